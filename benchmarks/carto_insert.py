@@ -0,0 +1,120 @@
+#!/usr/bin/env python
+"""Compares building Carto INSERT batches with SQLAlchemy literal_binds
+compilation, as the_el did before, against the direct SQL text builder.
+
+    python benchmarks/carto_insert.py --num-rows 20000
+"""
+
+import os
+import sys
+import json
+import time
+from datetime import datetime, date
+
+import click
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import literal_column
+from jsontableschema.exceptions import InvalidObjectType
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from the_el import carto
+from the_el.casting import RowCaster, is_missing
+
+table_schema = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'name', 'type': 'string'},
+        {'name': 'amount', 'type': 'number'},
+        {'name': 'created', 'type': 'datetime'},
+        {'name': 'day', 'type': 'date'},
+        {'name': 'tags', 'type': 'array'},
+        {'name': 'shape', 'type': 'geojson'}
+    ],
+    'missingValues': ['']
+}
+
+def generate_rows(num_rows):
+    for i in range(num_rows):
+        yield [
+            str(i),
+            "O'Brien {}".format(i) if i % 3 else '',
+            '{}.25'.format(i),
+            '2017-06-01T12:30:00Z',
+            '2017-06-01',
+            '["a", "b"]' if i % 2 else '',
+            '{{"type": "Point", "coordinates": [-75.16, 39.95, {}]}}'.format(i)
+        ]
+
+class LegacyCartoRowCaster(RowCaster):
+    """The literal_column based casting `carto.type_fields` used to do."""
+
+    def field_caster(self, field):
+        missing_values = self.missing_values
+        cast_value = field.cast_value
+
+        def cast(value):
+            if field.type == 'geojson':
+                if value == '' or value == 'NULL' or value == None:
+                    value = None
+                else:
+                    value = literal_column("ST_GeomFromGeoJSON('{}')".format(value))
+            elif field.type == 'array' or field.type == 'object':
+                if is_missing(value, missing_values):
+                    value = None
+                else:
+                    value = literal_column('\'' + value + '\'::jsonb')
+            else:
+                try:
+                    value = cast_value(value)
+                except InvalidObjectType:
+                    value = json.loads(value)
+
+            if isinstance(value, datetime):
+                value = literal_column("'" + value.strftime('%Y-%m-%d %H:%M:%S') + "'")
+            elif isinstance(value, date):
+                value = literal_column("'" + value.strftime('%Y-%m-%d') + "'")
+
+            if value is None:
+                value = literal_column('null')
+            return value
+
+        return cast
+
+def legacy_insert_sql(table, caster, batch):
+    statement = table.insert(values=[caster.cast_row(row) for row in batch])
+    return str(statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True}))
+
+def fast_insert_sql(sql_prefix, caster, batch):
+    return carto.get_insert_sql(sql_prefix, [caster.cast_row(row) for row in batch])
+
+def run(build, batches):
+    start = time.perf_counter()
+    num_bytes = 0
+    for batch in batches:
+        num_bytes += len(build(batch))
+    return time.perf_counter() - start, num_bytes
+
+@click.command()
+@click.option('--num-rows', type=int, default=20000)
+@click.option('--batch-size', type=int, default=500)
+def main(num_rows, batch_size):
+    table = carto.get_table('bench', table_schema)
+    rows = list(generate_rows(num_rows))
+    batches = [rows[i:i + batch_size] for i in range(0, num_rows, batch_size)]
+
+    legacy_caster = LegacyCartoRowCaster(table_schema)
+    legacy_seconds, legacy_bytes = run(lambda batch: legacy_insert_sql(table, legacy_caster, batch), batches)
+
+    caster = carto.CartoRowCaster(table_schema)
+    sql_prefix = carto.get_insert_sql_prefix(table)
+    fast_seconds, fast_bytes = run(lambda batch: fast_insert_sql(sql_prefix, caster, batch), batches)
+
+    click.echo('{:<24}{:>12}{:>14}{:>14}'.format('builder', 'seconds', 'rows/sec', 'bytes'))
+    for name, seconds, num_bytes in [('sqlalchemy literal_binds', legacy_seconds, legacy_bytes),
+                                     ('direct text builder', fast_seconds, fast_bytes)]:
+        click.echo('{:<24}{:>12.3f}{:>14.0f}{:>14}'.format(name, seconds, num_rows / seconds, num_bytes))
+    click.echo('speedup: {:.1f}x'.format(legacy_seconds / fast_seconds))
+
+if __name__ == '__main__':
+    main()
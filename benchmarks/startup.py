@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+"""Checks that `the_el --help` and each subcommand's `--help` start
+quickly, without importing backends or heavy dependencies.
+
+    python benchmarks/startup.py
+
+Each is run in a fresh interpreter. Backends and heavy dependencies, ie
+SQLAlchemy, are only imported by the commands using them, so printing help
+must not import any of `heavy_modules`. Exits 1 when one does, or when it
+takes more than `--max-ratio` times as long as starting a bare
+interpreter, measured in the same run so the check holds on any machine.
+"""
+
+import os
+import sys
+import json
+import time
+import subprocess
+
+import click
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+root_dir = os.path.dirname(benchmarks_dir)
+sys.path.insert(0, root_dir)
+
+from the_el.cli import main as the_el_main
+
+heavy_modules = [
+    'sqlalchemy',
+    'jsontableschema',
+    'jsontableschema_sql',
+    'smart_open',
+    'boto',
+    'boto3',
+    'requests',
+    'yaml',
+    'pyproj',
+    'pyarrow',
+    'zstandard'
+]
+
+## runs the CLI as the console script does, then reports which heavy modules it imported
+script = '''
+import sys, json
+heavy_modules = json.loads(sys.argv[2])
+sys.argv = ['the_el'] + json.loads(sys.argv[1])
+from the_el import main
+try:
+    main()
+except SystemExit:
+    pass
+sys.stderr.write(json.dumps([name for name in heavy_modules if name in sys.modules]) + '\\n')
+'''
+
+def run_python(args):
+    start = time.perf_counter()
+    result = subprocess.run([sys.executable] + args,
+                            cwd=root_dir,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True)
+    return time.perf_counter() - start, result.stderr
+
+def measure(args, repeat):
+    """Fastest of `repeat` runs of python with `args`, and the stderr of the last one."""
+    best_seconds = None
+    for i in range(repeat):
+        seconds, stderr = run_python(args)
+        if best_seconds is None or seconds < best_seconds:
+            best_seconds = seconds
+    return best_seconds, stderr
+
+@click.command()
+@click.option('--repeat', type=int, default=5, help='Runs per command, the fastest is kept')
+@click.option('--max-ratio', type=float, default=5.0,
+              help='Most times as long as a bare interpreter a command may take to start')
+def main(repeat, max_ratio):
+    interpreter_seconds, stderr = measure(['-c', 'pass'], repeat)
+
+    commands = [[]] + [[command] for command in sorted(the_el_main.commands)]
+
+    regressions = []
+    click.echo('{:<36}{:>14}{:>8}'.format('command', 'seconds', 'ratio'))
+    click.echo('{:<36}{:>14.3f}{:>8}'.format('python -c pass', interpreter_seconds, ''))
+    for command in commands:
+        args = command + ['--help']
+        name = ' '.join(['the_el'] + args)
+        seconds, stderr = measure(['-c', script, json.dumps(args), json.dumps(heavy_modules)], repeat)
+        ratio = seconds / interpreter_seconds
+
+        imported = json.loads(stderr.strip().splitlines()[-1])
+        if imported:
+            regressions.append('{} imported {}'.format(name, ', '.join(imported)))
+        if ratio > max_ratio:
+            regressions.append('{} took {:.1f} times as long as a bare interpreter to start, more than {:.1f}'.format(
+                name,
+                ratio,
+                max_ratio))
+        click.echo('{:<36}{:>14.3f}{:>8.1f}'.format(name, seconds, ratio))
+
+    if regressions:
+        for regression in regressions:
+            click.echo('REGRESSION: ' + regression, err=True)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,317 @@
+#!/usr/bin/env python
+"""Measures rows/sec and peak memory of the load and extract hot paths on
+synthetic inputs, and compares them against a stored baseline.
+
+    python benchmarks/suite.py --num-rows 20000
+    python benchmarks/suite.py --num-rows 20000 --save-baseline
+
+Runs offline. The Carto benchmark posts to the in-process fake Carto
+server, the Postgres COPY benchmark only runs when a local database is
+given with `--connection-string`, and the reprojection benchmarks only
+when pyproj is installed.
+
+Speed is compared relative to parsing the same synthetic CSV, the work
+every benchmark starts with, timed in runs alternating with the
+benchmark's own, so a baseline saved on one machine holds on another and
+under varying load. Exits 1 when a benchmark is slower relative to
+the reference, or uses more memory, than the baseline by more than
+`--tolerance`.
+"""
+
+import io
+import os
+import sys
+import csv
+import json
+import time
+import logging
+import statistics
+import tempfile
+import tracemalloc
+
+import click
+
+benchmarks_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, benchmarks_dir)
+sys.path.insert(0, os.path.dirname(benchmarks_dir))
+sys.path.insert(0, os.path.join(os.path.dirname(benchmarks_dir), 'tools'))
+
+from the_el import carto, postgres, formats, extract, geometry
+from the_el.casting import RowCaster
+
+import synthetic
+import fake_carto
+
+csv.field_size_limit(sys.maxsize)
+
+default_baseline_path = os.path.join(benchmarks_dir, 'baseline.json')
+
+logger = logging.getLogger('the_el.benchmarks')
+
+## peak memory growth below this is noise, not a regression
+memory_slack = 1024 * 1024
+
+class Context(object):
+    def __init__(self, schema_name, path, num_rows):
+        self.schema_name = schema_name
+        self.table_schema = synthetic.table_schemas[schema_name]
+        self.path = path
+        self.num_rows = num_rows
+        self.carto_creds = None
+        self.engine = None
+
+    def read_rows(self):
+        with open(self.path, newline='') as file:
+            rows = csv.reader(file)
+            next(rows)
+            for row in rows:
+                yield row
+
+    def typed_rows(self):
+        ## rows as a database driver returns them, for the read benchmarks
+        return list(RowCaster(self.table_schema).cast_rows(self.read_rows()))
+
+def bench_parse_csv(context):
+    def run():
+        num_rows = 0
+        for row in context.read_rows():
+            num_rows += 1
+        return num_rows
+    return run
+
+def bench_postgres_cast(context):
+    caster = postgres.CopyRowCaster(context.table_schema)
+    def run():
+        num_rows = 0
+        for row in caster.cast_rows(context.read_rows()):
+            num_rows += 1
+        return num_rows
+    return run
+
+def bench_postgres_copy_stream(context):
+    caster = postgres.CopyRowCaster(context.table_schema)
+    def run():
+        stream = postgres.CopyStream(caster.cast_rows(context.read_rows()))
+        while stream.read(postgres.copy_buffer_size):
+            pass
+        return context.num_rows
+    return run
+
+def bench_carto_insert_sql(context):
+    caster = carto.CartoRowCaster(context.table_schema)
+    sql_prefix = carto.get_insert_sql_prefix(carto.get_table('bench', context.table_schema))
+    def run():
+        num_rows = 0
+        for batch in caster.cast_batches(context.read_rows(), 500):
+            carto.get_insert_sql(sql_prefix, batch)
+            num_rows += len(batch)
+        return num_rows
+    return run
+
+def bench_carto_insert(context):
+    table = carto.get_table('bench', context.table_schema)
+    def run():
+        num_rows_expected, num_rows_inserted = carto.insert_rows(logger,
+                                                                 context.carto_creds,
+                                                                 table,
+                                                                 context.table_schema,
+                                                                 context.read_rows(),
+                                                                 500,
+                                                                 4)
+        return num_rows_inserted
+    return run
+
+def bench_postgres_copy_from(context):
+    table_name = 'the_el_bench_{}'.format(context.schema_name)
+    def run():
+        with context.engine.begin() as conn:
+            conn.execute('TRUNCATE TABLE {}'.format(table_name))
+        postgres.copy_from(context.engine, table_name, context.table_schema, context.read_rows())
+        return context.num_rows
+    return run
+
+def bench_read_output(output_format):
+    def bench(context):
+        rows = context.typed_rows()
+        def run():
+            output = formats.get_output(output_format, io.StringIO(), context.table_schema)
+            ## write_batch serializes nested values in place, so each run gets fresh rows
+            for batch in extract.iter_batches((list(row) for row in rows), 10000):
+                output.write_batch(batch)
+            output.close()
+            return len(rows)
+        return run
+    return bench
+
+def bench_reproject(batch_size):
+    ## batch_size 1 stands in for reprojecting geometry by geometry
+    def bench(context):
+        geometry_indexes = geometry.get_geometry_indexes(context.table_schema)
+        def run():
+            num_rows = 0
+            for row in geometry.reproject_rows(context.read_rows(), geometry_indexes, 4326, 2272, batch_size=batch_size):
+                num_rows += 1
+            return num_rows
+        return run
+    return bench
+
+benchmarks = [
+    ('postgres_cast', bench_postgres_cast),
+    ('postgres_copy_stream', bench_postgres_copy_stream),
+    ('postgres_copy_from', bench_postgres_copy_from),
+    ('carto_insert_sql', bench_carto_insert_sql),
+    ('carto_insert', bench_carto_insert),
+    ('read_csv', bench_read_output('csv')),
+    ('read_ndjson', bench_read_output('ndjson')),
+    ('reproject', bench_reproject(1000)),
+    ('reproject_per_geometry', bench_reproject(1))
+]
+
+def time_run(run):
+    start = time.perf_counter()
+    num_rows = run()
+    return num_rows, time.perf_counter() - start
+
+def measure(run, reference_run, repeat):
+    """Best rows/sec of `repeat` runs, and the median ratio of each run's
+    rows/sec to that of a `reference_run` just before it, then peak traced
+    memory of one more run.
+
+    Pairing each run with a reference run cancels out the machine's speed,
+    and the load on it at the time. Memory is traced in a separate run, as
+    tracing slows down allocation.
+    """
+    best_seconds = None
+    ratios = []
+    for i in range(repeat):
+        reference_rows, reference_seconds = time_run(reference_run)
+        num_rows, seconds = time_run(run)
+        ratios.append((num_rows / seconds) / (reference_rows / reference_seconds))
+        if best_seconds is None or seconds < best_seconds:
+            best_seconds = seconds
+
+    tracemalloc.start()
+    try:
+        run()
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'rows_per_sec': num_rows / best_seconds,
+        'relative_speed': statistics.median(ratios),
+        'peak_memory': peak_memory
+    }
+
+def compare(name, result, baseline, tolerance):
+    """Returns a list of regressions of `result` against `baseline`."""
+    regressions = []
+    if result['relative_speed'] < baseline['relative_speed'] * (1 - tolerance):
+        regressions.append('{} speed relative to parsing {:.3f} < baseline {:.3f}'.format(
+            name,
+            result['relative_speed'],
+            baseline['relative_speed']))
+    if (result['peak_memory'] > baseline['peak_memory'] * (1 + tolerance) and
+        result['peak_memory'] - baseline['peak_memory'] > memory_slack):
+        regressions.append('{} peak memory {} > baseline {}'.format(
+            name,
+            result['peak_memory'],
+            baseline['peak_memory']))
+    return regressions
+
+def create_bench_table(engine, schema_name, table_schema):
+    from jsontableschema_sql import Storage
+    table_name = 'the_el_bench_{}'.format(schema_name)
+    storage = Storage(engine=engine)
+    if table_name in storage.buckets:
+        storage.delete(table_name)
+    storage.create(table_name, table_schema)
+
+def format_change(value, baseline_value):
+    if baseline_value is None:
+        return ''
+    return '{:+.0%}'.format(value / baseline_value - 1)
+
+@click.command()
+@click.option('--num-rows', type=int, default=20000)
+@click.option('--repeat', type=int, default=7,
+              help='Runs per benchmark, the fastest rows/sec and the median relative speed are kept')
+@click.option('--schema', 'schema_names', multiple=True, type=click.Choice(sorted(synthetic.table_schemas)),
+              help='Synthetic table schemas to run, defaults to all')
+@click.option('--only', multiple=True, help='Benchmarks to run, defaults to all')
+@click.option('--connection-string', help='Local Postgres database for the postgres_copy_from benchmark')
+@click.option('--baseline', 'baseline_path', default=default_baseline_path)
+@click.option('--save-baseline', is_flag=True, help='Store these results as the baseline')
+@click.option('--tolerance', type=float, default=0.25, help='Fraction worse than the baseline counted as a regression')
+def main(num_rows, repeat, schema_names, only, connection_string, baseline_path, save_baseline, tolerance):
+    schema_names = schema_names or sorted(synthetic.table_schemas)
+
+    server, state, url = fake_carto.serve()
+    carto.carto_sql_api_url = url
+
+    engine = None
+    if connection_string:
+        from sqlalchemy import create_engine
+        engine = create_engine(connection_string)
+
+    baseline = {}
+    if not save_baseline and os.path.exists(baseline_path):
+        with open(baseline_path) as file:
+            baseline = json.load(file)
+        if baseline.get('num_rows') != num_rows:
+            click.echo('warning: baseline was measured with {} rows'.format(baseline.get('num_rows')), err=True)
+
+    results = {}
+    regressions = []
+    click.echo('{:<36}{:>14}{:>10}{:>8}{:>14}{:>8}'.format('benchmark', 'rows/sec', 'relative', '', 'peak MiB', ''))
+    with tempfile.TemporaryDirectory() as data_dir:
+        for schema_name in schema_names:
+            path = os.path.join(data_dir, schema_name + '.csv')
+            synthetic.write_csv(path, schema_name, num_rows)
+
+            context = Context(schema_name, path, num_rows)
+            context.carto_creds = (schema_name, 'key')
+            context.engine = engine
+
+            for bench_name, bench in benchmarks:
+                if only and bench_name not in only:
+                    continue
+                if bench_name.startswith('reproject') and not geometry.can_reproject():
+                    continue
+                if bench_name == 'postgres_copy_from':
+                    if engine is None:
+                        continue
+                    create_bench_table(engine, schema_name, context.table_schema)
+
+                name = '{}:{}'.format(schema_name, bench_name)
+                result = measure(bench(context), bench_parse_csv(context), repeat)
+                results[name] = result
+
+                baseline_result = baseline.get('results', {}).get(name)
+                if baseline_result:
+                    regressions += compare(name, result, baseline_result, tolerance)
+                click.echo('{:<36}{:>14.0f}{:>10.3f}{:>8}{:>14.1f}{:>8}'.format(
+                    name,
+                    result['rows_per_sec'],
+                    result['relative_speed'],
+                    format_change(result['relative_speed'], baseline_result and baseline_result['relative_speed']),
+                    result['peak_memory'] / (1024 * 1024),
+                    format_change(result['peak_memory'], baseline_result and baseline_result['peak_memory'])))
+
+    server.shutdown()
+
+    if save_baseline:
+        with open(baseline_path, 'w') as file:
+            ## rows/sec depend on the machine, so only the relative speed and memory are kept
+            saved_results = {name: {key: result[key] for key in ['relative_speed', 'peak_memory']}
+                             for name, result in results.items()}
+            json.dump({'num_rows': num_rows, 'results': saved_results}, file, indent=2, sort_keys=True)
+            file.write('\n')
+        click.echo('Saved baseline to {}'.format(baseline_path))
+    elif regressions:
+        for regression in regressions:
+            click.echo('REGRESSION: ' + regression, err=True)
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Synthetic CSV inputs for the benchmarks, generated from Table Schemas
+shaped like the tables the_el moves around.
+
+Values are drawn from a seeded random generator, so a given schema, row
+count and seed always produce the same file.
+"""
+
+import csv
+import json
+import random
+from datetime import date, datetime, timedelta
+
+table_schemas = {
+    ## wide, mixed types, polygons and nested values, ~10% missing values
+    'parcels': {
+        'fields': [
+            {'name': 'objectid', 'type': 'integer'},
+            {'name': 'parcel_number', 'type': 'string'},
+            {'name': 'address', 'type': 'string'},
+            {'name': 'owner', 'type': 'string'},
+            {'name': 'market_value', 'type': 'number'},
+            {'name': 'sale_date', 'type': 'date'},
+            {'name': 'updated_at', 'type': 'datetime'},
+            {'name': 'is_exempt', 'type': 'boolean'},
+            {'name': 'zoning', 'type': 'array'},
+            {'name': 'attributes', 'type': 'object'},
+            {'name': 'shape', 'type': 'geojson'}
+        ],
+        'primaryKey': ['objectid'],
+        'missingValues': ['']
+    },
+    ## narrow point layer
+    'waste_baskets': {
+        'fields': [
+            {'name': 'objectid', 'type': 'integer'},
+            {'name': 'status', 'type': 'string'},
+            {'name': 'installed', 'type': 'date'},
+            {'name': 'shape', 'type': 'geojson'}
+        ],
+        'primaryKey': ['objectid'],
+        'missingValues': ['']
+    }
+}
+
+streets = ['MARKET ST', 'CHESTNUT ST', 'BROAD ST', 'FRANKFORD AVE', 'GERMANTOWN AVE', "O'NEILL CT"]
+owners = ['CITY OF PHILA', 'SMITH JOHN', "O'BRIEN MARY", 'ACME HOLDINGS LLC', 'PHILA HOUSING AUTH']
+zoning_codes = ['RSA5', 'RM1', 'CMX2', 'CMX3', 'I2', 'SP-PO-A']
+statuses = ['active', 'removed', 'damaged']
+
+base_date = date(2000, 1, 1)
+base_datetime = datetime(2015, 1, 1)
+
+def point(rand):
+    return [round(-75.28 + rand.random() * 0.3, 6), round(39.87 + rand.random() * 0.25, 6)]
+
+def polygon(rand, num_vertices):
+    x, y = point(rand)
+    ring = [[round(x + rand.random() * 0.001, 6), round(y + rand.random() * 0.001, 6)]
+            for i in range(num_vertices)]
+    return {'type': 'Polygon', 'coordinates': [ring + [ring[0]]]}
+
+## geometries drawn for each schema's geojson fields
+geometry_types = {
+    'parcels': 'Polygon',
+    'waste_baskets': 'Point'
+}
+
+def field_value(rand, row_number, field, geometry_type):
+    name = field['name']
+    field_type = field['type']
+    if field_type == 'integer':
+        return str(row_number)
+    elif name == 'parcel_number':
+        return '{:09d}'.format(rand.randint(0, 999999999))
+    elif name == 'address':
+        return '{} {}'.format(rand.randint(1, 9999), rand.choice(streets))
+    elif name == 'owner':
+        return rand.choice(owners)
+    elif name == 'status':
+        return rand.choice(statuses)
+    elif field_type == 'string':
+        return 'value {}'.format(row_number)
+    elif field_type == 'number':
+        return '{:.2f}'.format(rand.random() * 1000000)
+    elif field_type == 'date':
+        return (base_date + timedelta(days=rand.randint(0, 6000))).isoformat()
+    elif field_type == 'datetime':
+        return (base_datetime + timedelta(seconds=rand.randint(0, 10 ** 8))).strftime('%Y-%m-%dT%H:%M:%SZ')
+    elif field_type == 'boolean':
+        return rand.choice(['true', 'false'])
+    elif field_type == 'array':
+        return json.dumps(rand.sample(zoning_codes, rand.randint(1, 3)))
+    elif field_type == 'object':
+        return json.dumps({'units': rand.randint(1, 12), 'source': rand.choice(['opa', 'dor'])})
+    elif field_type == 'geojson':
+        if geometry_type == 'Polygon':
+            return json.dumps(polygon(rand, rand.randint(4, 24)))
+        return json.dumps({'type': 'Point', 'coordinates': point(rand)})
+    raise Exception('No synthetic values for field type `{}`'.format(field_type))
+
+def generate_rows(schema_name, num_rows, seed=0, missing_rate=0.1):
+    """Yields rows of CSV text values, with `missing_rate` of non key values left empty."""
+    rand = random.Random(seed)
+    table_schema = table_schemas[schema_name]
+    geometry_type = geometry_types[schema_name]
+    primary_keys = table_schema.get('primaryKey', [])
+    for row_number in range(1, num_rows + 1):
+        row = []
+        for field in table_schema['fields']:
+            if field['name'] not in primary_keys and rand.random() < missing_rate:
+                row.append('')
+            else:
+                row.append(field_value(rand, row_number, field, geometry_type))
+        yield row
+
+def write_csv(path, schema_name, num_rows, seed=0, missing_rate=0.1):
+    with open(path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow([field['name'] for field in table_schemas[schema_name]['fields']])
+        writer.writerows(generate_rows(schema_name, num_rows, seed=seed, missing_rate=missing_rate))
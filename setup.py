@@ -18,7 +18,9 @@ setup(
         'oracle': ['cx-Oracle==5.3'],
         'mssql': ['pymssql==2.1.3'],
         'postgis': ['GeoAlchemy2==0.4.0'],
-        'oracle_sde': ['pyproj==1.9.5.1', 'Shapely==1.5.17.post1']
+        'oracle_sde': ['pyproj==1.9.5.1', 'Shapely==1.5.17.post1'],
+        'arrow': ['pyarrow>=0.8.0'],
+        'zstd': ['zstandard>=0.9.0']
     },
     dependency_links=[
         'https://github.com/CityOfPhiladelphia/jsontableschema-sql-py/tarball/master#egg=jsontableschema_sql-0.8.0'
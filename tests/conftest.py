@@ -0,0 +1,89 @@
+import os
+import sys
+import json
+
+import pytest
+
+tests_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(tests_dir))
+sys.path.insert(0, os.path.join(os.path.dirname(tests_dir), 'tools'))
+sys.path.insert(0, os.path.join(os.path.dirname(tests_dir), 'benchmarks'))
+
+import fake_carto
+
+@pytest.fixture
+def carto_server():
+    """Starts a fake Carto SQL API for one test, returning its `FakeCarto` state."""
+    from the_el import carto
+
+    servers = []
+    def serve(**kwargs):
+        server, state, url = fake_carto.serve(**kwargs)
+        servers.append(server)
+        carto.carto_sql_api_url = url
+        return state
+
+    original_url = carto.carto_sql_api_url
+    yield serve
+    carto.carto_sql_api_url = original_url
+    for server in servers:
+        server.shutdown()
+
+@pytest.fixture
+def postgres_connection_string():
+    """A scratch Postgres database, from `THE_EL_TEST_POSTGRES`, ie postgresql://localhost/the_el_test."""
+    connection_string = os.getenv('THE_EL_TEST_POSTGRES')
+    if connection_string == None:
+        pytest.skip('THE_EL_TEST_POSTGRES not set')
+    return connection_string
+
+def write_json(path, value):
+    with open(str(path), 'w') as file:
+        json.dump(value, file)
+    return str(path)
+
+def write_csv(path, header, rows):
+    import csv
+    with open(str(path), 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(header)
+        writer.writerows(rows)
+    return str(path)
+
+class RecordingCursor(object):
+    def __init__(self, calls):
+        self.calls = calls
+
+    def __getattr__(self, name):
+        ## execute, executemany, setinputsizes and close are recorded with their arguments
+        def call(*args):
+            self.calls.append((name,) + args)
+        return call
+
+class RecordingConnection(object):
+    """Stands in for a DB-API connection, recording the calls made on it and its cursors."""
+
+    def __init__(self):
+        self.calls = []
+
+    def cursor(self):
+        return RecordingCursor(self.calls)
+
+    def commit(self):
+        self.calls.append(('commit',))
+
+    def rollback(self):
+        self.calls.append(('rollback',))
+
+    def close(self):
+        self.calls.append(('close',))
+
+class RecordingEngine(object):
+    """Stands in for an engine of `dialect`, its raw connection a `RecordingConnection`."""
+
+    def __init__(self, dialect):
+        self.dialect = dialect
+        self.conn = RecordingConnection()
+
+    def raw_connection(self):
+        return self.conn
@@ -0,0 +1,182 @@
+import os
+import json
+
+from click.testing import CliRunner
+
+from the_el.cli import main
+from conftest import write_json, write_csv
+
+table_schema = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'name', 'type': 'string'}
+    ]
+}
+
+def write_args(tmpdir, num_rows):
+    schema_path = write_json(tmpdir.join('schema.json'), table_schema)
+    input_path = write_csv(tmpdir.join('input.csv'), ['id', 'name'],
+                           [[i, 'name {}'.format(i)] for i in range(num_rows)])
+    return ['write', 'things',
+            '--connection-string', 'carto://user:key',
+            '--table-schema-path', schema_path,
+            '--input-file', input_path,
+            '--skip-headers',
+            '--truncate',
+            '--checkpoint-file', str(tmpdir.join('checkpoint.json'))]
+
+def test_resume_after_failed_middle_batch(tmpdir, carto_server):
+    carto = carto_server(fail_inserts=[2])
+    args = write_args(tmpdir, 1234)
+
+    result = CliRunner().invoke(main, args)
+    assert result.exit_code != 0
+    assert carto.tables['things'] == 500
+    with open(str(tmpdir.join('checkpoint.json'))) as file:
+        assert json.load(file)['rows'] == 500
+
+    result = CliRunner().invoke(main, args + ['--resume'])
+    assert result.exit_code == 0, result.output
+    assert carto.tables['things'] == 1234
+    assert not os.path.exists(str(tmpdir.join('checkpoint.json')))
+
+def test_resume_requires_a_checkpoint(tmpdir, carto_server):
+    carto = carto_server()
+    args = write_args(tmpdir, 10)
+
+    result = CliRunner().invoke(main, args[:-2] + ['--resume'])
+    assert result.exit_code != 0
+    assert '--checkpoint-file' in str(result.exception)
+
+    ## nothing to resume from, the load is not started over
+    result = CliRunner().invoke(main, args + ['--resume'])
+    assert result.exit_code != 0
+    assert 'No checkpoint' in str(result.exception)
+    assert 'things' not in carto.tables
+    assert not any(statement.startswith('TRUNCATE') for statement in carto.statements)
+
+def test_resume_rejects_checkpoint_of_another_load(tmpdir, carto_server):
+    carto = carto_server(fail_inserts=[1])
+    args = write_args(tmpdir, 10)
+
+    result = CliRunner().invoke(main, args)
+    assert result.exit_code != 0
+
+    other_args = list(args)
+    other_args[1] = 'other_things'
+    result = CliRunner().invoke(main, other_args + ['--resume'])
+    assert result.exit_code != 0
+    assert 'is for loading' in str(result.exception)
+
+def test_checkpoint_rejects_concurrency(tmpdir, carto_server):
+    carto = carto_server()
+    args = write_args(tmpdir, 10)
+
+    result = CliRunner().invoke(main, args + ['--concurrency', '4'])
+    assert result.exit_code != 0
+    assert '--concurrency' in str(result.exception)
+    assert 'things' not in carto.tables
+
+def test_copy_loads_the_same_rows_as_insert(tmpdir, carto_server):
+    carto = carto_server(keep_rows=True)
+    schema_path = write_json(tmpdir.join('schema.json'), {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+            {'name': 'amount', 'type': 'number'},
+            {'name': 'day', 'type': 'date'},
+            {'name': 'attrs', 'type': 'object'}
+        ]
+    })
+    input_path = write_csv(tmpdir.join('input.csv'), ['id', 'name', 'amount', 'day', 'attrs'], [
+        [1, '', '1.5', '2017-06-01', '{"a": 1}'],
+        [2, 'None', '', '', '{"b": "it\'s"}'],
+        [3, '\\N', '-2', '2017-06-02', '{}'],
+        [4, 'comma, "quotes"\nand a newline', '0', '', '[1, 2]']
+    ])
+
+    for table_name, options in [('inserted', []), ('copied', ['--carto-copy'])]:
+        result = CliRunner().invoke(main, ['write', table_name,
+                                           '--connection-string', 'carto://user:key',
+                                           '--table-schema-path', schema_path,
+                                           '--input-file', input_path,
+                                           '--skip-headers'] + options)
+        assert result.exit_code == 0, result.output
+
+    assert carto.rows['inserted'][0][1] == ''
+    assert carto.rows['inserted'][1][2] == None
+    assert carto.rows['copied'] == carto.rows['inserted']
+
+def test_transfer_converts_source_types(tmpdir, carto_server):
+    from datetime import date
+    from sqlalchemy import create_engine
+    from jsontableschema_sql import Storage
+
+    carto = carto_server(keep_rows=True)
+    source_connection_string = 'sqlite:///{}?check_same_thread=false'.format(tmpdir.join('source.db'))
+    source = Storage(create_engine(source_connection_string))
+    source.create('things', {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'day', 'type': 'date'},
+            {'name': 'code', 'type': 'integer'},
+            {'name': 'amount', 'type': 'number'}
+        ]
+    })
+    source.write('things', [[1, date(2017, 6, 1), 19104, 3], [2, None, 0, 2.0]])
+
+    schema_path = write_json(tmpdir.join('schema.json'), {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'day', 'type': 'datetime'},
+            {'name': 'code', 'type': 'string'},
+            {'name': 'amount', 'type': 'integer'}
+        ]
+    })
+
+    for table_name, options in [('inserted', []), ('copied', ['--carto-copy'])]:
+        result = CliRunner().invoke(main, ['transfer', 'things', table_name,
+                                           '--source-connection-string', source_connection_string,
+                                           '--connection-string', 'carto://user:key',
+                                           '--table-schema-path', schema_path] + options)
+        assert result.exit_code == 0, result.output
+
+    assert carto.rows['inserted'] == [['1', '2017-06-01 00:00:00', '19104', '3'],
+                                      ['2', None, '0', '2']]
+    assert carto.rows['copied'] == carto.rows['inserted']
+
+def test_caster_geometry_missing_values():
+    from the_el import carto
+
+    schema = {'fields': [{'name': 'shape', 'type': 'geojson'}], 'missingValues': ['', 'NA']}
+    assert carto.CartoRowCaster(schema).cast_row(['NA']) == ['null']
+    assert carto.CartoCopyRowCaster(schema).cast_row(['NA']) == [None]
+
+def test_create_index_sql():
+    from the_el import carto
+
+    assert carto.get_create_index_sql('things', 'name') == \
+        'CREATE INDEX IF NOT EXISTS things_name ON "things" ("name");\n'
+
+def test_write_builds_indexes_after_loading(tmpdir, carto_server):
+    carto = carto_server()
+    args = write_args(tmpdir, 10)[:-2] + ['--indexes-fields', 'id,name']
+
+    result = CliRunner().invoke(main, args + ['--index-concurrency', '1'])
+    assert result.exit_code == 0, result.output
+
+    ## one request building every index, after the rows are loaded and before the table is vacuumed
+    index_statements = [statement for statement in carto.statements if 'CREATE INDEX' in statement]
+    assert index_statements == ['CREATE INDEX IF NOT EXISTS things_id ON "things" ("id");\n' +
+                                'CREATE INDEX IF NOT EXISTS things_name ON "things" ("name");\n']
+    index = carto.statements.index(index_statements[0])
+    assert any(statement.startswith('INSERT') for statement in carto.statements[:index])
+    assert any(statement.startswith('VACUUM') for statement in carto.statements[index:])
+
+    ## with concurrency, a request per index
+    del carto.statements[:]
+    result = CliRunner().invoke(main, args + ['--index-concurrency', '2'])
+    assert result.exit_code == 0, result.output
+    assert sorted([statement for statement in carto.statements if 'CREATE INDEX' in statement]) == \
+        ['CREATE INDEX IF NOT EXISTS things_id ON "things" ("id");\n',
+         'CREATE INDEX IF NOT EXISTS things_name ON "things" ("name");\n']
@@ -0,0 +1,144 @@
+import json
+from datetime import date, datetime
+
+import pytest
+import jsontableschema
+from jsontableschema.exceptions import InvalidObjectType
+from sqlalchemy import literal
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import literal_column
+from sqlalchemy.sql.elements import ColumnClause
+
+from the_el.casting import RowCaster
+from the_el.carto import CartoRowCaster
+
+## The per cell `type_fields` functions RowCaster and CartoRowCaster replaced, kept as references
+## the casters must agree with.
+
+def postgres_type_fields(schema, row):
+    missing_values = []
+    if 'missingValues' in schema._Schema__descriptor:
+        missing_values = schema._Schema__descriptor['missingValues']
+
+    typed_row = []
+    for index, field in enumerate(schema.fields):
+        value = row[index]
+
+        if value in missing_values:
+                value = None
+        elif field.type != 'geojson':
+            try:
+                value = field.cast_value(value)
+            except InvalidObjectType:
+                value = json.loads(value)
+
+        typed_row.append(value)
+
+    return typed_row
+
+def carto_type_fields(schema, row):
+    missing_values = []
+    if 'missingValues' in schema._Schema__descriptor:
+        missing_values = schema._Schema__descriptor['missingValues']
+
+    typed_row = []
+    for index, field in enumerate(schema.fields):
+        value = row[index]
+        if field.type == 'geojson':
+            if value == '' or value == 'NULL' or value == None:
+                value = None
+            else:
+                value = literal_column("ST_GeomFromGeoJSON('{}')".format(value))
+        elif field.type == 'string' and 'None' not in missing_values and value == 'None':
+            value = 'None'
+        elif field.type == 'string' and value.lower() == 'nan':
+            value = value # HACK: tableschema-py 1.0 fixes this but is not released yet
+        elif field.type == 'array' or field.type == 'object':
+            if value in missing_values:
+                value = None
+            else:
+                value = literal_column('\'' + value + '\'::jsonb')
+        else:
+            try:
+                value = field.cast_value(value)
+            except InvalidObjectType:
+                value = json.loads(value)
+
+        if isinstance(value, datetime):
+            value = literal_column("'" + value.strftime('%Y-%m-%d %H:%M:%S') + "'")
+        elif isinstance(value, date):
+            value = literal_column("'" + value.strftime('%Y-%m-%d') + "'")
+
+        if value is None:
+            value = literal_column('null')
+
+        typed_row.append(value)
+
+    return typed_row
+
+def compile_literal(value):
+    """The SQL the old Carto INSERTs rendered a value of `carto_type_fields` as."""
+    if isinstance(value, ColumnClause):
+        return str(value)
+    return str(literal(value).compile(dialect=postgresql.dialect(), compile_kwargs={'literal_binds': True}))
+
+table_schema = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'amount', 'type': 'number'},
+        {'name': 'active', 'type': 'boolean'},
+        {'name': 'day', 'type': 'date'},
+        {'name': 'at', 'type': 'datetime', 'format': 'any'},
+        {'name': 'name', 'type': 'string'},
+        {'name': 'attrs', 'type': 'object'},
+        {'name': 'tags', 'type': 'array'},
+        {'name': 'shape', 'type': 'geojson'}
+    ],
+    'missingValues': ['', 'NA']
+}
+
+## rows as read from csv
+rows = [
+    ['1', '1.5', 'true', '2017-06-01', '2017-06-01T12:30:15', 'a', '{"a": 1, "b": [1, 2]}', '["x", "y"]',
+     '{"type": "Point", "coordinates": [1, 2]}'],
+    ['-20', '3', 'false', '1999-12-31', '2017-06-01 00:00:00', "it's", '{}', '[]', 'NULL'],
+    ['0', '-0.25', 'True', '2017-01-01', '2017-06-01T12:30:15Z', 'None', '{"nested": {"a": null}}', '[1, [2]]', ''],
+    ['3', '1e3', 'FALSE', '2017-06-01', '2017-06-01T12:30:15', 'NaN', '{"a": "b"}', '["a"]',
+     '{"type": "LineString", "coordinates": [[0, 0], [1, 1]]}'],
+    ['', 'NA', '', 'NA', '', '', '', 'NA', 'NULL'],
+    ['4', '1000000.000001', '1', '2000-02-29', '2000-02-29 23:59:59', '  spaced  ', 'NA', '', '']
+]
+
+def cast_or_error(cast, row):
+    try:
+        return cast(row)
+    except Exception as e:
+        return type(e)
+
+## Geometries in missingValues, other than '' and 'NULL', are left out, as the Carto casters now
+## load them as null where `carto_type_fields` sent them to ST_GeomFromGeoJSON.
+
+@pytest.mark.parametrize('row', rows)
+def test_row_caster_matches_type_fields(row):
+    schema = jsontableschema.Schema(table_schema)
+    assert cast_or_error(RowCaster(table_schema).cast_row, row) == \
+        cast_or_error(lambda row: postgres_type_fields(schema, row), row)
+
+@pytest.mark.parametrize('row', rows)
+def test_carto_row_caster_matches_type_fields(row):
+    schema = jsontableschema.Schema(table_schema)
+    ## both fail on missingValues other than '' in scalar fields, as jsontableschema casts them
+    assert cast_or_error(CartoRowCaster(table_schema).cast_row, row) == \
+        cast_or_error(lambda row: [compile_literal(value) for value in carto_type_fields(schema, row)], row)
+
+def test_row_caster_without_missing_values():
+    descriptor = {'fields': [field for field in table_schema['fields'] if field['type'] in ['string', 'geojson']]}
+    schema = jsontableschema.Schema(descriptor)
+    for row in [['', ''], ['None', 'NULL'], ['NA', '{"type": "Point", "coordinates": []}']]:
+        assert RowCaster(descriptor).cast_row(row) == postgres_type_fields(schema, row)
+        assert CartoRowCaster(descriptor).cast_row(row) == \
+            [compile_literal(value) for value in carto_type_fields(schema, row)]
+
+def test_row_caster_rejects_short_rows():
+    with pytest.raises(IndexError):
+        RowCaster(table_schema).cast_row(['1', '1.5'])
@@ -0,0 +1,210 @@
+import json
+import logging
+from datetime import date, datetime
+from decimal import Decimal
+
+import pytest
+from click.testing import CliRunner
+from sqlalchemy import create_engine
+from sqlalchemy.pool import QueuePool
+from jsontableschema_sql import Storage
+
+from the_el import extract
+from the_el.cli import main
+
+logger = logging.getLogger('the_el')
+
+descriptor = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'name', 'type': 'string'}
+    ],
+    'primaryKey': 'id'
+}
+
+@pytest.fixture
+def engine(tmpdir):
+    engine = create_engine('sqlite:///{}?check_same_thread=false'.format(tmpdir.join('test.db')),
+                           poolclass=QueuePool,
+                           pool_size=2,
+                           max_overflow=1)
+    storage = Storage(engine)
+    storage.create('things', descriptor)
+    storage.write('things', [[i, 'name {}'.format(i)] for i in range(1000)])
+    yield engine
+    engine.dispose()
+
+def test_parallel_batches_in_partition_order(engine):
+    assert extract.get_max_connections(engine) == 3
+
+    batches = extract.parallel_iter_batches(logger, engine, Storage(engine), 'things', descriptor, 8,
+                                            fetch_size=10)
+
+    ids = [row[0] for batch in batches for row in batch]
+    assert ids == list(range(1000))
+
+def test_parallel_batches_stop_with_consumer(engine, monkeypatch):
+    num_batches = [0]
+    iter_batches = extract.iter_batches
+    def counted_batches(rows, batch_size):
+        for batch in iter_batches(rows, batch_size):
+            num_batches[0] += 1
+            yield batch
+    monkeypatch.setattr(extract, 'iter_batches', counted_batches)
+
+    batches = extract.parallel_iter_batches(logger, engine, Storage(engine), 'things', descriptor, 3,
+                                            fetch_size=1, queue_size=1)
+    next(batches)
+    batches.close()
+
+    ## each partition stops a few batches past its queue, rather than fetching its whole range
+    assert num_batches[0] < 20
+
+@pytest.mark.parametrize('value, value_type', [
+    (datetime(2017, 6, 1, 12, 30, 15, 250), 'datetime'),
+    (date(2017, 6, 1), 'date'),
+    (Decimal('10.25'), 'decimal'),
+    (42, 'number'),
+    (1.5, 'number'),
+    ('b', 'string')
+])
+def test_watermark_round_trip(value, value_type):
+    watermark = extract.encode_watermark('updated', value)
+    assert watermark['column'] == 'updated'
+    assert watermark['type'] == value_type
+    ## saved as JSON in the state file
+    assert extract.decode_watermark(json.loads(json.dumps(watermark))) == value
+
+def test_since_condition(engine):
+    table = extract.get_storage_table(Storage(engine), 'things')
+
+    condition = extract.get_since_condition(table, 'id', None, 10)
+    assert str(condition) == 'things.id <= :id_1'
+
+    condition = extract.get_since_condition(table, 'id', 5, 10)
+    assert str(condition) == 'things.id > :id_1 AND things.id <= :id_2'
+
+    assert extract.get_high_water_mark(engine, table, 'id') == 999
+    assert extract.get_high_water_mark(engine, table, 'id', since=999) is None
+
+def read_since(connection_string, state_path, output_path):
+    result = CliRunner().invoke(main, ['read', 'events',
+                                       '--connection-string', connection_string,
+                                       '--output-file', output_path,
+                                       '--since-column', 'updated',
+                                       '--state-file', state_path])
+    assert result.exit_code == 0, result.output
+    with open(output_path) as file:
+        return file.read().splitlines()
+
+def test_read_since_watermark(tmpdir):
+    connection_string = 'sqlite:///{}'.format(tmpdir.join('events.db'))
+    storage = Storage(create_engine(connection_string))
+    storage.create('events', {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'updated', 'type': 'integer'}
+        ]
+    })
+    storage.write('events', [[1, 10], [2, 20]])
+    state_path = str(tmpdir.join('state.json'))
+    output_path = str(tmpdir.join('events.csv'))
+
+    assert read_since(connection_string, state_path, output_path) == ['id,updated', '1,10', '2,20']
+    with open(state_path) as file:
+        assert json.load(file) == {'events': {'column': 'updated', 'type': 'number', 'value': 20}}
+
+    ## only rows past the saved mark, and none when there are no new rows
+    storage.write('events', [[3, 30], [1, 15]])
+    assert read_since(connection_string, state_path, output_path) == ['id,updated', '3,30']
+    assert read_since(connection_string, state_path, output_path) == ['id,updated']
+    with open(state_path) as file:
+        assert json.load(file)['events']['value'] == 30
+
+def test_read_since_requires_state_file(tmpdir):
+    result = CliRunner().invoke(main, ['read', 'events',
+                                       '--connection-string', 'sqlite:///{}'.format(tmpdir.join('events.db')),
+                                       '--since-column', 'updated'])
+    assert result.exit_code != 0
+    assert '`--state-file` required' in str(result.exception)
+
+def test_project_descriptor():
+    table_descriptor = {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+            {'name': 'owner_id', 'type': 'integer'}
+        ],
+        'primaryKey': 'id',
+        'foreignKeys': [
+            {'fields': 'owner_id', 'reference': {'resource': 'owners', 'fields': 'id'}},
+            {'fields': ['id', 'name'], 'reference': {'resource': 'others', 'fields': ['id', 'name']}}
+        ]
+    }
+
+    projected = extract.project_descriptor(table_descriptor, ['NAME', 'id'])
+    assert projected['fields'] == [{'name': 'name', 'type': 'string'}, {'name': 'id', 'type': 'integer'}]
+    assert projected['primaryKey'] == 'id'
+    assert projected['foreignKeys'] == [table_descriptor['foreignKeys'][1]]
+
+    ## keys on columns left out are dropped, and the table's descriptor is unchanged
+    projected = extract.project_descriptor(table_descriptor, ['owner_id'])
+    assert 'primaryKey' not in projected
+    assert projected['foreignKeys'] == [table_descriptor['foreignKeys'][0]]
+    assert len(table_descriptor['fields']) == 3
+    assert table_descriptor['primaryKey'] == 'id'
+
+    with pytest.raises(Exception) as e:
+        extract.project_descriptor(table_descriptor, ['id', 'missing'])
+    assert 'missing' in str(e.value)
+
+def test_select(engine):
+    from sqlalchemy import text
+
+    table = extract.get_storage_table(Storage(engine), 'things')
+
+    statement = extract.get_select(table)
+    assert list(map(list, engine.execute(statement)))[:2] == [[0, 'name 0'], [1, 'name 1']]
+
+    statement = extract.get_select(table,
+                                   columns=['name', 'ID'],
+                                   condition=text('id % 100 = 0'),
+                                   order_by='id DESC',
+                                   limit=3)
+    assert list(map(list, engine.execute(statement))) == [['name 900', 900], ['name 800', 800], ['name 700', 700]]
+
+def test_read_pushdown(engine, tmpdir):
+    connection_string = str(engine.url)
+    output_path = str(tmpdir.join('things.csv'))
+
+    result = CliRunner().invoke(main, ['read', 'things',
+                                       '--connection-string', connection_string,
+                                       '--output-file', output_path,
+                                       '--output-format', 'ndjson',
+                                       '--columns', 'name,id',
+                                       '--where', "name LIKE 'name 9%'",
+                                       '--order-by', 'id DESC',
+                                       '--limit', '2'])
+    assert result.exit_code == 0, result.output
+    with open(output_path) as file:
+        assert [json.loads(line) for line in file] == [{'name': 'name 999', 'id': 999},
+                                                       {'name': 'name 998', 'id': 998}]
+
+    ## partitions are read with the same projection and filter
+    result = CliRunner().invoke(main, ['read', 'things',
+                                       '--connection-string', connection_string,
+                                       '--output-file', output_path,
+                                       '--columns', 'id',
+                                       '--where', 'id < 10',
+                                       '--parallel', '2'])
+    assert result.exit_code == 0, result.output
+    with open(output_path) as file:
+        assert file.read().splitlines() == ['id'] + [str(i) for i in range(10)]
+
+def test_read_parallel_rejects_limit(engine):
+    result = CliRunner().invoke(main, ['read', 'things',
+                                       '--connection-string', str(engine.url),
+                                       '--limit', '10',
+                                       '--parallel', '2'])
+    assert result.exit_code != 0
+    assert '`--limit` are not supported with `--parallel`' in str(result.exception)
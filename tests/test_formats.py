@@ -0,0 +1,190 @@
+import io
+import csv
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import pytest
+
+from the_el import formats
+from the_el.casting import RowCaster
+
+table_schema = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'name', 'type': 'string'}
+    ]
+}
+
+rows = [[1, 'a'], [2, None]]
+
+class Unseekable(io.RawIOBase):
+    """Reads `data` as stdin or a streamed S3 object would, without seeking."""
+
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return False
+
+    def readinto(self, buffer):
+        data = self.data.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+## every field type, with rows as database drivers return them
+typed_schema = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'amount', 'type': 'number'},
+        {'name': 'active', 'type': 'boolean'},
+        {'name': 'day', 'type': 'date'},
+        {'name': 'at', 'type': 'datetime'},
+        {'name': 'opens', 'type': 'time'},
+        {'name': 'name', 'type': 'string'},
+        {'name': 'attrs', 'type': 'object'},
+        {'name': 'tags', 'type': 'array'}
+    ]
+}
+
+def get_typed_rows():
+    return [
+        [1, Decimal('1.5'), True, date(2017, 6, 1), datetime(2017, 6, 1, 12, 30, 15), time(8, 0),
+         'comma, "quotes"\nand a newline', {'a': 1, 'b': [1, 2]}, ['x', 'y']],
+        [2, None, None, None, None, None, None, None, None]
+    ]
+
+def write_output(output_format, batches, descriptor=table_schema):
+    file = io.BytesIO() if output_format in formats.binary_output_formats else io.StringIO()
+    output = formats.get_output(output_format, file, descriptor)
+    for batch in batches:
+        output.write_batch(batch)
+    output.close()
+    return file.getvalue()
+
+def test_csv_output():
+    data = write_output('csv', [get_typed_rows()], typed_schema)
+    rows = list(csv.reader(io.StringIO(data)))
+    assert rows[0] == [field['name'] for field in typed_schema['fields']]
+    assert rows[1] == ['1', '1.5', 'True', '2017-06-01', '2017-06-01 12:30:15', '08:00:00',
+                       'comma, "quotes"\nand a newline', '{"a": 1, "b": [1, 2]}', '["x", "y"]']
+    assert rows[2] == ['2'] + [''] * 8
+
+def test_ndjson_output():
+    data = write_output('ndjson', [get_typed_rows()[:1], get_typed_rows()[1:]], typed_schema)
+    records = [json.loads(line) for line in data.splitlines()]
+    assert records == [
+        {'id': 1, 'amount': 1.5, 'active': True, 'day': '2017-06-01', 'at': '2017-06-01T12:30:15',
+         'opens': '08:00:00', 'name': 'comma, "quotes"\nand a newline', 'attrs': {'a': 1, 'b': [1, 2]},
+         'tags': ['x', 'y']},
+        dict([(field['name'], None) for field in typed_schema['fields']], id=2)
+    ]
+
+@pytest.mark.parametrize('output_format', ['arrow', 'parquet'])
+def test_columnar_output(output_format):
+    pa = pytest.importorskip('pyarrow')
+    import pyarrow.parquet
+
+    ## one record batch, or row group, per fetched batch
+    data = write_output(output_format, [get_typed_rows()[:1], get_typed_rows()[1:]], typed_schema)
+    if output_format == 'arrow':
+        reader = pa.ipc.open_file(pa.BufferReader(data))
+        assert reader.num_record_batches == 2
+        table = reader.read_all()
+    else:
+        parquet_file = pyarrow.parquet.ParquetFile(pa.BufferReader(data))
+        assert parquet_file.num_row_groups == 2
+        table = parquet_file.read()
+
+    assert [str(field.type) for field in table.schema] == \
+        ['int64', 'double', 'bool', 'date32[day]', 'timestamp[us]', 'time64[us]', 'string', 'string', 'string']
+    assert table.to_pylist() == [
+        {'id': 1, 'amount': 1.5, 'active': True, 'day': date(2017, 6, 1), 'at': datetime(2017, 6, 1, 12, 30, 15),
+         'opens': time(8, 0), 'name': 'comma, "quotes"\nand a newline', 'attrs': '{"a": 1, "b": [1, 2]}',
+         'tags': '["x", "y"]'},
+        dict([(field['name'], None) for field in typed_schema['fields']], id=2)
+    ]
+
+def test_unknown_output_format():
+    with pytest.raises(Exception) as e:
+        formats.get_output('xml', io.StringIO(), table_schema)
+    assert 'xml' in str(e.value)
+
+@pytest.mark.parametrize('input_format', ['arrow', 'parquet'])
+def test_columnar_input_without_seeking(input_format):
+    pytest.importorskip('pyarrow')
+
+    data = write_output(input_format, [[list(row) for row in rows]])
+    assert list(formats.read_rows(input_format, Unseekable(data), table_schema)) == [[1, 'a'], [2, None]]
+
+def test_arrow_stream_input():
+    pa = pytest.importorskip('pyarrow')
+
+    file = io.BytesIO()
+    schema = pa.schema([('id', pa.int64()), ('name', pa.string())])
+    with pa.ipc.new_stream(file, schema) as writer:
+        writer.write_batch(pa.RecordBatch.from_arrays([pa.array([1, 2]), pa.array(['a', None])], schema=schema))
+
+    assert list(formats.read_rows('arrow', Unseekable(file.getvalue()), table_schema)) == [[1, 'a'], [2, None]]
+
+## naive datetimes are written without the UTC `Z` the default datetime format requires
+text_schema = {
+    'fields': [dict(field, format='any') if field['type'] == 'datetime' else field
+               for field in typed_schema['fields']]
+}
+
+@pytest.mark.parametrize('input_format', formats.input_formats)
+def test_input_round_trip(input_format):
+    if input_format in formats.binary_input_formats:
+        pytest.importorskip('pyarrow')
+        file = io.BytesIO(write_output(input_format, [get_typed_rows()], typed_schema))
+    else:
+        file = io.StringIO(write_output(input_format, [get_typed_rows()], typed_schema))
+
+    rows = formats.read_rows(input_format, file, text_schema)
+    if input_format == 'csv':
+        assert next(rows) == [field['name'] for field in typed_schema['fields']]
+
+    expected = get_typed_rows()
+    if input_format == 'csv':
+        ## csv can not tell an empty string from a null
+        expected[1][6] = ''
+    assert list(RowCaster(text_schema).cast_rows(rows)) == expected
+
+def test_csv_input_dialect():
+    file = io.StringIO("1;'a;b'\n2;'it''s'\n")
+    assert list(formats.read_rows('csv', file, table_schema, delimiter=';', quotechar="'")) == \
+        [['1', 'a;b'], ['2', "it's"]]
+
+def test_ndjson_input():
+    file = io.BytesIO(b'{"id": 1, "name": "a", "extra": true}\n\n{"id": 2}\n')
+    assert list(formats.read_rows('ndjson', file, table_schema)) == [[1, 'a'], [2, None]]
+
+    ## nested values are passed on as the JSON text the casters expect
+    file = io.StringIO('{"id": 1, "attrs": {"a": [1]}, "tags": "[\\"x\\"]"}\n')
+    rows = formats.read_rows('ndjson', file, {'fields': [{'name': 'id', 'type': 'integer'},
+                                                           {'name': 'attrs', 'type': 'object'},
+                                                           {'name': 'tags', 'type': 'array'}]})
+    assert list(rows) == [[1, '{"a": [1]}', '["x"]']]
+
+@pytest.mark.parametrize('input_format, input_file, expected', [
+    (None, None, 'csv'),
+    (None, 'rows.csv', 'csv'),
+    (None, 'rows.ndjson', 'ndjson'),
+    (None, 'rows.jsonl', 'ndjson'),
+    (None, 's3://bucket/rows.NDJSON.gz', 'ndjson'),
+    (None, 'rows.arrow', 'arrow'),
+    (None, 'rows.parquet', 'parquet'),
+    (None, 'rows.txt', 'csv'),
+    ('ndjson', 'rows.csv', 'ndjson')
+])
+def test_get_input_format(input_format, input_file, expected):
+    assert formats.get_input_format(input_format, input_file) == expected
+
+def test_unknown_input_format():
+    with pytest.raises(Exception) as e:
+        formats.read_rows('xml', io.StringIO(), table_schema)
+    assert 'xml' in str(e.value)
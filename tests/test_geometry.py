@@ -0,0 +1,121 @@
+import json
+
+import pytest
+
+from the_el import geometry
+
+## doubles as little-endian hex
+one = '000000000000F03F'
+two = '0000000000000040'
+three = '0000000000000840'
+zero = '0000000000000000'
+nan = '000000000000F87F'
+
+def ewkb_hex(value, srid=None):
+    return geometry.geojson_to_ewkb_hex(value, srid=srid).upper()
+
+def test_ewkb_point():
+    assert ewkb_hex('{"type": "Point", "coordinates": [1, 2]}') == '0101000000' + one + two
+    assert ewkb_hex({'type': 'Point', 'coordinates': [1, 2]}, srid=4326) == '0101000020E6100000' + one + two
+
+def test_ewkb_z():
+    point = {'type': 'Point', 'coordinates': [1, 2, 3]}
+    assert ewkb_hex(point) == '0101000080' + one + two + three
+    assert ewkb_hex(point, srid=4326) == '01010000A0E6100000' + one + two + three
+
+    ## positions missing a z in a 3D geometry get 0
+    line = {'type': 'LineString', 'coordinates': [[1, 2, 3], [2, 1]]}
+    assert ewkb_hex(line) == '0102000080' + '02000000' + one + two + three + two + one + zero
+
+def test_ewkb_empty():
+    assert ewkb_hex({'type': 'Point', 'coordinates': []}) == '0101000000' + nan + nan
+    assert ewkb_hex({'type': 'LineString', 'coordinates': []}) == '0102000000' + '00000000'
+    assert ewkb_hex({'type': 'MultiPolygon', 'coordinates': []}, srid=2272) == '0106000020E0080000' + '00000000'
+    assert ewkb_hex({'type': 'GeometryCollection', 'geometries': []}) == '0107000000' + '00000000'
+
+def test_ewkb_collection():
+    collection = {
+        'type': 'GeometryCollection',
+        'geometries': [
+            {'type': 'Point', 'coordinates': [1, 2]},
+            {'type': 'LineString', 'coordinates': [[0, 0], [1, 1]]}
+        ]
+    }
+    ## only the collection is tagged with the SRID
+    assert ewkb_hex(collection, srid=4326) == ('0107000020E6100000' + '02000000' +
+                                               '0101000000' + one + two +
+                                               '0102000000' + '02000000' + zero + zero + one + one)
+
+    ## a 3D child makes every child 3D, as PostGIS requires
+    collection['geometries'][0]['coordinates'] = [1, 2, 3]
+    assert ewkb_hex(collection) == ('0107000080' + '02000000' +
+                                    '0101000080' + one + two + three +
+                                    '0102000080' + '02000000' + zero + zero + zero + one + one + zero)
+
+def test_ewkb_multi_polygon():
+    square = [[[0, 0], [1, 0], [1, 1], [0, 0]]]
+    assert ewkb_hex({'type': 'MultiPolygon', 'coordinates': [square]}) == (
+        '0106000000' + '01000000' +
+        '0103000000' + '01000000' + '04000000' + zero + zero + one + zero + one + one + zero + zero)
+
+class FakeTransform(object):
+    """Shifts x by 10 and doubles y, recording the coordinates of each call."""
+
+    def __init__(self):
+        self.calls = []
+
+    def __call__(self, xs, ys):
+        self.calls.append((list(xs), list(ys)))
+        return [x + 10 for x in xs], [y * 2 for y in ys]
+
+def test_reproject_batch():
+    point = {'type': 'Point', 'coordinates': (1, 2)}
+    batch = [
+        [1, '{"type": "Point", "coordinates": [1, 2, 3]}', point],
+        [2, None, ''],
+        [3, {'type': 'Polygon', 'coordinates': [[[0, 0], [1, 0], [1, 1], [0, 0]]]}, 'NA'],
+        [4, {'type': 'GeometryCollection', 'geometries': [
+                {'type': 'Point', 'coordinates': []},
+                {'type': 'MultiLineString', 'coordinates': [[[0, 1], [1, 1]], [[2, 2], [3, 3]]]}
+            ]}, None]
+    ]
+    transform = FakeTransform()
+
+    assert geometry.reproject_batch(batch, [1, 2], transform, missing_values=['', 'NA']) is batch
+
+    ## every position of the batch in one call
+    assert len(transform.calls) == 1
+    assert transform.calls[0][0] == [1, 1, 0, 1, 1, 0, 0, 1, 2, 3]
+
+    ## text stays text and dicts stay dicts, z values are kept
+    assert json.loads(batch[0][1]) == {'type': 'Point', 'coordinates': [11, 4, 3]}
+    assert batch[0][2] == {'type': 'Point', 'coordinates': [11, 4]}
+    assert batch[2][1] == {'type': 'Polygon', 'coordinates': [[[10, 0], [11, 0], [11, 2], [10, 0]]]}
+    assert batch[3][1] == {'type': 'GeometryCollection', 'geometries': [
+        {'type': 'Point', 'coordinates': []},
+        {'type': 'MultiLineString', 'coordinates': [[[10, 2], [11, 2]], [[12, 4], [13, 6]]]}
+    ]}
+
+    ## missing geometries are left as they are, and input dicts are not changed
+    assert batch[1] == [2, None, '']
+    assert batch[2][2] == 'NA'
+    assert point == {'type': 'Point', 'coordinates': (1, 2)}
+
+def test_reproject_batch_without_geometries():
+    transform = FakeTransform()
+    batch = [[1, None], [2, {'type': 'Point', 'coordinates': []}]]
+    geometry.reproject_batch(batch, [1], transform)
+    assert transform.calls == []
+    assert batch == [[1, None], [2, {'type': 'Point', 'coordinates': []}]]
+
+def test_reproject_rows():
+    pytest.importorskip('pyproj')
+
+    rows = [[i, {'type': 'Point', 'coordinates': [1, 0]}] for i in range(5)]
+    reprojected = list(geometry.reproject_rows(rows, [1], 4326, 3857, batch_size=2))
+    assert [row[0] for row in reprojected] == list(range(5))
+    for row in reprojected:
+        assert row[1]['coordinates'] == pytest.approx([111319.49, 0], abs=0.01)
+
+    ## built once per SRID pair and thread
+    assert geometry.get_transform(4326, 3857) is geometry.get_transform('4326', '3857')
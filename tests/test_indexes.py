@@ -0,0 +1,36 @@
+from click.testing import CliRunner
+from sqlalchemy import create_engine, inspect
+
+from the_el.cli import main
+from conftest import write_json, write_csv
+
+def test_write_builds_indexes_only_when_asked(tmpdir):
+    connection_string = 'sqlite:///{}'.format(tmpdir.join('test.db'))
+    schema_path = write_json(tmpdir.join('schema.json'), {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'}
+        ]
+    })
+    input_path = write_csv(tmpdir.join('input.csv'), ['id', 'name'], [[1, 'a'], [2, 'b']])
+
+    result = CliRunner().invoke(main, ['create_table', 'things', schema_path,
+                                       '--connection-string', connection_string,
+                                       '--indexes-fields', 'name',
+                                       '--defer-indexes'])
+    assert result.exit_code == 0, result.output
+
+    write_args = ['write', 'things',
+                  '--connection-string', connection_string,
+                  '--table-schema-path', schema_path,
+                  '--input-file', input_path,
+                  '--skip-headers',
+                  '--indexes-fields', 'name']
+
+    result = CliRunner().invoke(main, write_args)
+    assert result.exit_code == 0, result.output
+    assert inspect(create_engine(connection_string)).get_indexes('things') == []
+
+    result = CliRunner().invoke(main, write_args + ['--build-indexes'])
+    assert result.exit_code == 0, result.output
+    assert [index['name'] for index in inspect(create_engine(connection_string)).get_indexes('things')] == ['things_ix000']
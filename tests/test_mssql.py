@@ -0,0 +1,36 @@
+from sqlalchemy import MetaData, Table, Column, Integer, String
+from sqlalchemy.dialects import mssql as mssql_dialect
+
+from the_el import mssql
+from conftest import RecordingEngine
+
+table_schema = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'name', 'type': 'string'},
+        {'name': 'attrs', 'type': 'object'}
+    ],
+    'missingValues': ['']
+}
+
+def get_table():
+    return Table('things', MetaData(), Column('id', Integer), Column('name', String), Column('attrs', String))
+
+def test_insert_rows_multi_row_statements(monkeypatch):
+    monkeypatch.setattr(mssql, 'max_rows_per_insert', 2)
+    engine = RecordingEngine(mssql_dialect.dialect())
+    rows = [['1', 'a', '{"b": 1}'], ['2', '', ''], ['3', 'c', '[]']]
+
+    mssql.insert_rows(engine, get_table(), table_schema, rows)
+
+    calls = engine.conn.calls
+    assert calls[0] == ('execute',
+                        'INSERT INTO things (id, name, attrs) VALUES (%s, %s, %s), (%s, %s, %s)',
+                        (1, 'a', '{"b": 1}', 2, None, None))
+    assert calls[1] == ('execute', 'INSERT INTO things (id, name, attrs) VALUES (%s, %s, %s)', (3, 'c', '[]'))
+    assert calls[-2:] == [('commit',), ('close',)]
+
+def test_rows_per_insert_fits_parameter_limit():
+    assert mssql.get_rows_per_insert(3) == 699
+    assert mssql.get_rows_per_insert(2) == 1000
+    assert mssql.get_rows_per_insert(3000) == 1
@@ -0,0 +1,75 @@
+import sys
+import types
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import MetaData, Table, Column, Integer, Numeric, Date, DateTime, String
+from sqlalchemy.dialects import oracle as oracle_dialect
+
+from the_el import oracle
+from conftest import RecordingEngine
+
+table_schema = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'amount', 'type': 'number'},
+        {'name': 'day', 'type': 'date'},
+        {'name': 'at', 'type': 'datetime'},
+        {'name': 'name', 'type': 'string'},
+        {'name': 'active', 'type': 'boolean'}
+    ]
+}
+
+@pytest.fixture
+def cx_oracle(monkeypatch):
+    """A stand-in for the cx_Oracle type constants, as the driver is not needed to bind them."""
+    module = types.ModuleType('cx_Oracle')
+    module.NUMBER = 'NUMBER'
+    module.DATETIME = 'DATETIME'
+    module.TIMESTAMP = 'TIMESTAMP'
+    monkeypatch.setitem(sys.modules, 'cx_Oracle', module)
+    return module
+
+def get_table():
+    ## reflected Oracle names are lower case
+    return Table('things', MetaData(),
+                 Column('id', Integer),
+                 Column('amount', Numeric),
+                 Column('day', Date),
+                 Column('at', DateTime),
+                 Column('name', String),
+                 Column('active', Integer))
+
+def test_insert_rows_binds_every_column_type(cx_oracle):
+    engine = RecordingEngine(oracle_dialect.dialect())
+    rows = [
+        ['1', '', '', '', '', ''],
+        ['2', '1.5', '2017-06-01', '2017-06-01T12:30:00Z', 'a longer name', 'true']
+    ]
+
+    oracle.insert_rows(engine, get_table(), table_schema, rows, batch_size=10)
+
+    calls = engine.conn.calls
+    assert calls[0] == ('setinputsizes', 'NUMBER', 'NUMBER', 'DATETIME', 'TIMESTAMP', 13, 'NUMBER')
+    assert calls[1][0] == 'executemany'
+    assert calls[1][1] == 'INSERT INTO things (id, amount, day, at, name, active) VALUES (:1, :2, :3, :4, :5, :6)'
+    assert calls[1][2][0] == [1, None, None, None, '', None]
+    assert calls[1][2][1][2:] == [date(2017, 6, 1), datetime(2017, 6, 1, 12, 30), 'a longer name', 1]
+    assert calls[-2:] == [('commit',), ('close',)]
+
+def test_insert_rows_batches(cx_oracle):
+    engine = RecordingEngine(oracle_dialect.dialect())
+    rows = [[str(i), '', '', '', 'x' * i, ''] for i in range(1, 6)]
+
+    oracle.insert_rows(engine, get_table(), table_schema, rows, batch_size=2)
+
+    ## text columns are sized to each batch's longest value
+    assert [call[5] for call in engine.conn.calls if call[0] == 'setinputsizes'] == [2, 4, 5]
+    assert [len(call[2]) for call in engine.conn.calls if call[0] == 'executemany'] == [2, 2, 1]
+
+def test_insert_rows_rolls_back(cx_oracle):
+    engine = RecordingEngine(oracle_dialect.dialect())
+
+    with pytest.raises(Exception):
+        oracle.insert_rows(engine, get_table(), table_schema, [['1', 'not a number', '', '', '', '']])
+    assert engine.conn.calls[-2:] == [('rollback',), ('close',)]
@@ -0,0 +1,44 @@
+import json
+
+from click.testing import CliRunner
+from sqlalchemy import create_engine
+from jsontableschema_sql import Storage
+
+from the_el.cli import main
+
+descriptor = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'name', 'type': 'string'}
+    ]
+}
+
+pipeline = '''
+connections:
+  source: sqlite:///$THE_EL_TEST_DIR/source.db?check_same_thread=false
+  dest: sqlite:///$THE_EL_TEST_DIR/dest.db?check_same_thread=false
+steps:
+  - command: transfer
+    source_table: things
+    dest_table: things
+    source_connection_string: source
+    connection_string: dest
+'''
+
+def test_transfer_step_resolves_connections(tmpdir, monkeypatch):
+    monkeypatch.setenv('THE_EL_TEST_DIR', str(tmpdir))
+
+    source = Storage(create_engine('sqlite:///{}'.format(tmpdir.join('source.db'))))
+    source.create('things', descriptor)
+    source.write('things', [[1, 'a'], [2, 'b']])
+    dest = Storage(create_engine('sqlite:///{}'.format(tmpdir.join('dest.db'))))
+    dest.create('things', descriptor)
+
+    tmpdir.join('pipeline.yaml').write(pipeline)
+    status_path = str(tmpdir.join('status.json'))
+    result = CliRunner().invoke(main, ['run', str(tmpdir.join('pipeline.yaml')), '--status-file', status_path])
+    assert result.exit_code == 0, result.output
+
+    with open(status_path) as file:
+        assert [step['status'] for step in json.load(file)] == ['success']
+    assert [list(row) for row in dest.iter('things')] == [[1, 'a'], [2, 'b']]
@@ -0,0 +1,339 @@
+import pytest
+from click.testing import CliRunner
+
+from the_el.cli import main
+from the_el import postgres, geometry
+from conftest import write_json, write_csv
+
+table_schema = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'name', 'type': 'string'},
+        {'name': 'note', 'type': 'string'}
+    ],
+    'primaryKey': 'id'
+}
+
+@pytest.fixture
+def engine(postgres_connection_string):
+    from sqlalchemy import create_engine
+
+    engine = create_engine(postgres_connection_string)
+    with engine.begin() as conn:
+        conn.execute('DROP TABLE IF EXISTS the_el_test_things')
+        conn.execute('CREATE TABLE the_el_test_things (id integer PRIMARY KEY, name text NOT NULL, note text)')
+    yield engine
+    with engine.begin() as conn:
+        conn.execute('DROP TABLE IF EXISTS the_el_test_things')
+    engine.dispose()
+
+def insert(engine, rows):
+    with engine.begin() as conn:
+        for row in rows:
+            conn.execute('INSERT INTO the_el_test_things (id, name, note) VALUES (%s, %s, %s)', row)
+
+def select(engine):
+    with engine.connect() as conn:
+        return [tuple(row) for row in conn.execute('SELECT id, name, note FROM the_el_test_things ORDER BY id')]
+
+def write(tmpdir, postgres_connection_string, rows, *options):
+    schema_path = write_json(tmpdir.join('schema.json'), table_schema)
+    input_path = write_csv(tmpdir.join('input.csv'), ['id', 'name', 'note'], rows)
+    return CliRunner().invoke(main, ['write', 'the_el_test_things',
+                                     '--connection-string', postgres_connection_string,
+                                     '--table-schema-path', schema_path,
+                                     '--input-file', input_path,
+                                     '--skip-headers'] + list(options))
+
+def test_copy_stream_tells_null_from_empty_strings():
+    stream = postgres.CopyStream([[1, '', None, '\\N'], [None]])
+    assert stream.read() == '1,"",\\N,"\\N"\r\n\\N\r\n'
+
+def test_copy_caster_converts_typed_values():
+    from datetime import date, datetime
+    from decimal import Decimal
+
+    caster = postgres.CopyRowCaster({
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'},
+            {'name': 'at', 'type': 'datetime'},
+            {'name': 'day', 'type': 'date'},
+            {'name': 'flag', 'type': 'boolean'}
+        ]
+    })
+    assert caster.cast_row([Decimal('7'), 19104, date(2017, 6, 1), datetime(2017, 6, 1, 12, 30), 1]) == \
+        [7, '19104', datetime(2017, 6, 1), date(2017, 6, 1), True]
+    assert caster.cast_row(['7', '19104', '2017-06-01T00:00:00Z', '2017-06-01', 'true']) == \
+        [7, '19104', datetime(2017, 6, 1), date(2017, 6, 1), True]
+
+    with pytest.raises(Exception):
+        caster.cast_row([1.5, 'a', None, None, None])
+
+geometry_schema = {
+    'fields': [
+        {'name': 'id', 'type': 'integer'},
+        {'name': 'shape', 'type': 'geojson'}
+    ],
+    'missingValues': ['', 'NA']
+}
+
+point = '{"type": "Point", "coordinates": [-75.16, 39.95]}'
+
+def copy_postgis(column_srids, from_srid=None):
+    import logging
+    from the_el import geometry
+
+    engine = FakeEngine(results=list(column_srids.items()))
+    postgres.copy_from_postgis(logging.getLogger('the_el.tests'),
+                               engine,
+                               None,
+                               'parcels',
+                               geometry_schema,
+                               [['1', point], ['2', 'NA'], ['3', '']],
+                               from_srid=from_srid)
+    return engine.conn
+
+def test_postgis_caster_missing_values():
+    caster = postgres.PostGISCopyRowCaster(geometry_schema, {'shape': 4326})
+    assert caster.cast_row(['1', 'NA']) == [1, None]
+    assert caster.cast_row(['1', 'NULL']) == [1, None]
+    assert caster.cast_row(['1', point]) == [1, geometry.geojson_to_ewkb_hex(point, srid=4326)]
+
+def test_copy_from_postgis_tags_column_srid():
+    conn = copy_postgis({'shape': 2272})
+    assert conn.statements[1] == 'COPY parcels (id, shape) FROM STDIN ' + postgres.copy_csv_options
+    assert conn.copied == ['1,"{}"\r\n2,\\N\r\n3,\\N\r\n'.format(geometry.geojson_to_ewkb_hex(point, srid=2272))]
+    assert conn.statements[-1] == 'COMMIT'
+
+    ## the same SRID needs no reprojection
+    assert copy_postgis({'shape': 2272}, from_srid='2272').copied == conn.copied
+
+    ## columns taking any SRID are tagged with --from-srid
+    conn = copy_postgis({'shape': None}, from_srid='4326')
+    assert geometry.geojson_to_ewkb_hex(point, srid=4326) in conn.copied[0]
+
+def test_copy_from_postgis_reprojects_client_side():
+    import json
+    pytest.importorskip('pyproj')
+
+    conn = copy_postgis({'shape': 2272}, from_srid='4326')
+
+    x, y = geometry.get_transform(4326, 2272)([-75.16], [39.95])
+    reprojected = json.dumps({'type': 'Point', 'coordinates': [x[0], y[0]]})
+    assert conn.copied[0].startswith('1,"{}"'.format(geometry.geojson_to_ewkb_hex(reprojected, srid=2272)))
+    assert not any('ST_Transform' in statement for statement in conn.statements)
+
+def test_copy_from_postgis_transforms_server_side(monkeypatch):
+    monkeypatch.setattr(geometry, 'can_reproject', lambda: False)
+
+    conn = copy_postgis({'shape': 2272}, from_srid='4326')
+
+    assert 'CREATE TEMP TABLE parcels_transform' in conn.statements[1]
+    assert conn.statements[2] == 'ALTER TABLE parcels_transform ALTER COLUMN shape TYPE geometry'
+    assert conn.statements[3] == 'COPY parcels_transform (id, shape) FROM STDIN ' + postgres.copy_csv_options
+    assert conn.copied[0].startswith('1,"{}"'.format(geometry.geojson_to_ewkb_hex(point, srid=4326)))
+    assert conn.statements[4] == 'INSERT INTO parcels (id, shape) SELECT id, ST_Transform(shape, 2272) AS shape ' +\
+                                 'FROM parcels_transform'
+
+def test_upsert_keeps_empty_strings(tmpdir, postgres_connection_string, engine):
+    insert(engine, [(1, 'old', 'x')])
+
+    result = write(tmpdir, postgres_connection_string, [[1, '', 'a'], [2, 'b', '']], '--upsert')
+    assert result.exit_code == 0, result.output
+
+    assert select(engine) == [(1, '', 'a'), (2, 'b', '')]
+
+def test_upsert_duplicate_keys_last_wins(tmpdir, postgres_connection_string, engine):
+    result = write(tmpdir, postgres_connection_string, [[3, 'first', ''], [3, 'second', '']], '--upsert')
+    assert result.exit_code == 0, result.output
+    assert select(engine) == [(3, 'second', '')]
+
+    result = write(tmpdir, postgres_connection_string, [[3, 'first', ''], [3, 'second', '']],
+                   '--upsert', '--no-dedupe')
+    assert result.exit_code != 0
+
+def test_differential_load_compares_empty_strings(engine):
+    insert(engine, [(1, '', ''), (2, 'b', ''), (4, 'd', None)])
+
+    rows = [['1', '', ''], ['2', 'b', 'changed'], ['3', '', '']]
+    inserted, updated, deleted = postgres.differential_load(engine, None, 'the_el_test_things', table_schema, rows)
+
+    assert (inserted, updated, deleted) == (1, 1, 1)
+    assert select(engine) == [(1, '', ''), (2, 'b', 'changed'), (3, '', '')]
+
+class FakeCursor(object):
+    """Stands in for a psycopg2 cursor, recording statements and the data COPY'd."""
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.rowcount = -1
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def execute(self, statement, params=None):
+        self.conn.statements.append(statement)
+
+    def fetchall(self):
+        return self.conn.results
+
+    def copy_expert(self, statement, file, size=None):
+        self.conn.statements.append(statement)
+        data = ''
+        while True:
+            chunk = file.read(size)
+            if not chunk:
+                break
+            data += chunk
+        self.conn.copied.append(data)
+        self.rowcount = len(data.splitlines())
+
+class FakeConnection(object):
+    def __init__(self, results):
+        self.results = results
+        self.statements = []
+        self.copied = []
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.statements.append('COMMIT')
+
+    def rollback(self):
+        self.statements.append('ROLLBACK')
+
+    def close(self):
+        pass
+
+class FakeEngine(object):
+    """Stands in for an engine, its raw connection running no SQL and fetching `results`."""
+
+    def __init__(self, results=None):
+        self.conn = FakeConnection(results)
+
+    def raw_connection(self):
+        return self.conn
+
+def test_staging_table_names_are_unique_and_fit():
+    names = postgres.get_staging_table_names('phl.' + 'x' * 70, 12)
+    assert len(set(names)) == 12
+    assert all(name.startswith('phl.xxx') for name in names)
+    assert all(len(name.split('.')[1]) <= 63 for name in names)
+
+    assert set(postgres.get_staging_table_names('things', 2)).isdisjoint(postgres.get_staging_table_names('things', 2))
+
+def parallel_copy(engine, rows):
+    import logging
+    postgres.parallel_copy_from(logging.getLogger('the_el.tests'), engine, 'things', table_schema, rows, 2, chunk_size=2)
+
+def get_statements(engine, prefix):
+    return [statement for statement in engine.conn.statements if statement.startswith(prefix)]
+
+def test_parallel_copy_from_drops_its_staging_tables():
+    engine = FakeEngine()
+    parallel_copy(engine, [[str(i), 'name', ''] for i in range(10)])
+
+    created = [statement.split()[3] for statement in get_statements(engine, 'CREATE UNLOGGED TABLE')]
+    assert len(created) == 2
+    assert sum(len(data.splitlines()) for data in engine.conn.copied) == 10
+    assert get_statements(engine, 'INSERT INTO things SELECT * FROM {} UNION ALL'.format(created[0]))
+    assert get_statements(engine, 'DROP TABLE') == ['DROP TABLE IF EXISTS {}'.format(name) for name in created]
+
+def test_parallel_copy_from_drops_its_staging_tables_on_failure():
+    def rows():
+        for i in range(5):
+            yield [str(i), 'name', '']
+        raise ValueError('input failed')
+
+    engine = FakeEngine()
+    with pytest.raises(ValueError):
+        parallel_copy(engine, rows())
+
+    created = [statement.split()[3] for statement in get_statements(engine, 'CREATE UNLOGGED TABLE')]
+    assert not get_statements(engine, 'INSERT')
+    assert get_statements(engine, 'DROP TABLE') == ['DROP TABLE IF EXISTS {}'.format(name) for name in created]
+
+def test_differential_load_refuses_empty_input():
+    engine = FakeEngine()
+    with pytest.raises(Exception) as e:
+        postgres.differential_load(engine, None, 'the_el_test_things', table_schema, [])
+    assert '--allow-empty' in str(e.value)
+    assert not any(statement.lstrip().startswith('DELETE') for statement in engine.conn.statements)
+    assert engine.conn.statements[-1] == 'ROLLBACK'
+
+def test_differential_load_empty_input(engine):
+    insert(engine, [(1, 'a', None)])
+
+    with pytest.raises(Exception):
+        postgres.differential_load(engine, None, 'the_el_test_things', table_schema, [])
+    assert select(engine) == [(1, 'a', None)]
+
+    inserted, updated, deleted = postgres.differential_load(engine, None, 'the_el_test_things', table_schema, [],
+                                                            allow_empty=True)
+    assert (inserted, updated, deleted) == (0, 0, 1)
+    assert select(engine) == []
+
+def test_differential_load_duplicate_keys_last_wins(engine):
+    insert(engine, [(1, 'a', None), (2, 'b', None)])
+
+    rows = [['1', 'first', ''], ['1', 'second', ''], ['3', 'first', ''], ['3', 'second', '']]
+    inserted, updated, deleted = postgres.differential_load(engine, None, 'the_el_test_things', table_schema, rows)
+    assert (inserted, updated, deleted) == (1, 1, 1)
+    assert select(engine) == [(1, 'second', ''), (3, 'second', '')]
+
+    with pytest.raises(Exception) as e:
+        postgres.differential_load(engine, None, 'the_el_test_things', table_schema, rows, dedupe=False)
+    assert 'id = 1' in str(e.value)
+
+def test_copy_to_read_counts_rows(tmpdir, postgres_connection_string, engine):
+    import json
+
+    insert(engine, [(1, 'a', None), (2, 'b', ''), (3, 'c', 'x')])
+
+    metrics_path = str(tmpdir.join('metrics.jsonl'))
+    result = CliRunner().invoke(main, ['read', 'the_el_test_things',
+                                       '--connection-string', postgres_connection_string,
+                                       '--output-file', str(tmpdir.join('output.csv')),
+                                       '--where', 'id > 1',
+                                       '--metrics-file', metrics_path])
+    assert result.exit_code == 0, result.output
+
+    with open(metrics_path) as file:
+        summary = json.loads(file.readline())
+    assert summary['counters']['rows'] == 2
+    assert summary['rows_per_sec'] > 0
+
+def forbid_reflection(monkeypatch):
+    """Fails the test on reflecting a table's columns from here on."""
+    from sqlalchemy.engine.reflection import Inspector
+
+    def get_columns(*args, **kwargs):
+        raise AssertionError('table reflected')
+    monkeypatch.setattr(Inspector, 'get_columns', get_columns)
+
+def test_copy_write_skips_reflection(tmpdir, postgres_connection_string, engine, monkeypatch):
+    forbid_reflection(monkeypatch)
+    result = write(tmpdir, postgres_connection_string, [[1, 'a', 'x'], [2, 'b', '']])
+    assert result.exit_code == 0, result.output
+    assert select(engine) == [(1, 'a', 'x'), (2, 'b', '')]
+
+def test_copy_read_uses_describe_cache(tmpdir, postgres_connection_string, engine, monkeypatch):
+    insert(engine, [(1, 'a', None)])
+    args = ['read', 'the_el_test_things',
+            '--connection-string', postgres_connection_string,
+            '--output-file', str(tmpdir.join('output.csv')),
+            '--describe-cache', str(tmpdir.join('cache'))]
+
+    result = CliRunner().invoke(main, args)
+    assert result.exit_code == 0, result.output
+
+    forbid_reflection(monkeypatch)
+    result = CliRunner().invoke(main, args)
+    assert result.exit_code == 0, result.output
+    with open(str(tmpdir.join('output.csv'))) as file:
+        assert file.read().splitlines() == ['id,name,note', '1,a,']
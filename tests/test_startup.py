@@ -0,0 +1,28 @@
+import sys
+import json
+import subprocess
+
+import pytest
+
+import startup
+from the_el.cli import main
+
+def get_imported_heavy_modules(args):
+    """Runs python with `args` in a fresh interpreter, returning the heavy modules it imported."""
+    result = subprocess.run([sys.executable] + args,
+                            cwd=startup.root_dir,
+                            stdout=subprocess.DEVNULL,
+                            stderr=subprocess.PIPE,
+                            universal_newlines=True,
+                            check=True)
+    return json.loads(result.stderr.strip().splitlines()[-1])
+
+def test_import_does_not_import_heavy_modules():
+    script = 'import sys, json; import the_el.cli; ' +\
+             'sys.stderr.write(json.dumps([name for name in {} if name in sys.modules]))'.format(startup.heavy_modules)
+    assert get_imported_heavy_modules(['-c', script]) == []
+
+@pytest.mark.parametrize('command', [[]] + [[command] for command in sorted(main.commands)])
+def test_help_does_not_import_heavy_modules(command):
+    args = command + ['--help']
+    assert get_imported_heavy_modules(['-c', startup.script, json.dumps(args), json.dumps(startup.heavy_modules)]) == []
@@ -0,0 +1,104 @@
+import io
+import gzip
+
+import pytest
+from click.testing import CliRunner
+from sqlalchemy import create_engine
+from jsontableschema_sql import Storage
+
+from the_el import writer
+from the_el.cli import main
+
+def decompress(data, compression):
+    if compression == 'gzip':
+        return gzip.decompress(data)
+    elif compression == 'zstd':
+        import zstandard
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+class FailingFile(io.BytesIO):
+    def write(self, data):
+        raise IOError('disk full')
+
+@pytest.mark.parametrize('compression', [None, 'gzip', 'zstd'])
+def test_background_writer(compression, monkeypatch):
+    if compression == 'zstd':
+        pytest.importorskip('zstandard')
+    ## several chunks through each stage
+    monkeypatch.setattr(writer, 'chunk_size', 100)
+
+    file = io.BytesIO()
+    expected = b''
+    with writer.BackgroundWriter(file, compression=compression, queue_size=1) as output:
+        for i in range(200):
+            line = 'row {},café\n'.format(i)
+            output.write(line if i % 2 == 0 else line.encode('utf-8'))
+            expected += line.encode('utf-8')
+        assert output.tell() == len(expected)
+
+    assert output.closed
+    assert decompress(file.getvalue(), compression) == expected
+    assert output.num_bytes == len(expected)
+    assert output.num_compressed_bytes == len(file.getvalue())
+    assert output.summary().startswith('Wrote {} bytes as {} at '.format(len(expected), len(file.getvalue())))
+    assert 'upload: ' in output.summary()
+    if compression != None:
+        assert 'compress: ' in output.summary()
+
+def test_background_writer_file_error(monkeypatch):
+    monkeypatch.setattr(writer, 'chunk_size', 10)
+
+    output = writer.BackgroundWriter(FailingFile(), compression='gzip', queue_size=1)
+    ## the failure is raised to the writing thread, without it blocking on the failed stage
+    with pytest.raises(IOError) as e:
+        for i in range(1000):
+            output.write('row {}\n'.format(i))
+    assert 'disk full' in str(e.value)
+
+    with pytest.raises(IOError):
+        output.close()
+    assert output.closed
+
+def test_background_writer_compressor_error(monkeypatch):
+    class FailingCompressor(object):
+        def compress(self, data):
+            raise ValueError('bad chunk')
+
+        def flush(self):
+            return b''
+
+    monkeypatch.setattr(writer, 'get_compressor', lambda compression: FailingCompressor())
+
+    file = io.BytesIO()
+    with pytest.raises(ValueError) as e:
+        with writer.BackgroundWriter(file, compression='gzip') as output:
+            output.write('row\n')
+    assert 'bad chunk' in str(e.value)
+    assert file.getvalue() == b''
+
+def test_unsupported_compression():
+    with pytest.raises(Exception) as e:
+        writer.get_compressor('lz4')
+    assert 'lz4' in str(e.value)
+
+def test_read_compressed_output(tmpdir):
+    connection_string = 'sqlite:///{}'.format(tmpdir.join('test.db'))
+    storage = Storage(create_engine(connection_string))
+    storage.create('things', {
+        'fields': [
+            {'name': 'id', 'type': 'integer'},
+            {'name': 'name', 'type': 'string'}
+        ]
+    })
+    storage.write('things', [[1, 'a'], [2, 'b']])
+
+    ## compressed once, even though the extension would have smart_open compress it too
+    output_path = str(tmpdir.join('things.csv.gz'))
+    result = CliRunner().invoke(main, ['read', 'things',
+                                       '--connection-string', connection_string,
+                                       '--output-file', output_path,
+                                       '--compression', 'gzip'])
+    assert result.exit_code == 0, result.output
+    with open(output_path, 'rb') as file:
+        assert gzip.decompress(file.read()).decode('utf-8').splitlines() == ['id,name', '1,a', '2,b']
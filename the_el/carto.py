@@ -1,18 +1,51 @@
+import os
 import re
 import json
+import math
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date
+from decimal import Decimal
 
 from sqlalchemy import *
 from sqlalchemy.dialects import postgresql
 from sqlalchemy.schema import CreateTable
-from sqlalchemy.sql import literal_column
 from jsontableschema_sql.mappers import load_postgis_support, descriptor_to_columns_and_constraints
 import requests
-import jsontableschema
+from requests.adapters import HTTPAdapter
 from jsontableschema.exceptions import InvalidObjectType
 import click
 
-carto_connection_string_regex = r'^carto://(.+):(.+)'
+from .casting import RowCaster, is_missing, is_missing_geometry, get_cast_value
+from .connections import carto_connection_string_regex
+from .geometry import geojson_to_ewkb_hex
+from .postgres import CopyStream, copy_csv_options
+from . import metrics
+
+
+## Overridable to point at a local stand-in, see tools/fake_carto.py
+carto_sql_api_url = os.getenv('CARTO_SQL_API_URL', 'https://{}.carto.com/api/v2/sql/')
+
+max_connections = 32
+
+copy_chunk_size = 1024 * 1024
+
+## the_geom columns are always WGS 84
+carto_srid = 4326
+
+session = None
+session_lock = threading.Lock()
+
+def get_session():
+    global session
+    with session_lock:
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+    return session
 
 def get_table(table_name, json_table_schema):
     metadata = MetaData()
@@ -33,7 +66,7 @@ def carto_sql_call(logger, creds, str_statement, log_response=False):
         'q': str_statement,
         'api_key': creds[1]
     }
-    response = requests.post('https://{}.carto.com/api/v2/sql/'.format(creds[0]), data=data)
+    response = get_session().post(carto_sql_api_url.format(creds[0]), data=data)
     try:
         response.raise_for_status()
     except:
@@ -45,12 +78,24 @@ def carto_sql_call(logger, creds, str_statement, log_response=False):
 
     return response.json()
 
-def create_indexes(logger, creds, table_name, indexes_fields):
+def get_create_index_sql(table_name, indexes_field):
+    return 'CREATE INDEX IF NOT EXISTS {table}_{field} ON "{table}" ("{field}");\n'.format(table=table_name, field=indexes_field)
+
+def create_indexes(logger, creds, table_name, indexes_fields, concurrency=1):
+    """Creates an index on each of `indexes_fields`, sending up to `concurrency` builds at once."""
     logger.info('{} - creating table indexes - {}'.format(table_name, ','.join(indexes_fields)))
-    str_statement = ''
-    for indexes_field in indexes_fields:
-        str_statement += 'CREATE INDEX {table}_{field} ON "{table}" ("{field}");\n'.format(table=table_name, field=indexes_field)
-    carto_sql_call(logger, creds, str_statement)
+    if concurrency <= 1:
+        str_statement = ''
+        for indexes_field in indexes_fields:
+            str_statement += get_create_index_sql(table_name, indexes_field)
+        carto_sql_call(logger, creds, str_statement)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(concurrency, max_connections)) as pool:
+        futures = [pool.submit(carto_sql_call, logger, creds, get_create_index_sql(table_name, indexes_field))
+                   for indexes_field in indexes_fields]
+        for future in futures:
+            future.result()
 
 def create_table(logger, table_name, load_postgis, json_table_schema, if_not_exists, indexes_fields, connection_string):
     if load_postgis:
@@ -75,7 +120,7 @@ def create_table(logger, table_name, load_postgis, json_table_schema, if_not_exi
         raise Exception(message)
 
     if indexes_fields:
-        create_indexes(creds, table_name, indexes_fields)
+        create_indexes(logger, creds, table_name, indexes_fields)
 
 def generate_select_grants(logger, table, users):
     grants_sql = ''
@@ -94,52 +139,144 @@ def swap_table(logger, db_schema, new_table_name, old_table_name, select_users,
           'COMMIT;'
     carto_sql_call(logger, creds, sql)
 
-def type_fields(schema, row):
-    missing_values = []
-    if 'missingValues' in schema._Schema__descriptor:
-        missing_values = schema._Schema__descriptor['missingValues']
+def quote_literal(value):
+    return "'" + value.replace("'", "''") + "'"
+
+def sql_literal(value):
+    """Encodes a python value as a Postgres SQL literal."""
+    if value is None:
+        return 'null'
+    elif value is True:
+        return 'true'
+    elif value is False:
+        return 'false'
+    elif isinstance(value, str):
+        return quote_literal(value)
+    elif isinstance(value, int):
+        return str(value)
+    elif isinstance(value, (float, Decimal)):
+        if math.isfinite(value):
+            return str(value)
+        return quote_literal(str(value))
+    elif isinstance(value, datetime):
+        return quote_literal(value.strftime('%Y-%m-%d %H:%M:%S'))
+    elif isinstance(value, date):
+        return quote_literal(value.strftime('%Y-%m-%d'))
+    elif isinstance(value, (dict, list)):
+        return quote_literal(json.dumps(value))
+    return quote_literal(str(value))
+
+class CartoRowCaster(RowCaster):
+    """Casts rows to SQL literal text for INSERT statements.
+
+    Subclasses change how nulls, geometries, json and other typed values
+    are represented by overriding the `*_value` methods.
+    """
+
+    def null_value(self):
+        return 'null'
+
+    def geometry_value(self, value):
+        return 'ST_GeomFromGeoJSON(' + quote_literal(value) + ')'
+
+    def json_value(self, value):
+        return quote_literal(value) + '::jsonb'
+
+    def typed_value(self, value):
+        return sql_literal(value)
+
+    def field_caster(self, field):
+        missing_values = self.missing_values
+        null = self.null_value()
+        geometry_value = self.geometry_value
+        json_value = self.json_value
+        typed_value = self.typed_value
 
-    typed_row = []
-    for index, field in enumerate(schema.fields):
-        value = row[index]
         if field.type == 'geojson':
-            if value == '' or value == 'NULL' or value == None:
-                value = None
-            else:
-                value = literal_column("ST_GeomFromGeoJSON('{}')".format(value))
-        elif field.type == 'string' and 'None' not in missing_values and value == 'None':
-            value = 'None'
-        elif field.type == 'string' and value.lower() == 'nan':
-            value = value # HACK: tableschema-py 1.0 fixes this but is not released yet
-        elif field.type == 'array' or field.type == 'object':
-            if value in missing_values:
-                value = None
-            else:
-                value = literal_column('\'' + value + '\'::jsonb')
-        else:
+            def cast(value):
+                if is_missing_geometry(value, missing_values):
+                    return null
+                return geometry_value(value)
+            return cast
+
+        if field.type == 'array' or field.type == 'object':
+            def cast(value):
+                if value is None or is_missing(value, missing_values):
+                    return null
+                return json_value(value)
+            return cast
+
+        cast_value = get_cast_value(field)
+
+        def cast_default(value):
             try:
-                value = field.cast_value(value)
+                value = cast_value(value)
             except InvalidObjectType:
                 value = json.loads(value)
+            return typed_value(value)
 
-        if isinstance(value, datetime):
-            value = literal_column("'" + value.strftime('%Y-%m-%d %H:%M:%S') + "'")
-        elif isinstance(value, date):
-            value = literal_column("'" + value.strftime('%Y-%m-%d') + "'")
+        if field.type == 'string':
+            keep_none = 'None' not in missing_values
+            def cast(value):
+                if isinstance(value, str):
+                    if keep_none and value == 'None':
+                        return typed_value('None')
+                    elif value.lower() == 'nan':
+                        return typed_value(value) # HACK: tableschema-py 1.0 fixes this but is not released yet
+                return cast_default(value)
+            return cast
+
+        return cast_default
+
+class CartoCopyRowCaster(CartoRowCaster):
+    """Casts rows to values for CSV sent to the COPY FROM endpoint."""
 
-        if value is None:
-            value = literal_column('null')
+    def null_value(self):
+        return None
 
-        typed_row.append(value)
+    def geometry_value(self, value):
+        return geojson_to_ewkb_hex(value, srid=carto_srid)
 
-    return typed_row
+    def json_value(self, value):
+        return value
 
-def insert(logger, creds, table, rows):
-    statement = table.insert(values=rows)
-    str_statement = statement.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
-    response_json = carto_sql_call(logger, creds, str_statement)
+    def typed_value(self, value):
+        if isinstance(value, datetime):
+            return value.strftime('%Y-%m-%d %H:%M:%S')
+        elif isinstance(value, (dict, list)):
+            return json.dumps(value)
+        return value
+
+def get_insert_sql_prefix(table):
+    columns = ', '.join(['"{}"'.format(column.name) for column in table.columns])
+    return 'INSERT INTO "{}" ({}) VALUES '.format(table.name, columns)
+
+def get_insert_sql(sql_prefix, rows):
+    """Builds an INSERT statement from rows already encoded by `CartoRowCaster`."""
+    return sql_prefix + ', '.join(['(' + ', '.join(row) + ')' for row in rows])
+
+def insert(logger, creds, table, rows, sql_prefix=None):
+    if sql_prefix is None:
+        sql_prefix = get_insert_sql_prefix(table)
+    with metrics.current.phase('build_sql'):
+        str_statement = get_insert_sql(sql_prefix, rows)
+    metrics.current.count('bytes', len(str_statement))
+    with metrics.current.phase('network'):
+        response_json = carto_sql_call(logger, creds, str_statement)
     return response_json['total_rows']
 
+def insert_batch(logger, creds, table, batch, sql_prefix=None):
+    num_rows_inserted = insert(logger, creds, table, batch, sql_prefix=sql_prefix)
+    logger.info('{} - Inserted {} rows'.format(table.name, num_rows_inserted))
+    if len(batch) != num_rows_inserted:
+        message = '{} - Number of rows inserted does not match expected - expected: {} actual: {}'.format(
+            table.name,
+            len(batch),
+            num_rows_inserted)
+        logger.error(message)
+        raise Exception(message)
+    return num_rows_inserted
+
 def cartodbfytable(logger, creds, db_schema, table_name):
     logger.info('{} - cdb_cartodbfytable\'ing table'.format(table_name))
     carto_sql_call(logger, creds, "select cdb_cartodbfytable('{}', '{}');".format(db_schema, table_name))
@@ -168,6 +305,86 @@ def verify_count(logger, creds, table_name, num_rows_expected, num_rows_inserted
             data['rows'][0]['count']))
     logger.info(message)
 
+def insert_rows(logger, creds, table, json_table_schema, rows, batch_size, concurrency, checkpoint=None):
+    caster = CartoRowCaster(json_table_schema)
+    sql_prefix = get_insert_sql_prefix(table)
+
+    num_rows_expected = 0
+    total_num_rows_inserted = 0
+
+    ## batches in flight at once commit independently, so a failed one can
+    ## leave later ones committed past any checkpoint saved before it
+    window = concurrency * 2
+    if checkpoint is not None:
+        if concurrency > 1:
+            raise Exception('Checkpoints require Carto INSERT batches to be sent one at a time')
+        window = 1
+
+    def collect(pending):
+        future, mark = pending.popleft()
+        with metrics.current.phase('wait'):
+            num_rows_inserted = future.result()
+        if checkpoint is not None:
+            checkpoint.save(mark)
+        return num_rows_inserted
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        ## bounded window of batches in flight, so input is never fully read into memory
+        pending = deque()
+        try:
+            for batch in metrics.current.timed('cast', caster.cast_batches(rows, batch_size)):
+                num_rows_expected += len(batch)
+                mark = None
+                if checkpoint is not None:
+                    mark = checkpoint.mark(num_rows_expected)
+                pending.append((pool.submit(insert_batch, logger, creds, table, batch, sql_prefix), mark))
+                if len(pending) >= window:
+                    total_num_rows_inserted += collect(pending)
+
+            while pending:
+                total_num_rows_inserted += collect(pending)
+        except:
+            for future, mark in pending:
+                future.cancel()
+            raise
+
+    return num_rows_expected, total_num_rows_inserted
+
+def copy_from(logger, creds, table, chunks):
+    columns = ', '.join(['"{}"'.format(column.name) for column in table.columns])
+    copy = 'COPY "{}" ({}) FROM STDIN {}'.format(table.name, columns, copy_csv_options)
+    params = {
+        'q': copy,
+        'api_key': creds[1]
+    }
+    response = get_session().post(carto_sql_api_url.format(creds[0]) + 'copyfrom', params=params, data=chunks)
+    try:
+        response.raise_for_status()
+    except:
+        logger.error('HTTP ' + str(response.status_code) + ': ' + response.text)
+        raise
+
+    return response.json()['total_rows']
+
+def copy_rows(logger, creds, table, json_table_schema, rows):
+    caster = CartoCopyRowCaster(json_table_schema)
+    counts = {'rows': 0}
+
+    def counted(rows):
+        for row in rows:
+            counts['rows'] += 1
+            yield row
+
+    stream = CopyStream(metrics.current.timed('cast', caster.cast_rows(counted(rows))))
+    ## requests sends a generator body with chunked transfer encoding
+    chunks = (chunk.encode('utf-8') for chunk in iter(lambda: stream.read(copy_chunk_size), ''))
+
+    with metrics.current.phase('network'):
+        num_rows_inserted = copy_from(logger, creds, table, chunks)
+    logger.info('{} - Copied {} rows'.format(table.name, num_rows_inserted))
+
+    return counts['rows'], num_rows_inserted
+
 def load(logger,
          db_schema,
          table_name,
@@ -177,45 +394,51 @@ def load(logger,
          rows,
          indexes_fields,
          do_truncate,
-         batch_size=500):
+         batch_size=500,
+         concurrency=1,
+         use_copy=False,
+         checkpoint=None,
+         index_concurrency=1):
     if load_postgis:
         load_postgis_support()
 
     creds = re.match(carto_connection_string_regex, connection_string).groups()
     table = get_table(table_name, json_table_schema)
-    schema = jsontableschema.Schema(json_table_schema)
 
-    if do_truncate:
-        truncate(logger, creds, table_name)
-
-    _buffer = []
-    num_rows_expected = 0
-    total_num_rows_inserted = 0
-    for row in rows:
-        num_rows_expected += 1
-        _buffer.append(type_fields(schema, row))
-        buf_ln = len(_buffer)
-        if buf_ln >= batch_size:
-            num_rows_inserted = insert(logger, creds, table, _buffer)
-            logger.info('{} - Inserted {} rows'.format(table_name, num_rows_inserted))
-            if buf_ln != num_rows_inserted:
-                message = '{} - Number of rows inserted does not match expected - expected: {} actual: {}'.format(
-                    table_name,
-                    buf_ln,
-                    num_rows_inserted)
-                logger.error(message)
-                raise Exception(message)
-            total_num_rows_inserted += num_rows_inserted
-            _buffer = []
-
-    if len(_buffer) > 0:
-        insert(logger, creds, table, _buffer)
-
-    verify_count(logger, creds, table, num_rows_expected, total_num_rows_inserted)
-
-    cartodbfytable(logger, creds, db_schema, table_name)
+    resumed_rows = 0
+    if checkpoint is not None:
+        if use_copy:
+            raise Exception('Checkpoints are not supported when loading Carto with COPY')
+        resumed_rows = checkpoint.start_rows
+
+    ## a resumed load keeps the rows committed before it failed
+    if do_truncate and resumed_rows == 0:
+        with metrics.current.phase('truncate'):
+            truncate(logger, creds, table_name)
+
+    if use_copy:
+        num_rows_expected, total_num_rows_inserted = copy_rows(logger, creds, table, json_table_schema, rows)
+    else:
+        num_rows_expected, total_num_rows_inserted = insert_rows(logger,
+                                                                 creds,
+                                                                 table,
+                                                                 json_table_schema,
+                                                                 rows,
+                                                                 batch_size,
+                                                                 concurrency,
+                                                                 checkpoint=checkpoint)
+        num_rows_expected += resumed_rows
+        total_num_rows_inserted += resumed_rows
+
+    with metrics.current.phase('verify'):
+        verify_count(logger, creds, table, num_rows_expected, total_num_rows_inserted)
+
+    with metrics.current.phase('cartodbfy'):
+        cartodbfytable(logger, creds, db_schema, table_name)
 
     if indexes_fields:
-        create_indexes(logger, creds, table_name, indexes_fields)
+        with metrics.current.phase('index'):
+            create_indexes(logger, creds, table_name, indexes_fields, concurrency=index_concurrency)
 
-    vacuum_analyze(logger, creds, table_name)
+    with metrics.current.phase('vacuum'):
+        vacuum_analyze(logger, creds, table_name)
@@ -0,0 +1,169 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+
+import jsontableschema
+from jsontableschema.exceptions import InvalidObjectType, InvalidCastError
+
+def get_missing_values(table_schema):
+    return set(table_schema.get('missingValues', []))
+
+def is_missing(value, missing_values):
+    try:
+        return value in missing_values
+    except TypeError: # unhashable, ie already parsed json
+        return False
+
+def is_missing_geometry(value, missing_values):
+    ## '' and 'NULL' are null geometries even where the schema's missingValues leave them out
+    return value is None or value == '' or value == 'NULL' or is_missing(value, missing_values)
+
+## Converters of values already typed, ie by the database driver of a `transfer` source, to a
+## field's python type. Each returns None for a value it cannot convert.
+
+def to_string(value):
+    if isinstance(value, bool):
+        return 'true' if value else 'false'
+    elif isinstance(value, (date, time)):
+        return value.isoformat()
+    elif isinstance(value, (dict, list)):
+        return json.dumps(value)
+    elif isinstance(value, (int, float, Decimal)):
+        return str(value)
+    return None
+
+def to_integer(value):
+    if isinstance(value, int):
+        return value
+    elif isinstance(value, float) and value.is_integer():
+        return int(value)
+    elif isinstance(value, Decimal) and value.is_finite() and value == value.to_integral_value():
+        return int(value)
+    return None
+
+def to_number(value):
+    if isinstance(value, (int, float, Decimal)) and not isinstance(value, bool):
+        return value
+    return None
+
+def to_boolean(value):
+    if isinstance(value, bool):
+        return value
+    elif isinstance(value, int) and value in (0, 1):
+        return value == 1
+    return None
+
+def to_date(value):
+    if isinstance(value, datetime):
+        return value.date()
+    elif isinstance(value, date):
+        return value
+    return None
+
+def to_datetime(value):
+    if isinstance(value, datetime):
+        return value
+    elif isinstance(value, date):
+        return datetime(value.year, value.month, value.day)
+    return None
+
+def to_time(value):
+    if isinstance(value, datetime):
+        return value.time()
+    elif isinstance(value, time):
+        return value
+    return None
+
+typed_converters = {
+    'string': to_string,
+    'integer': to_integer,
+    'number': to_number,
+    'boolean': to_boolean,
+    'date': to_date,
+    'datetime': to_datetime,
+    'time': to_time
+}
+
+def get_cast_value(field):
+    """Returns a function casting a value of `field` to its python type.
+
+    Text and None are cast by the field's `cast_value`, which only takes
+    text. Values
+    already typed are converted where the types are compatible, ie a date
+    to a datetime, or a number to a string, and otherwise rejected, rather
+    than cast lossily by `cast_value`, ie 1.5 to an integer 1.
+    """
+    cast_value = field.cast_value
+    convert = typed_converters.get(field.type)
+    if convert is None:
+        return cast_value
+    field_name = field.name
+    field_type = field.type
+
+    def cast(value):
+        if value is None or isinstance(value, str):
+            return cast_value(value)
+        converted = convert(value)
+        if converted is None:
+            raise InvalidCastError('{!r} of field `{}` can not be converted to {}'.format(value, field_name, field_type))
+        return converted
+
+    return cast
+
+class RowCaster(object):
+    """Casts raw rows to python values using a JSON Table Schema.
+
+    The per column cast functions are built once, so casting a row is a
+    single pass over precomputed callables. Subclasses customize how each
+    field is cast by overriding `field_caster`.
+    """
+
+    def __init__(self, table_schema):
+        self.table_schema = table_schema
+        self.schema = jsontableschema.Schema(table_schema)
+        self.missing_values = get_missing_values(table_schema)
+        self.casters = [self.field_caster(field) for field in self.schema.fields]
+        self.num_fields = len(self.casters)
+
+    def field_caster(self, field):
+        missing_values = self.missing_values
+
+        if field.type == 'geojson':
+            def cast(value):
+                if is_missing(value, missing_values):
+                    return None
+                return value
+            return cast
+
+        cast_value = get_cast_value(field)
+
+        def cast(value):
+            if is_missing(value, missing_values):
+                return None
+            try:
+                return cast_value(value)
+            except InvalidObjectType:
+                return json.loads(value)
+
+        return cast
+
+    def cast_row(self, row):
+        if len(row) < self.num_fields:
+            raise IndexError('Row has {} values, {} fields expected'.format(len(row), self.num_fields))
+        return [cast(value) for cast, value in zip(self.casters, row)]
+
+    def cast_rows(self, rows):
+        cast_row = self.cast_row
+        for row in rows:
+            yield cast_row(row)
+
+    def cast_batches(self, rows, batch_size):
+        cast_row = self.cast_row
+        batch = []
+        for row in rows:
+            batch.append(cast_row(row))
+            if len(batch) >= batch_size:
+                yield batch
+                batch = []
+        if len(batch) > 0:
+            yield batch
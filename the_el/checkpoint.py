@@ -0,0 +1,81 @@
+import os
+import json
+
+class CountingLines(object):
+    """Iterates the decoded lines of a binary file, tracking the bytes consumed.
+
+    `csv.reader` pulls lines only as it needs them to finish a row, so
+    `offset` read after a row is the byte offset where the next row starts.
+    """
+
+    def __init__(self, file, offset=0, encoding='utf-8'):
+        self.file = file
+        self.offset = offset
+        self.encoding = encoding
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = self.file.readline()
+        if not line:
+            raise StopIteration
+        self.offset += len(line)
+        return line.decode(self.encoding)
+
+class Checkpoint(object):
+    """Records how much of the input has been committed, so a failed load can resume after it.
+
+    The checkpoint file holds the number of input rows committed and, when
+    the input is read through `CountingLines`, the byte offset after them.
+    """
+
+    def __init__(self, path, table_name, input_file):
+        self.path = path
+        self.table_name = table_name
+        self.input_file = input_file
+        self.start_rows = 0
+        self.start_bytes = None
+        self.lines = None
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return False
+
+        with open(self.path) as file:
+            state = json.load(file)
+
+        if state['table_name'] != self.table_name or state['input_file'] != self.input_file:
+            raise Exception('Checkpoint {} is for loading {} into {}'.format(
+                self.path,
+                state['input_file'],
+                state['table_name']))
+
+        self.start_rows = state['rows']
+        self.start_bytes = state['bytes']
+        return True
+
+    def mark(self, num_rows):
+        """The position after `num_rows` rows read in this run, to `save` once they are committed."""
+        num_bytes = None
+        if self.lines is not None:
+            num_bytes = self.lines.offset
+        return (self.start_rows + num_rows, num_bytes)
+
+    def save(self, mark):
+        rows, num_bytes = mark
+        state = {
+            'table_name': self.table_name,
+            'input_file': self.input_file,
+            'rows': rows,
+            'bytes': num_bytes
+        }
+        ## write then rename, so a crash never leaves a partial checkpoint
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w') as file:
+            json.dump(state, file)
+        os.replace(temp_path, self.path)
+
+    def clear(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
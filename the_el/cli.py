@@ -5,20 +5,25 @@ import os
 import re
 import codecs
 import logging
+import functools
+import threading
 from logging.config import dictConfig
 
 import click
-import yaml
-from sqlalchemy import create_engine
-from jsontableschema_sql import Storage
-from smart_open import smart_open
 
-from . import postgres
-from . import carto
+## backends and heavy dependencies, ie SQLAlchemy, are imported by the
+## commands using them, so starting the_el for one command stays fast
+from . import formats
+from . import metrics
+from . import writer
+from .connections import carto_connection_string_regex
+from .checkpoint import Checkpoint, CountingLines
 
 csv.field_size_limit(sys.maxsize)
 
 def get_logger(logging_config):
+    import yaml
+
     try:
         with open(logging_config) as file:
             config = yaml.load(file)
@@ -40,26 +45,166 @@ def get_logger(logging_config):
 def main():
     pass
 
+metrics_options = [
+    click.option('--metrics-file', help='Append a JSON line summarizing the run\'s phases, counters and rows/sec'),
+    click.option('--prometheus-file', help='Write the run summary as a Prometheus textfile'),
+    click.option('--progress-interval', type=float, help='Log rows and rows/sec every this many seconds'),
+    click.option('--profile', help='Write a cProfile of the run to this file, for `python -m pstats`')
+]
+
+def instrumented(command, name_param='table_name'):
+    """Adds the metrics options to a command, and runs it under `metrics.run`."""
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(metrics_file, prometheus_file, progress_interval, profile, **kwargs):
+            with metrics.run(logging.getLogger('the_el'),
+                             command,
+                             kwargs[name_param],
+                             metrics_file=metrics_file,
+                             prometheus_file=prometheus_file,
+                             progress_interval=progress_interval,
+                             profile_file=profile):
+                return func(**kwargs)
+
+        for option in reversed(metrics_options):
+            wrapper = option(wrapper)
+        return wrapper
+    return decorator
+
 def get_connection_string(connection_string):
     connection_string = os.getenv('CONNECTION_STRING', connection_string)
     if connection_string == None:
         raise Exception('`CONNECTION_STRING` environment variable or `--connection-string` option required')
     return connection_string
 
-def create_storage_adaptor(connection_string, db_schema, geometry_support, from_srid=None, to_srid=None):
-    engine = create_engine(connection_string)
-    storage = Storage(engine, dbschema=db_schema, geometry_support=geometry_support, from_srid=from_srid, to_srid=to_srid, views=True)
+def get_engine_options(connection_string, fetch_size=None):
+    from sqlalchemy.engine.url import make_url
+
+    options = {}
+    ## cx_Oracle fetches `arraysize` rows per round trip, 50 by default
+    if fetch_size != None and make_url(connection_string).drivername.split('+')[0] == 'oracle':
+        options['arraysize'] = fetch_size
+    return options
+
+def get_reflect_only(table_name):
+    ## reflecting every table in a large schema, ie Oracle SDE, takes far longer than the one used
+    if table_name == None:
+        return None
+    return lambda name: name.lower() == table_name.lower()
+
+## engines, and their connection pools, are shared by the commands run in one process, ie by `run`
+engines = {}
+engines_lock = threading.Lock()
+
+def get_engine(connection_string, fetch_size=None):
+    from sqlalchemy import create_engine
+
+    options = get_engine_options(connection_string, fetch_size=fetch_size)
+    key = (connection_string, tuple(sorted(options.items())))
+    with engines_lock:
+        if key not in engines:
+            engines[key] = create_engine(connection_string, **options)
+        return engines[key]
+
+def create_storage_adaptor(connection_string,
+                           db_schema,
+                           geometry_support,
+                           from_srid=None,
+                           to_srid=None,
+                           fetch_size=None,
+                           table_name=None,
+                           descriptor=None):
+    """Returns an engine and a storage adaptor reflecting `table_name`, or every table without one.
+
+    With a `descriptor` for `table_name`, ie from a schema file or the
+    describe cache, the table is not reflected and the storage describes it
+    by the descriptor. Only paths that never need the SQLAlchemy table, ie
+    the Postgres COPY paths, may pass one.
+    """
+    from jsontableschema_sql import Storage
+
+    reflect_only = get_reflect_only(table_name)
+    if descriptor != None:
+        reflect_only = lambda name: False
+
+    engine = get_engine(connection_string, fetch_size=fetch_size)
+    storage = Storage(engine,
+                      dbschema=db_schema,
+                      geometry_support=geometry_support,
+                      from_srid=from_srid,
+                      to_srid=to_srid,
+                      views=True,
+                      reflect_only=reflect_only)
+    if descriptor != None:
+        storage.describe(table_name, descriptor=descriptor)
     return engine, storage
 
-def fopen(file, mode='r'):
+def get_describe_cache(describe_cache, describe_cache_ttl, refresh_describe_cache):
+    from .describe_cache import DescriptorCache
+
+    describe_cache = os.getenv('THE_EL_DESCRIBE_CACHE', describe_cache)
+    if describe_cache == None:
+        return None
+    return DescriptorCache(describe_cache, ttl=describe_cache_ttl, refresh=refresh_describe_cache)
+
+def get_descriptor(logger, cache, connection_string, db_schema, geometry_support, table_name):
+    """Returns the table's descriptor from `cache`, reflecting the table on a miss or without a cache."""
+    def describe():
+        engine, storage = create_storage_adaptor(connection_string, db_schema, geometry_support, table_name=table_name)
+        return storage.describe(table_name)
+
+    if cache == None:
+        return describe()
+    engine = get_engine(connection_string)
+    return cache.describe(logger, engine, connection_string, db_schema, table_name, geometry_support, describe)
+
+def fopen(file, mode='r', ignore_extension=False):
     if file == None:
         if mode == 'r':
             return sys.stdin
+        elif mode == 'rb':
+            return sys.stdin.buffer
         elif mode == 'w':
             return sys.stdout
+        elif mode == 'wb':
+            return sys.stdout.buffer
     else:
+        from smart_open import smart_open
+        if ignore_extension:
+            ## smart_open compresses local files by their extension, ie .gz, even with `ignore_extension`
+            if '://' not in file:
+                return open(file, mode)
+            return smart_open(file, mode=mode, ignore_extension=True)
         return smart_open(file, mode=mode)
 
+def get_state_key(db_schema, table_name):
+    if db_schema:
+        return '{}.{}'.format(db_schema, table_name)
+    return table_name
+
+def load_state(logger, state_file):
+    try:
+        with fopen(state_file) as file:
+            contents = file.read()
+    except Exception:
+        logger.warning('Could not read state file {}, extracting all rows'.format(state_file))
+        return {}
+    if not isinstance(contents, str):
+        contents = contents.decode('utf-8')
+    return json.loads(contents)
+
+def save_state(state_file, state):
+    with fopen(state_file, mode='w') as file:
+        json.dump(state, file, indent=2, sort_keys=True)
+
+def get_since_where(since_column, since, upper):
+    where = '{} <= %(upper)s'.format(since_column)
+    params = {'upper': upper}
+    if since != None:
+        where = '{} > %(since)s AND '.format(since_column) + where
+        params['since'] = since
+    return where, params
+
 def get_table_schema(table_schema_path):
     with fopen(table_schema_path) as file:
         contents = file.read()
@@ -73,11 +218,25 @@ def get_table_schema(table_schema_path):
 @click.option('-o','--output-file')
 @click.option('--db-schema')
 @click.option('--geometry-support')
-def describe_table(table_name, connection_string, output_file, db_schema, geometry_support):
+@click.option('--describe-cache', help='Directory caching table descriptors between runs, or THE_EL_DESCRIBE_CACHE')
+@click.option('--describe-cache-ttl', type=int, default=86400, help='Seconds a cached descriptor is used for')
+@click.option('--refresh-describe-cache', is_flag=True, help='Reflect the table and replace its cached descriptor')
+@click.option('--logging-config', default='logging_config.conf')
+def describe_table(table_name,
+                   connection_string,
+                   output_file,
+                   db_schema,
+                   geometry_support,
+                   describe_cache,
+                   describe_cache_ttl,
+                   refresh_describe_cache,
+                   logging_config):
+    logger = get_logger(logging_config)
+
     connection_string = get_connection_string(connection_string)
 
-    engine, storage = create_storage_adaptor(connection_string, db_schema, geometry_support)
-    descriptor = storage.describe(table_name)
+    cache = get_describe_cache(describe_cache, describe_cache_ttl, refresh_describe_cache)
+    descriptor = get_descriptor(logger, cache, connection_string, db_schema, geometry_support, table_name)
 
     with fopen(output_file, mode='w') as file:
         json.dump(descriptor, file)
@@ -90,6 +249,8 @@ def describe_table(table_name, connection_string, output_file, db_schema, geomet
 @click.option('--indexes-fields')
 @click.option('--geometry-support')
 @click.option('--if-not-exists', is_flag=True, default=False)
+@click.option('--defer-indexes', is_flag=True,
+              help='Leave out the --indexes-fields indexes, for `write --indexes-fields` to build after loading')
 @click.option('--logging-config', default='logging_config.conf')
 def create_table(table_name,
                  table_schema_path,
@@ -98,137 +259,611 @@ def create_table(table_name,
                  indexes_fields,
                  geometry_support,
                  if_not_exists,
+                 defer_indexes,
                  logging_config):
     logger = get_logger(logging_config)
 
     table_schema = get_table_schema(table_schema_path)
 
+    if defer_indexes:
+        indexes_fields = None
     if indexes_fields != None:
         indexes_fields = indexes_fields.split(',')
 
-    if re.match(carto.carto_connection_string_regex, connection_string) != None:
+    if re.match(carto_connection_string_regex, connection_string) != None:
+        from . import carto
         load_postgis = geometry_support == 'postgis'
         logger.info('{} - Creating table using Carto'.format(table_name))
         return carto.create_table(logger, table_name, load_postgis, table_schema, if_not_exists, indexes_fields, connection_string)
 
     connection_string = get_connection_string(connection_string)
 
-    engine, storage = create_storage_adaptor(connection_string, db_schema, geometry_support)
+    engine, storage = create_storage_adaptor(connection_string, db_schema, geometry_support, table_name=table_name)
 
     logger.info('{} - Creating table using SQLAlchemy'.format(table_name))
     storage.create(table_name, table_schema, indexes_fields=indexes_fields)
 
+def load_rows(logger,
+              table_name,
+              table_schema,
+              connection_string,
+              rows,
+              db_schema=None,
+              geometry_support=None,
+              from_srid=None,
+              indexes_fields=None,
+              upsert=False,
+              dedupe=True,
+              differential=False,
+              allow_empty=False,
+              truncate=False,
+              workers=1,
+              concurrency=1,
+              carto_copy=False,
+              checkpoint=None,
+              commit_every=100000,
+              build_indexes=False,
+              index_concurrency=1):
+    """Loads rows into a table through the fastest path the destination and options allow.
+
+    With `build_indexes`, indexes on `indexes_fields` are built after the
+    rows are loaded, followed by an ANALYZE. Carto loads always build them.
+    """
+    if build_indexes and indexes_fields == None:
+        raise Exception('`--build-indexes` requires `--indexes-fields`')
+
+    if re.match(carto_connection_string_regex, connection_string) != None:
+        from . import carto
+        from . import geometry
+
+        if differential:
+            raise Exception('`--differential` is not supported by Carto')
+
+        load_postgis = geometry_support == 'postgis'
+
+        if indexes_fields != None:
+            indexes_fields = indexes_fields.split(',')
+
+        if from_srid != None and int(from_srid) != carto.carto_srid:
+            rows = geometry.reproject_rows(rows,
+                                           geometry.get_geometry_indexes(table_schema),
+                                           from_srid,
+                                           carto.carto_srid)
+
+        logger.info('{} - Writing to table using Carto'.format(table_name))
+
+        carto.load(logger,
+                   db_schema,
+                   table_name,
+                   load_postgis,
+                   table_schema,
+                   connection_string,
+                   rows,
+                   indexes_fields,
+                   truncate,
+                   concurrency=concurrency,
+                   use_copy=carto_copy,
+                   checkpoint=checkpoint,
+                   index_concurrency=index_concurrency)
+    else:
+        from . import postgres
+        from . import oracle
+        from . import mssql
+        from . import extract
+        from . import indexes
+
+        connection_string = get_connection_string(connection_string)
+
+        ## the Postgres COPY paths load by the table schema alone, so the table is not reflected for them
+        engine = get_engine(connection_string)
+        copy_load = (engine.dialect.driver == 'psycopg2' and
+                     (upsert or differential or checkpoint != None or geometry_support in [None, 'postgis']))
+        descriptor = None
+        if table_schema != None and copy_load and not build_indexes:
+            descriptor = table_schema
+
+        engine, storage = create_storage_adaptor(connection_string,
+                                                 db_schema,
+                                                 geometry_support,
+                                                 from_srid=from_srid,
+                                                 table_name=table_name,
+                                                 descriptor=descriptor)
+
+        ## TODO: truncate? carto does. Makes this idempotent
+
+        logger.info('{} - Writing to table using SQLAlchemy'.format(table_name))
+
+        if table_schema != None:
+            storage.describe(table_name, descriptor=table_schema)
+        else:
+            storage.describe(table_name)
+
+        if upsert:
+            inserted, updated = postgres.upsert(engine, db_schema, table_name, table_schema, rows, dedupe=dedupe)
+            logger.info('{} - Upserted rows - inserted: {} updated: {}'.format(table_name, inserted, updated))
+        elif differential:
+            if engine.dialect.driver != 'psycopg2':
+                raise Exception('`--differential` not supported for `{}`'.format(engine.dialect.driver))
+            inserted, updated, deleted = postgres.differential_load(engine,
+                                                                    db_schema,
+                                                                    table_name,
+                                                                    table_schema,
+                                                                    rows,
+                                                                    dedupe=dedupe,
+                                                                    allow_empty=allow_empty)
+            logger.info('{} - Differential load - inserted: {} updated: {} deleted: {}'.format(
+                table_name,
+                inserted,
+                updated,
+                deleted))
+        elif checkpoint != None:
+            if geometry_support != None or engine.dialect.driver != 'psycopg2':
+                raise Exception('`--checkpoint-file` requires Postgres without `--geometry-support`')
+            postgres.chunked_copy_from(logger, engine, table_name, table_schema, rows, commit_every, checkpoint)
+        elif geometry_support == 'postgis' and engine.dialect.driver == 'psycopg2':
+            postgres.copy_from_postgis(logger, engine, db_schema, table_name, table_schema, rows, from_srid=from_srid)
+        elif geometry_support == None and engine.dialect.driver == 'psycopg2':
+            if workers > 1:
+                postgres.parallel_copy_from(logger, engine, table_name, table_schema, rows, workers)
+            else:
+                postgres.copy_from(engine, table_name, table_schema, rows)
+        elif geometry_support == None and engine.dialect.driver == 'cx_oracle':
+            oracle.insert_rows(engine, extract.get_storage_table(storage, table_name), table_schema, rows)
+        elif geometry_support == None and engine.dialect.driver == 'pymssql':
+            mssql.insert_rows(engine, extract.get_storage_table(storage, table_name), table_schema, rows)
+        else:
+            with metrics.current.phase('write'):
+                storage.write(table_name, rows)
+
+        if build_indexes:
+            indexes.build_indexes(logger,
+                                  engine,
+                                  extract.get_storage_table(storage, table_name),
+                                  indexes_fields.split(','),
+                                  concurrency=index_concurrency)
+
 @main.command()
+@instrumented('write')
 @click.argument('table_name')
 @click.option('--table-schema-path')
 @click.option('--connection-string')
 @click.option('-f','--input-file')
+@click.option('--input-format', type=click.Choice(formats.input_formats),
+              help='Defaults to the format implied by the input file extension, or csv')
+@click.option('--delimiter', default=',', help='CSV field delimiter')
+@click.option('--quotechar', default='"', help='CSV quote character')
 @click.option('--db-schema')
 @click.option('--geometry-support')
 @click.option('--from-srid')
-@click.option('--skip-headers', is_flag=True)
+@click.option('--skip-headers', is_flag=True, help='Skip the CSV header row')
 @click.option('--indexes-fields')
 @click.option('--upsert', is_flag=True)
+@click.option('--dedupe/--no-dedupe', default=True,
+              help='Keep only the last row for each primary key when upserting or loading differentially, ' +
+                   '`--no-dedupe` fails on duplicates')
+@click.option('--differential', is_flag=True,
+              help='Only insert, update and delete the rows that differ from the table, by primary key')
+@click.option('--allow-empty', is_flag=True,
+              help='Let a --differential load of an empty input delete every row of the table')
 @click.option('--truncate/--no-truncate', is_flag=True, default=False)
+@click.option('--workers', type=int, default=1, help='Number of processes and connections used to COPY into Postgres')
+@click.option('--concurrency', type=int, default=1, help='Number of Carto INSERT batches in flight at once')
+@click.option('--carto-copy', is_flag=True, help='Stream rows to Carto through COPY FROM instead of INSERT batches')
+@click.option('--build-indexes', is_flag=True,
+              help='Build the --indexes-fields indexes and update statistics after loading, ie into a table ' +
+                   'created with `create_table --defer-indexes`')
+@click.option('--index-concurrency', type=int, default=4,
+              help='Number of --build-indexes indexes built at once, where the database allows')
+@click.option('--checkpoint-file', help='JSON file recording the input rows committed so far, for --resume')
+@click.option('--resume', is_flag=True, help='Continue a failed load from after the rows in --checkpoint-file')
+@click.option('--commit-every', type=int, default=100000, help='Rows per commit and checkpoint when COPYing into Postgres')
 @click.option('--logging-config', default='logging_config.conf')
 def write(table_name,
           table_schema_path,
           connection_string,
           input_file,
+          input_format,
+          delimiter,
+          quotechar,
           db_schema,
           geometry_support,
           from_srid,
           skip_headers,
           indexes_fields,
           upsert,
+          dedupe,
+          differential,
+          allow_empty,
           truncate,
+          workers,
+          concurrency,
+          carto_copy,
+          build_indexes,
+          index_concurrency,
+          checkpoint_file,
+          resume,
+          commit_every,
           logging_config):
     logger = get_logger(logging_config)
 
     table_schema = get_table_schema(table_schema_path)
 
-    ## TODO: csv settings? use Frictionless Data csv standard?
-    ## TODO: support line delimted json?
-    with fopen(input_file) as file:
-        rows = csv.reader(file)
-
-        if skip_headers:
-            next(rows)
-
-        if re.match(carto.carto_connection_string_regex, connection_string) != None:
-            load_postgis = geometry_support == 'postgis'
-
-            if indexes_fields != None:
-                indexes_fields = indexes_fields.split(',')
-
-            logger.info('{} - Writing to table using Carto'.format(table_name))
-
-            carto.load(logger,
-                       db_schema,
-                       table_name,
-                       load_postgis,
-                       table_schema,
-                       connection_string,
-                       rows,
-                       indexes_fields,
-                       truncate)
+    input_format = formats.get_input_format(input_format, input_file)
+    mode = 'r'
+    if input_format in formats.binary_input_formats:
+        mode = 'rb'
+
+    if resume and checkpoint_file == None:
+        raise Exception('`--resume` requires `--checkpoint-file`')
+
+    checkpoint = None
+    if checkpoint_file != None:
+        if input_format != 'csv':
+            raise Exception('`--checkpoint-file` is only supported for csv input')
+        if upsert or differential or workers > 1 or concurrency > 1:
+            raise Exception('`--checkpoint-file` is not supported with `--upsert`, `--differential`, `--workers` or `--concurrency`')
+        checkpoint = Checkpoint(checkpoint_file, table_name, input_file)
+        if resume:
+            ## starting over would truncate and reload what the failed run committed
+            if not checkpoint.load():
+                raise Exception('No checkpoint {} to `--resume` from'.format(checkpoint_file))
+            logger.info('{} - Resuming after {} rows'.format(table_name, checkpoint.start_rows))
         else:
-            connection_string = get_connection_string(connection_string)
-
-            engine, storage = create_storage_adaptor(connection_string, db_schema, geometry_support, from_srid=from_srid)
+            ## a load failing before its first commit can still be resumed
+            checkpoint.save((0, 0))
+        ## csv is read as bytes, to track the offset of each committed row
+        mode = 'rb'
+
+    with fopen(input_file, mode=mode) as file:
+        source = file
+        offset = 0
+        skip_rows = 0
+        if checkpoint != None:
+            if checkpoint.start_bytes != None and input_file != None and file.seekable():
+                file.seek(checkpoint.start_bytes)
+                offset = checkpoint.start_bytes
+            else:
+                skip_rows = checkpoint.start_rows
+            source = checkpoint.lines = CountingLines(file, offset=offset)
 
-            ## TODO: truncate? carto does. Makes this idempotent
+        rows = formats.read_rows(input_format, source, table_schema, delimiter=delimiter, quotechar=quotechar)
 
-            logger.info('{} - Writing to table using SQLAlchemy'.format(table_name))
+        if skip_headers and input_format == 'csv' and offset == 0:
+            next(rows)
 
-            if table_schema_path != None:
-                table_schema = get_table_schema(table_schema_path)
-                storage.describe(table_name, descriptor=table_schema)
-            else:
-                storage.describe(table_name)
+        for i in range(skip_rows):
+            next(rows)
 
-            if upsert:
-                postgres.upsert(engine, db_schema, table_name, table_schema, rows)
-            elif geometry_support == None and engine.dialect.driver == 'psycopg2':
-                postgres.copy_from(engine, table_name, table_schema, rows)
-            else:
-                storage.write(table_name, rows)
+        rows = metrics.current.timed('parse', rows, counter='rows')
+
+        load_rows(logger,
+                  table_name,
+                  table_schema,
+                  connection_string,
+                  rows,
+                  db_schema=db_schema,
+                  geometry_support=geometry_support,
+                  from_srid=from_srid,
+                  indexes_fields=indexes_fields,
+                  upsert=upsert,
+                  dedupe=dedupe,
+                  differential=differential,
+                  allow_empty=allow_empty,
+                  truncate=truncate,
+                  workers=workers,
+                  concurrency=concurrency,
+                  carto_copy=carto_copy,
+                  checkpoint=checkpoint,
+                  commit_every=commit_every,
+                  build_indexes=build_indexes,
+                  index_concurrency=index_concurrency)
+
+    if checkpoint != None:
+        checkpoint.clear()
 
 @main.command()
+@instrumented('read')
 @click.argument('table_name')
 @click.option('--connection-string')
 @click.option('-o','--output-file')
+@click.option('--output-format', type=click.Choice(formats.output_formats), default='csv')
 @click.option('--db-schema')
 @click.option('--geometry-support')
 @click.option('--from-srid')
 @click.option('--to-srid')
+@click.option('--fetch-size', type=int, default=10000, help='Rows fetched and written per batch')
+@click.option('--parallel', type=int, default=1, help='Number of connections reading key range partitions at once')
+@click.option('--partition-column', help='Integer column to partition on for --parallel, defaults to the primary key')
+@click.option('--since-column', help='Timestamp or sequence column to extract only new rows by, requires --state-file')
+@click.option('--state-file', help='JSON file keeping the high-water mark of --since-column between runs')
+@click.option('--columns', help='Comma separated columns to extract, in output order, defaults to all')
+@click.option('--where', help='SQL condition rows are extracted by, run in the database')
+@click.option('--order-by', help='SQL ORDER BY expression')
+@click.option('--limit', type=int, help='Maximum number of rows to extract')
+@click.option('--compression', type=click.Choice(writer.compressions),
+              help='Compress the output, on a background thread overlapping with fetching rows')
+@click.option('--describe-cache', help='Directory caching table descriptors between runs, or THE_EL_DESCRIBE_CACHE. ' +
+                                       'Used where the rows are read by Postgres COPY')
+@click.option('--describe-cache-ttl', type=int, default=86400, help='Seconds a cached descriptor is used for')
+@click.option('--refresh-describe-cache', is_flag=True, help='Reflect the table and replace its cached descriptor')
 @click.option('--logging-config', default='logging_config.conf')
-def read(table_name, connection_string, output_file, db_schema, geometry_support, from_srid, to_srid, logging_config):
+def read(table_name,
+         connection_string,
+         output_file,
+         output_format,
+         db_schema,
+         geometry_support,
+         from_srid,
+         to_srid,
+         fetch_size,
+         parallel,
+         partition_column,
+         since_column,
+         state_file,
+         columns,
+         where,
+         order_by,
+         limit,
+         compression,
+         describe_cache,
+         describe_cache_ttl,
+         refresh_describe_cache,
+         logging_config):
+    from sqlalchemy import text, and_
+    from . import postgres
+    from . import extract
+    from . import geometry
+
     logger = get_logger(logging_config)
 
+    if parallel > 1 and (order_by != None or limit != None):
+        raise Exception('`--order-by` and `--limit` are not supported with `--parallel`')
+
     connection_string = get_connection_string(connection_string)
 
-    engine, storage = create_storage_adaptor(connection_string, db_schema, geometry_support, from_srid=from_srid, to_srid=to_srid)
+    ## reprojected in batches by the_el, rather than geometry by geometry by the storage
+    reproject = from_srid != None and to_srid != None
+
+    driver = get_engine(connection_string, fetch_size=fetch_size).dialect.driver
+    copy_read = output_format == 'csv' and geometry_support == None and driver == 'psycopg2'
+
+    ## COPY only needs the descriptor, which the cache spares reflecting the table for. Other reads select
+    ## through the reflected SQLAlchemy table, so they reflect it either way.
+    descriptor = None
+    cache = get_describe_cache(describe_cache, describe_cache_ttl, refresh_describe_cache)
+    if cache != None and copy_read and since_column == None:
+        descriptor = get_descriptor(logger, cache, connection_string, db_schema, geometry_support, table_name)
+
+    engine, storage = create_storage_adaptor(connection_string,
+                                             db_schema,
+                                             geometry_support,
+                                             from_srid=None if reproject else from_srid,
+                                             to_srid=None if reproject else to_srid,
+                                             fetch_size=fetch_size,
+                                             table_name=table_name,
+                                             descriptor=descriptor)
+
+    condition = None
+    if since_column != None:
+        if state_file == None:
+            raise Exception('`--state-file` required with `--since-column`')
+
+        state = load_state(logger, state_file)
+        state_key = get_state_key(db_schema, table_name)
+        since = None
+        if state_key in state and state[state_key]['column'] == since_column:
+            since = extract.decode_watermark(state[state_key])
+
+        table = extract.get_storage_table(storage, table_name)
+        upper = extract.get_high_water_mark(engine, table, since_column, since=since)
+        logger.info('{} - Extracting rows where {} > {} and <= {}'.format(table_name, since_column, since, upper))
+
+        if upper == None: ## no new rows, extract none
+            upper = since
+        condition = extract.get_since_condition(table, since_column, since, upper)
+
+    query_condition = condition
+    if where != None:
+        if condition is not None:
+            query_condition = and_(condition, text(where))
+        else:
+            query_condition = text(where)
 
     ## TODO: csv settings? use Frictionless Data csv standard?
-    ## TODO: support line delimited json?
-    with fopen(output_file, mode='w') as file:
-        writer = csv.writer(file)
+    with fopen(output_file, mode='wb', ignore_extension=compression != None) as destination, writer.BackgroundWriter(destination, compression=compression) as file:
+        table_descriptor = storage.describe(table_name)
+        descriptor = table_descriptor
+        select_columns = None
+        if columns != None:
+            descriptor = extract.project_descriptor(table_descriptor, columns.split(','))
+            select_columns = [field['name'] for field in descriptor['fields']]
+        output = formats.get_output(output_format, file, descriptor)
+
+        if copy_read:
+            params = None
+            if condition is not None:
+                since_where, params = get_since_where(since_column, since, upper)
+                if where != None:
+                    ## escaped, as the statement is rendered with the since parameters
+                    where = '({}) AND {}'.format(where.replace('%', '%%'), since_where)
+                else:
+                    where = since_where
+            num_rows = postgres.copy_to(engine,
+                                        table_name,
+                                        file,
+                                        where=where,
+                                        params=params,
+                                        columns=select_columns,
+                                        order_by=order_by,
+                                        limit=limit)
+            if num_rows >= 0:
+                metrics.current.count('rows', num_rows)
+        else:
+            if parallel > 1:
+                batches = extract.parallel_iter_batches(logger,
+                                                        engine,
+                                                        storage,
+                                                        table_name,
+                                                        table_descriptor,
+                                                        parallel,
+                                                        partition_column=partition_column,
+                                                        fetch_size=fetch_size,
+                                                        condition=query_condition,
+                                                        columns=select_columns)
+            elif query_condition is not None or select_columns != None or order_by != None or limit != None:
+                table = extract.get_storage_table(storage, table_name)
+                statement = extract.get_select(table,
+                                               columns=select_columns,
+                                               condition=query_condition,
+                                               order_by=order_by,
+                                               limit=limit)
+                rows = extract.iter_select(engine, statement, fetch_size)
+                batches = extract.iter_batches(rows, fetch_size)
+            else:
+                batches = extract.iter_batches(storage.iter(table_name), fetch_size)
 
-        descriptor = storage.describe(table_name)
-        fields = map(lambda x: x['name'], descriptor['fields'])
-        writer.writerow(fields)
+            if reproject:
+                batches = geometry.reproject_batches(batches,
+                                                     geometry.get_geometry_indexes(descriptor),
+                                                     from_srid,
+                                                     to_srid)
 
-        if geometry_support == None and engine.dialect.driver == 'psycopg2':
-            postgres.copy_to(engine, table_name, file)
-        else:
-            for row in storage.iter(table_name):
-                row_out = []
-                for field in row:
-                    if isinstance(field, dict) or isinstance(field, list):
-                        field = json.dumps(field)
-                    row_out.append(field)
-                writer.writerow(row_out)
+            for batch in metrics.current.timed('fetch', batches):
+                metrics.current.count('rows', len(batch))
+                with metrics.current.phase('write'):
+                    output.write_batch(batch)
+
+        output.close()
+
+    logger.info('{} - {}'.format(table_name, file.summary()))
+
+    if since_column != None and upper != None:
+        state[state_key] = extract.encode_watermark(since_column, upper)
+        save_state(state_file, state)
+        logger.info('{} - Saved high-water mark {} = {}'.format(table_name, since_column, upper))
+
+@main.command()
+@instrumented('transfer', name_param='dest_table')
+@click.argument('source_table')
+@click.argument('dest_table')
+@click.option('--source-connection-string', required=True)
+@click.option('--source-db-schema')
+@click.option('--source-geometry-support')
+@click.option('--connection-string', help='Destination connection string')
+@click.option('--db-schema', help='Destination schema')
+@click.option('--geometry-support', help='Destination geometry support')
+@click.option('--table-schema-path', help='Destination table schema, defaults to the source table\'s')
+@click.option('--from-srid')
+@click.option('--to-srid')
+@click.option('--fetch-size', type=int, default=10000, help='Rows fetched and queued per batch')
+@click.option('--queue-size', type=int, default=4, help='Batches fetched ahead of the load at most')
+@click.option('--parallel', type=int, default=1, help='Number of connections reading key range partitions at once')
+@click.option('--partition-column', help='Integer column to partition on for --parallel, defaults to the primary key')
+@click.option('--indexes-fields')
+@click.option('--upsert', is_flag=True)
+@click.option('--dedupe/--no-dedupe', default=True,
+              help='Keep only the last row for each primary key when upserting, `--no-dedupe` fails on duplicates')
+@click.option('--truncate/--no-truncate', is_flag=True, default=False)
+@click.option('--workers', type=int, default=1, help='Number of processes and connections used to COPY into Postgres')
+@click.option('--concurrency', type=int, default=1, help='Number of Carto INSERT batches in flight at once')
+@click.option('--carto-copy', is_flag=True, help='Stream rows to Carto through COPY FROM instead of INSERT batches')
+@click.option('--build-indexes', is_flag=True,
+              help='Build the --indexes-fields indexes and update statistics after loading, ie into a table ' +
+                   'created with `create_table --defer-indexes`')
+@click.option('--index-concurrency', type=int, default=4,
+              help='Number of --build-indexes indexes built at once, where the database allows')
+@click.option('--logging-config', default='logging_config.conf')
+def transfer(source_table,
+             dest_table,
+             source_connection_string,
+             source_db_schema,
+             source_geometry_support,
+             connection_string,
+             db_schema,
+             geometry_support,
+             table_schema_path,
+             from_srid,
+             to_srid,
+             fetch_size,
+             queue_size,
+             parallel,
+             partition_column,
+             indexes_fields,
+             upsert,
+             dedupe,
+             truncate,
+             workers,
+             concurrency,
+             carto_copy,
+             build_indexes,
+             index_concurrency,
+             logging_config):
+    """Streams the rows of a table in one database into a table in another, without a file in between."""
+    from . import extract
+    from . import geometry
+
+    logger = get_logger(logging_config)
+
+    reproject = from_srid != None and to_srid != None
+
+    engine, storage = create_storage_adaptor(source_connection_string,
+                                             source_db_schema,
+                                             source_geometry_support,
+                                             from_srid=None if reproject else from_srid,
+                                             to_srid=None if reproject else to_srid,
+                                             fetch_size=fetch_size,
+                                             table_name=source_table)
+
+    descriptor = storage.describe(source_table)
+    if table_schema_path != None:
+        table_schema = get_table_schema(table_schema_path)
+    else:
+        table_schema = descriptor
+
+    if parallel > 1:
+        batches = extract.parallel_iter_batches(logger,
+                                                engine,
+                                                storage,
+                                                source_table,
+                                                descriptor,
+                                                parallel,
+                                                partition_column=partition_column,
+                                                fetch_size=fetch_size)
+    else:
+        batches = extract.iter_batches(storage.iter(source_table), fetch_size)
+
+    if reproject:
+        batches = geometry.reproject_batches(batches, geometry.get_geometry_indexes(descriptor), from_srid, to_srid)
+
+    ## the loaders take nested values as JSON text, as read from a file, so they are encoded on the fetching thread
+    nested_indexes = formats.get_nested_indexes(descriptor)
+    batches = (formats.serialize_batch(batch, nested_indexes) for batch in batches)
+
+    logger.info('{} - Transferring rows from {}'.format(dest_table, source_table))
+
+    def iter_rows():
+        for batch in extract.queued_batches(batches, queue_size):
+            metrics.current.count('rows', len(batch))
+            for row in batch:
+                yield row
+
+    load_rows(logger,
+              dest_table,
+              table_schema,
+              connection_string,
+              iter_rows(),
+              db_schema=db_schema,
+              geometry_support=geometry_support,
+              from_srid=to_srid,
+              indexes_fields=indexes_fields,
+              upsert=upsert,
+              dedupe=dedupe,
+              truncate=truncate,
+              workers=workers,
+              concurrency=concurrency,
+              carto_copy=carto_copy,
+              build_indexes=build_indexes,
+              index_concurrency=index_concurrency)
 
 @main.command()
 @click.argument('new_table_name')
@@ -240,7 +875,8 @@ def read(table_name, connection_string, output_file, db_schema, geometry_support
 def swap_table(new_table_name, old_table_name, connection_string, db_schema, select_users, logging_config):
     logger = get_logger(logging_config)
 
-    if re.match(carto.carto_connection_string_regex, connection_string) != None:
+    if re.match(carto_connection_string_regex, connection_string) != None:
+        from . import carto
         if select_users != None:
             select_users = select_users.split(',')
         else:
@@ -249,7 +885,7 @@ def swap_table(new_table_name, old_table_name, connection_string, db_schema, sel
         return carto.swap_table(logger, db_schema, new_table_name, old_table_name, select_users, connection_string)
 
     connection_string = get_connection_string(connection_string)
-    engine = create_engine(connection_string)
+    engine = get_engine(connection_string)
  
     if engine.dialect.driver == 'psycopg2':
         logger.info('Swapping tables using psycopg2: {} - {}'.format(new_table_name, old_table_name))
@@ -310,3 +946,56 @@ def swap_table(new_table_name, old_table_name, connection_string, db_schema, sel
             raise
     else:
         raise Exception('`{}` not supported by swap_table'.format(engine.dialect.driver))
+
+@main.command()
+@instrumented('run', name_param='pipeline_file')
+@click.argument('pipeline_file')
+@click.option('--workers', type=int, help='Number of steps run at once, overrides the pipeline\'s `workers`')
+@click.option('--status-file', help='Write the status and seconds of each step to this JSON file')
+@click.option('--logging-config', default='logging_config.conf')
+def run(pipeline_file, workers, status_file, logging_config):
+    """Runs the steps of a pipeline YAML file in one process, sharing engines between them."""
+    from . import pipeline
+
+    logger = get_logger(logging_config)
+    ctx = click.get_current_context()
+
+    with fopen(pipeline_file) as file:
+        pipeline_workers, steps = pipeline.load_pipeline(file)
+
+    for step in steps:
+        param_names = [param.name for param in main.commands[step.command].params]
+        unknown = [name for name in step.params if name not in param_names]
+        if unknown:
+            raise Exception('Pipeline step `{}` has unknown `{}` parameters: {}'.format(
+                step.name,
+                step.command,
+                ', '.join(unknown)))
+
+    def invoke(step):
+        params = dict(step.params)
+        if 'logging_config' in [param.name for param in main.commands[step.command].params]:
+            params.setdefault('logging_config', logging_config)
+        ctx.invoke(main.commands[step.command], **params)
+
+    pipeline.run_pipeline(logger, steps, invoke, workers or pipeline_workers)
+
+    for step in steps:
+        metrics.current.count('steps_' + step.status)
+        logger.info('{} - {}{}'.format(step.name,
+                                       step.status,
+                                       '' if step.elapsed is None else ' in {:.3f}s'.format(step.elapsed)))
+
+    if status_file != None:
+        with fopen(status_file, mode='w') as file:
+            json.dump([{
+                'name': step.name,
+                'command': step.command,
+                'status': step.status,
+                'elapsed': step.elapsed,
+                'error': step.error
+            } for step in steps], file, indent=2)
+
+    failed = [step.name for step in steps if step.status != 'success']
+    if failed:
+        raise Exception('Pipeline steps did not succeed: {}'.format(', '.join(failed)))
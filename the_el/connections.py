@@ -0,0 +1,2 @@
+## kept apart from carto.py, so telling a Carto connection string apart does not import Carto's dependencies
+carto_connection_string_regex = r'^carto://(.+):(.+)'
@@ -0,0 +1,128 @@
+import os
+import json
+import time
+import hashlib
+
+from sqlalchemy import text
+from sqlalchemy.engine.url import make_url
+
+## a cheap query per dialect whose result changes when the table's DDL does
+fingerprint_sql = {
+    'oracle': '''
+        SELECT to_char(last_ddl_time, 'YYYY-MM-DD HH24:MI:SS') FROM all_objects
+        WHERE owner = :schema AND object_name = :table_name AND object_type IN ('TABLE', 'VIEW')
+    ''',
+    'postgresql': '''
+        SELECT md5(
+            coalesce((SELECT string_agg(attname || ' ' || format_type(atttypid, atttypmod) || ' ' || attnotnull, ','
+                                        ORDER BY attnum)
+                      FROM pg_attribute
+                      WHERE attrelid = c.oid AND attnum > 0 AND NOT attisdropped), '') ||
+            coalesce((SELECT string_agg(pg_get_constraintdef(oid), ',' ORDER BY conname)
+                      FROM pg_constraint
+                      WHERE conrelid = c.oid), ''))
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = :schema AND c.relname = :table_name
+    ''',
+    'mssql': '''
+        SELECT convert(varchar(30), o.modify_date, 126) FROM sys.objects o
+        JOIN sys.schemas s ON s.schema_id = o.schema_id
+        WHERE s.name = :schema AND o.name = :table_name
+    '''
+}
+
+default_schemas = {
+    'postgresql': 'public',
+    'mssql': 'dbo'
+}
+
+def get_fingerprint(engine, db_schema, table_name):
+    """Returns a value that changes when the table's DDL does, or None where the dialect has no cheap way to tell."""
+    dialect = engine.dialect.name
+    if dialect not in fingerprint_sql:
+        return None
+
+    if dialect == 'oracle':
+        ## Oracle stores unquoted names in upper case
+        schema = (db_schema or engine.url.username).upper()
+        table_name = table_name.upper()
+    else:
+        schema = db_schema or default_schemas[dialect]
+
+    with engine.connect() as conn:
+        fingerprint = conn.execute(text(fingerprint_sql[dialect]), schema=schema, table_name=table_name).scalar()
+    if fingerprint is None:
+        return None
+    return str(fingerprint)
+
+def get_connection_target(connection_string):
+    ## the password is left out, so rotating it does not invalidate the cache
+    url = make_url(connection_string)
+    return '{}://{}@{}:{}/{}'.format(url.drivername, url.username, url.host, url.port, url.database)
+
+class DescriptorCache(object):
+    """On-disk cache of table descriptors, to skip reflection on repeated runs.
+
+    Entries are keyed by connection target, schema, table and geometry
+    support, and hold the table's DDL fingerprint when they were stored.
+    An entry is used while it is younger than `ttl` seconds and the
+    fingerprint still matches. Dialects without a fingerprint rely on the
+    `ttl` alone.
+    """
+
+    def __init__(self, cache_dir, ttl=None, refresh=False):
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.refresh = refresh
+
+    def get_path(self, connection_string, db_schema, table_name, geometry_support):
+        key = json.dumps([get_connection_target(connection_string), db_schema, table_name, geometry_support])
+        return os.path.join(self.cache_dir, hashlib.sha1(key.encode('utf-8')).hexdigest() + '.json')
+
+    def get(self, path, fingerprint):
+        if self.refresh or not os.path.exists(path):
+            return None
+
+        try:
+            with open(path) as file:
+                entry = json.load(file)
+        except ValueError: ## partially written or corrupt, treated as a miss
+            return None
+
+        if self.ttl is not None and time.time() - entry['cached_at'] > self.ttl:
+            return None
+        if entry['fingerprint'] != fingerprint:
+            return None
+        return entry['descriptor']
+
+    def put(self, path, fingerprint, descriptor):
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entry = {
+            'cached_at': time.time(),
+            'fingerprint': fingerprint,
+            'descriptor': descriptor
+        }
+        ## write then rename, so concurrent runs never read a partial entry
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp_path, 'w') as file:
+            json.dump(entry, file)
+        os.replace(temp_path, path)
+
+    def describe(self, logger, engine, connection_string, db_schema, table_name, geometry_support, describe):
+        """Returns the cached descriptor for the table, or calls `describe()` and caches its result."""
+        path = self.get_path(connection_string, db_schema, table_name, geometry_support)
+
+        try:
+            fingerprint = get_fingerprint(engine, db_schema, table_name)
+        except Exception as e:
+            logger.warning('{} - Could not fingerprint table DDL, relying on cache TTL: {}'.format(table_name, e))
+            fingerprint = None
+
+        descriptor = self.get(path, fingerprint)
+        if descriptor is not None:
+            logger.info('{} - Using cached descriptor'.format(table_name))
+            return descriptor
+
+        descriptor = describe()
+        self.put(path, fingerprint, descriptor)
+        return descriptor
@@ -0,0 +1,298 @@
+import math
+import queue
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+
+from sqlalchemy import select, func, text, and_, or_
+from sqlalchemy.pool import QueuePool
+
+from . import metrics
+
+def iter_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if len(batch) > 0:
+        yield batch
+
+def get_storage_table(storage, table_name):
+    ## the reflected table storage.iter selects from, so column types and conversions match
+    return storage._Storage__get_table(table_name)
+
+def get_column(table, column_name):
+    ## reflection normalizes case insensitive names, ie Oracle's upper case, to lower case
+    if column_name not in table.c and column_name.lower() in table.c:
+        column_name = column_name.lower()
+    return table.c[column_name]
+
+def get_partition_column(descriptor, partition_column):
+    if partition_column is None:
+        primary_key = descriptor.get('primaryKey')
+        if isinstance(primary_key, list) and len(primary_key) == 1:
+            primary_key = primary_key[0]
+        if not isinstance(primary_key, str):
+            raise Exception('`--partition-column` or a single column `primaryKey` required for parallel reads')
+        partition_column = primary_key
+    return partition_column
+
+def get_partition_ranges(engine, table, column_name, num_partitions, condition=None):
+    column = get_column(table, column_name)
+    statement = select([func.min(column), func.max(column)])
+    if condition is not None:
+        statement = statement.where(condition)
+    with engine.connect() as conn:
+        lower, upper = conn.execute(statement).fetchone()
+
+    if lower is None:
+        return [(None, None)]
+    try:
+        lower = int(math.floor(lower))
+        upper = int(math.floor(upper))
+    except TypeError:
+        raise Exception('Partition column `{}` must be a numeric column'.format(column_name))
+
+    num_partitions = min(num_partitions, upper - lower + 1)
+    step = (upper - lower + 1) // num_partitions
+    ## the last range picks up the remainder of the integer division
+    boundaries = [lower + step * i for i in range(num_partitions)] + [upper + 1]
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+def get_partition_select(table, column_name, lower, upper, is_last, condition=None, columns=None):
+    column = get_column(table, column_name)
+    statement = get_select(table, columns=columns)
+    if condition is not None:
+        statement = statement.where(condition)
+    if lower is not None:
+        condition = and_(column >= lower, column < upper)
+        if is_last:
+            condition = or_(condition, column == None)
+        statement = statement.where(condition)
+    return statement.order_by(column)
+
+def as_list(value):
+    if isinstance(value, list):
+        return value
+    return [value]
+
+def project_descriptor(descriptor, columns):
+    """Returns a copy of the descriptor with only `columns`, in their given order.
+
+    Keys are kept only when all of their columns are.
+    """
+    fields = {field['name'].lower(): field for field in descriptor['fields']}
+    unknown = [column for column in columns if column.lower() not in fields]
+    if unknown:
+        raise Exception('Columns not in table: {}'.format(', '.join(unknown)))
+
+    projected = dict(descriptor)
+    projected['fields'] = [fields[column.lower()] for column in columns]
+    names = [field['name'] for field in projected['fields']]
+
+    if not all([key in names for key in as_list(descriptor.get('primaryKey', []))]):
+        del projected['primaryKey']
+    if 'foreignKeys' in descriptor:
+        projected['foreignKeys'] = [foreign_key for foreign_key in descriptor['foreignKeys']
+                                    if all([key in names for key in as_list(foreign_key['fields'])])]
+    return projected
+
+def get_select(table, columns=None, condition=None, order_by=None, limit=None):
+    """Selects `columns`, or all of the table's, with an optional condition, SQL ORDER BY text and limit."""
+    if columns:
+        statement = select([get_column(table, column) for column in columns])
+    else:
+        statement = table.select()
+    if condition is not None:
+        statement = statement.where(condition)
+    if order_by is not None:
+        statement = statement.order_by(text(order_by))
+    if limit is not None:
+        statement = statement.limit(limit)
+    return statement
+
+def get_high_water_mark(engine, table, column_name, since=None):
+    column = get_column(table, column_name)
+    statement = select([func.max(column)])
+    if since is not None:
+        statement = statement.where(column > since)
+    with engine.connect() as conn:
+        return conn.execute(statement).scalar()
+
+def get_since_condition(table, column_name, since, upper):
+    """Rows after the last run's high-water mark, up to the one this run will record."""
+    column = get_column(table, column_name)
+    condition = column <= upper
+    if since is not None:
+        condition = and_(column > since, condition)
+    return condition
+
+def encode_watermark(column_name, value):
+    if isinstance(value, datetime):
+        value_type, value = 'datetime', value.isoformat()
+    elif isinstance(value, date):
+        value_type, value = 'date', value.isoformat()
+    elif isinstance(value, Decimal):
+        value_type, value = 'decimal', str(value)
+    elif isinstance(value, (int, float)):
+        value_type = 'number'
+    else:
+        value_type, value = 'string', str(value)
+    return {'column': column_name, 'type': value_type, 'value': value}
+
+def decode_watermark(watermark):
+    value = watermark['value']
+    if watermark['type'] == 'datetime':
+        return datetime.fromisoformat(value)
+    elif watermark['type'] == 'date':
+        return date.fromisoformat(value)
+    elif watermark['type'] == 'decimal':
+        return Decimal(value)
+    return value
+
+def iter_select(engine, statement, fetch_size):
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True, max_row_buffer=fetch_size).execute(statement)
+        while True:
+            rows = result.fetchmany(fetch_size)
+            if not rows:
+                break
+            for row in rows:
+                yield list(row)
+
+def get_max_connections(engine):
+    """Connections the engine's pool hands out at once before blocking, None when unbounded."""
+    pool = engine.pool
+    if isinstance(pool, QueuePool) and pool._max_overflow >= 0:
+        return pool.size() + pool._max_overflow
+    return None
+
+## marks the end of the batches in a queue
+end_of_batches = object()
+
+def extract_partition(engine, statement, fetch_size, batch_queue, stopped, errors):
+    rows = iter_select(engine, statement, fetch_size)
+    try:
+        produce_batches(iter_batches(rows, fetch_size), batch_queue, stopped, errors)
+    finally:
+        ## when stopped early, ends the partition's query and returns its connection to the pool
+        rows.close()
+
+def parallel_iter_batches(logger,
+                          engine,
+                          storage,
+                          table_name,
+                          descriptor,
+                          num_partitions,
+                          partition_column=None,
+                          fetch_size=10000,
+                          condition=None,
+                          columns=None,
+                          queue_size=4):
+    """Extracts key range partitions of a table on separate connections at once.
+
+    Batches are yielded in partition order, so the output is ordered by the
+    partition column whatever format it is written in. Each partition
+    fetches at most `queue_size` batches ahead of the consumer, so memory
+    is bounded, and stops at its next fetch once the consumer stops.
+    Partitions are limited to the connections the engine's pool allows.
+    """
+    max_connections = get_max_connections(engine)
+    if max_connections != None and num_partitions > max_connections:
+        logger.warning('{} - Reading {} partitions instead of {}, the most connections the pool allows'.format(
+            table_name,
+            max_connections,
+            num_partitions))
+        num_partitions = max_connections
+
+    table = get_storage_table(storage, table_name)
+    partition_column = get_partition_column(descriptor, partition_column)
+    ranges = get_partition_ranges(engine, table, partition_column, num_partitions, condition=condition)
+
+    logger.info('{} - Reading {} partitions on {}'.format(table_name, len(ranges), partition_column))
+
+    stopped = threading.Event()
+    errors = []
+    partitions = []
+    for i, (lower, upper) in enumerate(ranges):
+        statement = get_partition_select(table,
+                                         partition_column,
+                                         lower,
+                                         upper,
+                                         i == len(ranges) - 1,
+                                         condition=condition,
+                                         columns=columns)
+        batch_queue = queue.Queue(maxsize=queue_size)
+        thread = threading.Thread(target=extract_partition,
+                                  args=(engine, statement, fetch_size, batch_queue, stopped, errors))
+        thread.daemon = True
+        thread.start()
+        partitions.append((thread, batch_queue))
+
+    try:
+        for thread, batch_queue in partitions:
+            while True:
+                with metrics.current.phase('queue_wait'):
+                    batch = batch_queue.get()
+                if errors:
+                    raise errors[0]
+                if batch is end_of_batches:
+                    break
+                yield batch
+    finally:
+        stopped.set()
+        for thread, batch_queue in partitions:
+            thread.join()
+
+def produce_batches(batches, batch_queue, stopped, errors):
+    try:
+        for batch in metrics.current.timed('fetch', batches):
+            while not stopped.is_set():
+                try:
+                    batch_queue.put(batch, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+            if stopped.is_set():
+                return
+    except Exception as e:
+        errors.append(e)
+    finally:
+        ## blocks until there is room, unless the consumer has gone
+        while not stopped.is_set():
+            try:
+                batch_queue.put(end_of_batches, timeout=0.1)
+                break
+            except queue.Full:
+                pass
+
+def queued_batches(batches, queue_size):
+    """Yields `batches` produced on a background thread, at most `queue_size` batches ahead.
+
+    Fetching the next batches overlaps with whatever the consumer does
+    with the current one, while the bounded queue keeps memory to
+    `queue_size` batches when the consumer is the slower side. Errors
+    raised producing batches are raised to the consumer.
+    """
+    batch_queue = queue.Queue(maxsize=queue_size)
+    stopped = threading.Event()
+    errors = []
+
+    thread = threading.Thread(target=produce_batches, args=(batches, batch_queue, stopped, errors))
+    thread.daemon = True
+    thread.start()
+
+    try:
+        while True:
+            with metrics.current.phase('queue_wait'):
+                batch = batch_queue.get()
+            if batch is end_of_batches:
+                break
+            yield batch
+        thread.join()
+        if errors:
+            raise errors[0]
+    finally:
+        stopped.set()
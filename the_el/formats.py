@@ -0,0 +1,286 @@
+import os
+import csv
+import json
+import shutil
+import tempfile
+from datetime import date, datetime, time
+from decimal import Decimal
+
+output_formats = ['csv', 'ndjson', 'arrow', 'parquet']
+
+binary_output_formats = ['arrow', 'parquet']
+
+input_formats = ['csv', 'ndjson', 'arrow', 'parquet']
+
+binary_input_formats = ['arrow', 'parquet']
+
+input_format_extensions = {
+    '.csv': 'csv',
+    '.ndjson': 'ndjson',
+    '.jsonl': 'ndjson',
+    '.arrow': 'arrow',
+    '.feather': 'arrow',
+    '.parquet': 'parquet'
+}
+
+nested_types = ['object', 'array', 'geojson']
+
+def get_nested_indexes(descriptor):
+    return [index for index, field in enumerate(descriptor['fields']) if field['type'] in nested_types]
+
+def serialize_batch(batch, nested_indexes):
+    """JSON encodes dict and list values in the nested columns of each row, in place."""
+    if nested_indexes:
+        for row in batch:
+            for index in nested_indexes:
+                value = row[index]
+                if isinstance(value, dict) or isinstance(value, list):
+                    row[index] = json.dumps(value)
+    return batch
+
+def json_default(value):
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    elif isinstance(value, Decimal):
+        return float(value)
+    elif isinstance(value, bytes):
+        return value.decode('utf-8')
+    raise TypeError('{} is not JSON serializable'.format(repr(value)))
+
+class CSVOutput(object):
+    def __init__(self, file, descriptor):
+        self.file = file
+        self.writer = csv.writer(file)
+        self.nested_indexes = get_nested_indexes(descriptor)
+        self.writer.writerow([field['name'] for field in descriptor['fields']])
+
+    def write_batch(self, batch):
+        self.writer.writerows(serialize_batch(batch, self.nested_indexes))
+
+    def close(self):
+        pass
+
+class NDJSONOutput(object):
+    def __init__(self, file, descriptor):
+        self.file = file
+        self.names = [field['name'] for field in descriptor['fields']]
+
+    def write_batch(self, batch):
+        names = self.names
+        lines = [json.dumps(dict(zip(names, row)), default=json_default) for row in batch]
+        self.file.write('\n'.join(lines) + '\n')
+
+    def close(self):
+        pass
+
+def import_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise Exception('pyarrow is required for arrow and parquet formats, `pip install the_el[arrow]`')
+    return pyarrow
+
+def get_arrow_schema(pa, descriptor):
+    arrow_types = {
+        'integer': pa.int64(),
+        'number': pa.float64(),
+        'boolean': pa.bool_(),
+        'date': pa.date32(),
+        'datetime': pa.timestamp('us'),
+        'time': pa.time64('us')
+    }
+    return pa.schema([pa.field(field['name'], arrow_types.get(field['type'], pa.string()))
+                      for field in descriptor['fields']])
+
+def get_arrow_converters(descriptor):
+    """Per column functions making fetched values acceptable to `pyarrow.array`."""
+    def to_float(value):
+        if value is None:
+            return None
+        return float(value)
+
+    def to_json(value):
+        if isinstance(value, dict) or isinstance(value, list):
+            return json.dumps(value)
+        return value
+
+    def to_string(value):
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+    converters = []
+    for field in descriptor['fields']:
+        if field['type'] == 'number':
+            converters.append(to_float)
+        elif field['type'] in nested_types:
+            converters.append(to_json)
+        elif field['type'] in ['integer', 'boolean', 'date', 'datetime', 'time']:
+            converters.append(None)
+        else:
+            converters.append(to_string)
+    return converters
+
+class ArrowOutput(object):
+    """Writes each batch as an Arrow record batch, typed from the table descriptor."""
+
+    def __init__(self, file, descriptor):
+        self.pa = import_pyarrow()
+        self.file = file
+        self.schema = get_arrow_schema(self.pa, descriptor)
+        self.converters = get_arrow_converters(descriptor)
+        self.writer = self.open_writer()
+
+    def open_writer(self):
+        return self.pa.ipc.new_file(self.file, self.schema)
+
+    def record_batch(self, batch):
+        pa = self.pa
+        arrays = []
+        for index, (converter, field) in enumerate(zip(self.converters, self.schema)):
+            column = [row[index] for row in batch]
+            if converter is not None:
+                column = [converter(value) for value in column]
+            arrays.append(pa.array(column, type=field.type))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+    def write_batch(self, batch):
+        self.writer.write_batch(self.record_batch(batch))
+
+    def close(self):
+        self.writer.close()
+
+class ParquetOutput(ArrowOutput):
+    """Writes each batch as a Parquet row group."""
+
+    def open_writer(self):
+        import pyarrow.parquet
+        return pyarrow.parquet.ParquetWriter(self.file, self.schema)
+
+    def write_batch(self, batch):
+        table = self.pa.Table.from_batches([self.record_batch(batch)])
+        self.writer.write_table(table)
+
+output_classes = {
+    'csv': CSVOutput,
+    'ndjson': NDJSONOutput,
+    'arrow': ArrowOutput,
+    'parquet': ParquetOutput
+}
+
+def get_output(output_format, file, descriptor):
+    if output_format not in output_classes:
+        raise Exception('Output format `{}` not supported'.format(output_format))
+    return output_classes[output_format](file, descriptor)
+
+def get_input_format(input_format, input_file):
+    """Returns `input_format`, or the format implied by the input file extension, defaulting to csv."""
+    if input_format != None:
+        return input_format
+    if input_file != None:
+        path = input_file
+        if path.endswith('.gz') or path.endswith('.bz2'):
+            path = os.path.splitext(path)[0]
+        extension = os.path.splitext(path)[1].lower()
+        if extension in input_format_extensions:
+            return input_format_extensions[extension]
+    return 'csv'
+
+def get_nested_encoders(table_schema):
+    """Per column functions turning parsed nested values back into the JSON text the casters expect."""
+    def to_json(value):
+        if isinstance(value, dict) or isinstance(value, list):
+            return json.dumps(value)
+        return value
+
+    return [to_json if field['type'] in nested_types else None for field in table_schema['fields']]
+
+def encode_row(values, encoders):
+    return [value if encoder is None else encoder(value) for encoder, value in zip(encoders, values)]
+
+def read_csv(file, table_schema, delimiter=',', quotechar='"', **kwargs):
+    return csv.reader(file, delimiter=delimiter, quotechar=quotechar)
+
+def read_ndjson(file, table_schema, batch_size=None, **kwargs):
+    names = [field['name'] for field in table_schema['fields']]
+    encoders = get_nested_encoders(table_schema)
+    for line in file:
+        if isinstance(line, bytes):
+            line = line.decode('utf-8')
+        if line.strip() == '':
+            continue
+        record = json.loads(line)
+        yield encode_row([record.get(name) for name in names], encoders)
+
+def iter_record_batch_rows(record_batches, table_schema):
+    names = [field['name'] for field in table_schema['fields']]
+    encoders = get_nested_encoders(table_schema)
+    for record_batch in record_batches:
+        columns = [record_batch.column(record_batch.schema.get_field_index(name)).to_pylist() for name in names]
+        for values in zip(*columns):
+            yield encode_row(values, encoders)
+
+def is_seekable(file):
+    try:
+        return file.seekable()
+    except AttributeError:
+        return False
+
+def get_seekable(file):
+    """Returns `file`, or a temporary copy of it where it can not seek, ie stdin or a streamed S3 object.
+
+    Arrow and Parquet files are read from their footer first, so their
+    readers need to seek.
+    """
+    if is_seekable(file):
+        return file
+    copy = tempfile.TemporaryFile()
+    shutil.copyfileobj(file, copy, 1024 * 1024)
+    copy.seek(0)
+    return copy
+
+## the Arrow IPC file format starts with this, the stream format, ie piped from another program, does not
+arrow_file_magic = b'ARROW1'
+
+def read_arrow(file, table_schema, batch_size=None, **kwargs):
+    pa = import_pyarrow()
+    file = get_seekable(file)
+    start = file.tell()
+    magic = file.read(len(arrow_file_magic))
+    file.seek(start)
+
+    if magic == arrow_file_magic:
+        reader = pa.ipc.open_file(file)
+        record_batches = (reader.get_batch(i) for i in range(reader.num_record_batches))
+    else:
+        record_batches = pa.ipc.open_stream(file)
+    return iter_record_batch_rows(record_batches, table_schema)
+
+def read_parquet(file, table_schema, batch_size=10000, **kwargs):
+    import_pyarrow()
+    import pyarrow.parquet
+    parquet_file = pyarrow.parquet.ParquetFile(get_seekable(file))
+    names = [field['name'] for field in table_schema['fields']]
+    record_batches = parquet_file.iter_batches(batch_size=batch_size, columns=names)
+    return iter_record_batch_rows(record_batches, table_schema)
+
+input_readers = {
+    'csv': read_csv,
+    'ndjson': read_ndjson,
+    'arrow': read_arrow,
+    'parquet': read_parquet
+}
+
+def read_rows(input_format, file, table_schema, delimiter=',', quotechar='"', batch_size=10000):
+    """Returns an iterator of rows, as lists in table schema field order, read from `file`.
+
+    Every format is read lazily, csv and ndjson line by line and the
+    columnar formats one record batch at a time.
+    """
+    if input_format not in input_readers:
+        raise Exception('Input format `{}` not supported'.format(input_format))
+    return input_readers[input_format](file,
+                                       table_schema,
+                                       delimiter=delimiter,
+                                       quotechar=quotechar,
+                                       batch_size=batch_size)
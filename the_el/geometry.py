@@ -0,0 +1,209 @@
+import json
+import struct
+import binascii
+import threading
+from array import array
+
+from .extract import iter_batches
+from .casting import is_missing_geometry
+from . import metrics
+
+wkb_types = {
+    'Point': 1,
+    'LineString': 2,
+    'Polygon': 3,
+    'MultiPoint': 4,
+    'MultiLineString': 5,
+    'MultiPolygon': 6,
+    'GeometryCollection': 7
+}
+
+ewkb_z_flag = 0x80000000
+ewkb_srid_flag = 0x20000000
+
+def get_dimensions(geometry):
+    if geometry['type'] == 'GeometryCollection':
+        for child in geometry['geometries']:
+            if get_dimensions(child) == 3:
+                return 3
+        return 2
+
+    coordinates = geometry['coordinates']
+    while len(coordinates) > 0 and isinstance(coordinates[0], list):
+        coordinates = coordinates[0]
+    if len(coordinates) > 2:
+        return 3
+    return 2
+
+def write_positions(out, positions, dimensions):
+    values = []
+    for position in positions:
+        values.extend(position[:dimensions])
+        if len(position) < dimensions:
+            values.append(0.0)
+    out += struct.pack('<I', len(positions))
+    out += struct.pack('<{}d'.format(len(values)), *values)
+
+def write_geometry(out, geometry, dimensions, srid=None):
+    geometry_type = geometry['type']
+    if geometry_type not in wkb_types:
+        raise Exception('Unsupported GeoJSON geometry type `{}`'.format(geometry_type))
+
+    wkb_type = wkb_types[geometry_type]
+    if dimensions == 3:
+        wkb_type |= ewkb_z_flag
+    if srid is not None:
+        wkb_type |= ewkb_srid_flag
+        out += struct.pack('<BII', 1, wkb_type, int(srid))
+    else:
+        out += struct.pack('<BI', 1, wkb_type)
+
+    if geometry_type == 'GeometryCollection':
+        out += struct.pack('<I', len(geometry['geometries']))
+        for child in geometry['geometries']:
+            write_geometry(out, child, dimensions)
+        return
+
+    coordinates = geometry['coordinates']
+    if geometry_type == 'Point':
+        if len(coordinates) == 0: # empty point
+            out += struct.pack('<{}d'.format(dimensions), *([float('nan')] * dimensions))
+        else:
+            position = list(coordinates[:dimensions]) + [0.0] * (dimensions - len(coordinates))
+            out += struct.pack('<{}d'.format(dimensions), *position)
+    elif geometry_type == 'LineString':
+        write_positions(out, coordinates, dimensions)
+    elif geometry_type == 'Polygon':
+        out += struct.pack('<I', len(coordinates))
+        for ring in coordinates:
+            write_positions(out, ring, dimensions)
+    else:
+        child_type = geometry_type[len('Multi'):]
+        out += struct.pack('<I', len(coordinates))
+        for child_coordinates in coordinates:
+            write_geometry(out, {'type': child_type, 'coordinates': child_coordinates}, dimensions)
+
+def geojson_to_ewkb(geometry, srid=None):
+    """Encodes a GeoJSON geometry (dict or JSON text) as little-endian EWKB bytes."""
+    if not isinstance(geometry, dict):
+        geometry = json.loads(geometry)
+
+    out = bytearray()
+    write_geometry(out, geometry, get_dimensions(geometry), srid=srid)
+    return bytes(out)
+
+def geojson_to_ewkb_hex(geometry, srid=None):
+    """Encodes a GeoJSON geometry as hex EWKB, which PostGIS accepts as geometry text input, ie in COPY."""
+    return binascii.hexlify(geojson_to_ewkb(geometry, srid=srid)).decode('ascii')
+
+def import_pyproj():
+    try:
+        import pyproj
+    except ImportError:
+        raise Exception('pyproj is required to reproject geometries, `pip install the_el[oracle_sde]`')
+    return pyproj
+
+def can_reproject():
+    try:
+        import_pyproj()
+    except Exception:
+        return False
+    return True
+
+def create_transform(from_srid, to_srid):
+    pyproj = import_pyproj()
+    if hasattr(pyproj, 'Transformer'):
+        return pyproj.Transformer.from_crs(from_srid, to_srid, always_xy=True).transform
+
+    ## pyproj < 2
+    from_proj = pyproj.Proj(init='epsg:{}'.format(from_srid), preserve_units=True)
+    to_proj = pyproj.Proj(init='epsg:{}'.format(to_srid), preserve_units=True)
+    return lambda xs, ys: pyproj.transform(from_proj, to_proj, xs, ys)
+
+## pyproj transformers are not thread safe, so each thread builds its own
+local = threading.local()
+
+def get_transform(from_srid, to_srid):
+    """Returns a function reprojecting arrays of x and y coordinates, built once per SRID pair and thread."""
+    if not hasattr(local, 'transforms'):
+        local.transforms = {}
+    key = (int(from_srid), int(to_srid))
+    if key not in local.transforms:
+        local.transforms[key] = create_transform(*key)
+    return local.transforms[key]
+
+def get_geometry_indexes(table_schema):
+    return [index for index, field in enumerate(table_schema['fields']) if field['type'] == 'geojson']
+
+## how deep positions are nested in the coordinates of each geometry type
+coordinates_depths = {
+    'Point': 0,
+    'LineString': 1,
+    'MultiPoint': 1,
+    'Polygon': 2,
+    'MultiLineString': 2,
+    'MultiPolygon': 3
+}
+
+def collect_positions(coordinates, depth, positions):
+    if depth == 0:
+        if len(coordinates) > 0: # not an empty point
+            positions.append(coordinates)
+    elif depth == 1:
+        positions.extend(coordinates)
+    else:
+        for child in coordinates:
+            collect_positions(child, depth - 1, positions)
+
+def collect_geometry_positions(geometry, positions):
+    if geometry['type'] == 'GeometryCollection':
+        for child in geometry['geometries']:
+            collect_geometry_positions(child, positions)
+    else:
+        collect_positions(geometry['coordinates'], coordinates_depths[geometry['type']], positions)
+
+def reproject_batch(batch, geometry_indexes, transform, missing_values=()):
+    """Reprojects the geometries in `geometry_indexes` of each row, in place, with one `transform` call.
+
+    Geometries are GeoJSON dicts or text, and are replaced in the same form.
+    Null geometries, and those in `missing_values`, are left as they are.
+    """
+    geometries = []
+    positions = []
+    for row in batch:
+        for index in geometry_indexes:
+            value = row[index]
+            if is_missing_geometry(value, missing_values):
+                continue
+            is_text = not isinstance(value, dict)
+            ## dicts are copied, as they are not ours to change and may hold tuples
+            geometry = json.loads(value if is_text else json.dumps(value))
+            collect_geometry_positions(geometry, positions)
+            geometries.append((row, index, geometry, is_text))
+
+    if not positions:
+        return batch
+
+    xs, ys = transform(array('d', [position[0] for position in positions]),
+                       array('d', [position[1] for position in positions]))
+    for position, x, y in zip(positions, xs, ys):
+        position[0] = x
+        position[1] = y
+
+    for row, index, geometry, is_text in geometries:
+        row[index] = json.dumps(geometry) if is_text else geometry
+    return batch
+
+def reproject_batches(batches, geometry_indexes, from_srid, to_srid, missing_values=()):
+    transform = get_transform(from_srid, to_srid)
+    for batch in batches:
+        with metrics.current.phase('reproject'):
+            batch = reproject_batch(batch, geometry_indexes, transform, missing_values=missing_values)
+        yield batch
+
+def reproject_rows(rows, geometry_indexes, from_srid, to_srid, batch_size=1000, missing_values=()):
+    """Yields rows with their geometries reprojected, `batch_size` rows at a time."""
+    batches = iter_batches(rows, batch_size)
+    for batch in reproject_batches(batches, geometry_indexes, from_srid, to_srid, missing_values=missing_values):
+        for row in batch:
+            yield row
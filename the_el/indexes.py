@@ -0,0 +1,57 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy import Index, inspect
+
+from .extract import get_column
+from . import metrics
+
+## dialects able to build several indexes on one table at once, each on its own connection
+concurrent_index_dialects = ['postgresql']
+
+def get_index_name(table_name, i):
+    ## as jsontableschema_sql names the indexes it creates with the table
+    return '{}_ix{:03d}'.format(table_name, i)
+
+def get_analyze_sql(engine, table):
+    preparer = engine.dialect.identifier_preparer
+    if engine.dialect.name == 'oracle':
+        owner = "'{}'".format(table.schema.upper()) if table.schema else 'USER'
+        return "BEGIN DBMS_STATS.GATHER_TABLE_STATS({}, '{}'); END;".format(owner, table.name.upper())
+    elif engine.dialect.name == 'mssql':
+        return 'UPDATE STATISTICS {}'.format(preparer.format_table(table))
+    return 'ANALYZE {}'.format(preparer.format_table(table))
+
+def create_index(logger, engine, index):
+    logger.info('{} - Building index {}'.format(index.table.name, index.name))
+    with metrics.current.phase('index'):
+        with engine.begin() as conn:
+            index.create(bind=conn)
+
+def build_indexes(logger, engine, table, indexes_fields, concurrency=1):
+    """Builds an index on each of `indexes_fields` of a loaded table, then updates its statistics.
+
+    Indexes are built `concurrency` at once where the dialect allows. Ones
+    that already exist, ie created with the table, are skipped.
+    """
+    existing = set([index['name'] for index in inspect(engine).get_indexes(table.name, schema=table.schema)])
+
+    indexes = []
+    for i, field in enumerate(indexes_fields):
+        name = get_index_name(table.name, i)
+        if name in existing:
+            logger.info('{} - Index {} exists, skipping'.format(table.name, name))
+            continue
+        indexes.append(Index(name, get_column(table, field)))
+
+    if engine.dialect.name not in concurrent_index_dialects:
+        concurrency = 1
+
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(create_index, logger, engine, index) for index in indexes]
+        for future in futures:
+            future.result()
+
+    logger.info('{} - Analyzing table'.format(table.name))
+    with metrics.current.phase('analyze'):
+        with engine.begin() as conn:
+            conn.execute(get_analyze_sql(engine, table))
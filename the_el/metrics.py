@@ -0,0 +1,257 @@
+import os
+import json
+import time
+import cProfile
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+class NullMetrics(object):
+    """Stands in for `Metrics` outside an instrumented command, recording nothing."""
+
+    @contextmanager
+    def phase(self, name):
+        yield
+
+    def timed(self, name, items, counter=None):
+        return items
+
+    def count(self, name, amount=1):
+        pass
+
+class Metrics(object):
+    """Per phase timers and counters for one command run.
+
+    Phases nest: time spent in an inner phase is not charged to the phase
+    around it, so each phase's seconds are its own, ie `copy` is the time
+    Postgres spends on COPY excluding the parsing, casting and encoding of
+    the rows it reads. Phase seconds are summed across threads.
+    """
+
+    def __init__(self, command, table_name):
+        self.command = command
+        self.table_name = table_name
+        self.started_at = datetime.utcnow()
+        self.start_time = time.perf_counter()
+        self.counters = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.thread_phases = []
+
+    def get_local(self):
+        local = self.local
+        if not hasattr(local, 'stack'):
+            local.stack = []
+            local.phases = {}
+            with self.lock:
+                self.thread_phases.append(local.phases)
+        return local
+
+    def enter(self, name):
+        now = time.perf_counter()
+        local = self.get_local()
+        stack = local.stack
+        if stack:
+            outer = stack[-1]
+            local.phases[outer[0]] = local.phases.get(outer[0], 0) + now - outer[1]
+        stack.append([name, now])
+
+    def exit(self):
+        now = time.perf_counter()
+        local = self.get_local()
+        stack = local.stack
+        name, start = stack.pop()
+        local.phases[name] = local.phases.get(name, 0) + now - start
+        if stack:
+            stack[-1][1] = now
+
+    @contextmanager
+    def phase(self, name):
+        self.enter(name)
+        try:
+            yield
+        finally:
+            self.exit()
+
+    def timed(self, name, items, counter=None):
+        """Yields from `items`, charging the time spent producing each one to phase `name`.
+
+        Called once per row, so `enter` and `exit` are inlined.
+        """
+        items = iter(items)
+        local = self.get_local()
+        stack = local.stack
+        phases = local.phases
+        perf_counter = time.perf_counter
+        num_items = 0
+        try:
+            while True:
+                now = perf_counter()
+                if stack:
+                    outer = stack[-1]
+                    phases[outer[0]] = phases.get(outer[0], 0) + now - outer[1]
+                entry = [name, now]
+                stack.append(entry)
+                try:
+                    item = next(items)
+                except StopIteration:
+                    return
+                finally:
+                    now = perf_counter()
+                    stack.pop()
+                    phases[name] = phases.get(name, 0) + now - entry[1]
+                    if stack:
+                        stack[-1][1] = now
+                num_items += 1
+                ## counted in steps, so progress reports see rows as they go
+                if counter is not None and num_items == 1000:
+                    self.count(counter, num_items)
+                    num_items = 0
+                yield item
+        finally:
+            if counter is not None:
+                self.count(counter, num_items)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def get_phases(self):
+        phases = {}
+        with self.lock:
+            for thread_phases in self.thread_phases:
+                for name, seconds in list(thread_phases.items()):
+                    phases[name] = phases.get(name, 0) + seconds
+        return phases
+
+    def elapsed(self):
+        return time.perf_counter() - self.start_time
+
+    def summary(self, status):
+        elapsed = self.elapsed()
+        rows = self.counters.get('rows', 0)
+        return {
+            'command': self.command,
+            'table': self.table_name,
+            'status': status,
+            'started_at': self.started_at.isoformat() + 'Z',
+            'elapsed': round(elapsed, 6),
+            'rows_per_sec': round(rows / elapsed, 3) if elapsed > 0 else None,
+            'counters': dict(self.counters),
+            'phases': {name: round(seconds, 6) for name, seconds in self.get_phases().items()}
+        }
+
+current = NullMetrics()
+
+def format_labels(labels):
+    return ','.join(['{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                     for name, value in labels])
+
+def to_prometheus(summary):
+    """Renders a run summary in the Prometheus text exposition format, for the node exporter textfile collector."""
+    labels = [('command', summary['command']), ('table', summary['table'])]
+    lines = []
+
+    def add(name, help_text, samples):
+        lines.append('# HELP the_el_{} {}'.format(name, help_text))
+        lines.append('# TYPE the_el_{} gauge'.format(name))
+        for extra_labels, value in samples:
+            lines.append('the_el_{}{{{}}} {}'.format(name, format_labels(labels + extra_labels), value))
+
+    started_at = datetime.strptime(summary['started_at'], '%Y-%m-%dT%H:%M:%S.%fZ')
+    add('last_run_timestamp_seconds', 'Unix time the last run started',
+        [([], (started_at - datetime(1970, 1, 1)).total_seconds())])
+    add('last_run_success', '1 if the last run succeeded',
+        [([], 1 if summary['status'] == 'success' else 0)])
+    add('elapsed_seconds', 'Wall clock seconds of the last run', [([], summary['elapsed'])])
+    add('rows_per_second', 'Rows per second of the last run', [([], summary['rows_per_sec'] or 0)])
+    add('count', 'Counters of the last run, ie rows and bytes',
+        [([('counter', name)], value) for name, value in sorted(summary['counters'].items())])
+    add('phase_seconds', 'Seconds spent in each phase of the last run',
+        [([('phase', name)], seconds) for name, seconds in sorted(summary['phases'].items())])
+    return '\n'.join(lines) + '\n'
+
+def write_json_line(path, summary):
+    with open(path, 'a') as file:
+        file.write(json.dumps(summary) + '\n')
+
+def write_prometheus(path, summary):
+    ## write then rename, so the collector never reads a partial file
+    temp_path = path + '.tmp'
+    with open(temp_path, 'w') as file:
+        file.write(to_prometheus(summary))
+    os.replace(temp_path, path)
+
+def report_progress(logger, metrics, interval, stopped):
+    while not stopped.wait(interval):
+        rows = metrics.counters.get('rows', 0)
+        elapsed = metrics.elapsed()
+        logger.info('{} - Progress - rows: {} rows/sec: {:.0f} elapsed: {:.0f}s'.format(
+            metrics.table_name,
+            rows,
+            rows / elapsed,
+            elapsed))
+
+def format_summary(summary):
+    phases = ' '.join(['{}: {:.3f}s'.format(name, seconds)
+                       for name, seconds in sorted(summary['phases'].items(), key=lambda item: -item[1])])
+    counters = ' '.join(['{}: {}'.format(name, value) for name, value in sorted(summary['counters'].items())])
+    return '{} - {} {} in {:.3f}s - {} rows/sec: {} - {}'.format(
+        summary['table'],
+        summary['command'],
+        summary['status'],
+        summary['elapsed'],
+        counters,
+        summary['rows_per_sec'],
+        phases)
+
+@contextmanager
+def run(logger,
+        command,
+        table_name,
+        metrics_file=None,
+        prometheus_file=None,
+        progress_interval=None,
+        profile_file=None):
+    """Instruments a command run, logging a summary of its phases and counters when it ends.
+
+    A run inside another, ie a `run` pipeline step, records into the outer run.
+    """
+    global current
+
+    if not isinstance(current, NullMetrics):
+        yield current
+        return
+
+    metrics = Metrics(command, table_name)
+    current = metrics
+
+    stopped = threading.Event()
+    if progress_interval:
+        thread = threading.Thread(target=report_progress, args=(logger, metrics, progress_interval, stopped))
+        thread.daemon = True
+        thread.start()
+
+    profile = None
+    if profile_file:
+        profile = cProfile.Profile()
+        profile.enable()
+
+    status = 'error'
+    try:
+        yield metrics
+        status = 'success'
+    finally:
+        if profile is not None:
+            profile.disable()
+            profile.dump_stats(profile_file)
+            logger.info('{} - Wrote profile to {}'.format(table_name, profile_file))
+        stopped.set()
+        current = NullMetrics()
+
+        summary = metrics.summary(status)
+        logger.info(format_summary(summary))
+        if metrics_file:
+            write_json_line(metrics_file, summary)
+        if prometheus_file:
+            write_prometheus(prometheus_file, summary)
@@ -0,0 +1,63 @@
+import json
+
+from .casting import RowCaster
+from .extract import get_column
+from . import metrics
+
+## SQL Server allows at most 1000 rows in a VALUES list and 2100 parameters in a statement
+max_rows_per_insert = 1000
+max_parameters = 2100
+
+class MSSQLRowCaster(RowCaster):
+    def field_caster(self, field):
+        cast = super(MSSQLRowCaster, self).field_caster(field)
+
+        if field.type == 'array' or field.type == 'object':
+            def cast_json(value):
+                value = cast(value)
+                if value is None:
+                    return None
+                return json.dumps(value)
+            return cast_json
+
+        return cast
+
+def get_rows_per_insert(num_fields):
+    return max(1, min(max_rows_per_insert, (max_parameters - 1) // num_fields))
+
+def get_insert_sql(engine, table, table_schema, num_rows):
+    preparer = engine.dialect.identifier_preparer
+    columns = [get_column(table, field['name']) for field in table_schema['fields']]
+    values = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    return 'INSERT INTO {} ({}) VALUES {}'.format(
+        preparer.format_table(table),
+        ', '.join([preparer.format_column(column) for column in columns]),
+        ', '.join([values] * num_rows))
+
+def insert_rows(engine, table, table_schema, rows):
+    """Loads rows into a SQL Server table with multi-row INSERT statements, in one transaction.
+
+    pymssql's `executemany` runs one statement per row, so each statement
+    inserts as many rows as the parameter limit allows instead.
+    """
+    caster = MSSQLRowCaster(table_schema)
+    rows_per_insert = get_rows_per_insert(len(table_schema['fields']))
+    sql = get_insert_sql(engine, table, table_schema, rows_per_insert)
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        for batch in metrics.current.timed('cast', caster.cast_batches(rows, rows_per_insert)):
+            if len(batch) < rows_per_insert: ## the last batch
+                sql = get_insert_sql(engine, table, table_schema, len(batch))
+            params = tuple([value for row in batch for value in row])
+            with metrics.current.phase('insert'):
+                cur.execute(sql, params)
+        cur.close()
+        with metrics.current.phase('commit'):
+            conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,98 @@
+import json
+
+from .casting import RowCaster
+from .extract import get_column
+from . import metrics
+
+## rows sent per `executemany`, which cx_Oracle binds as arrays in one round trip
+batch_size = 10000
+
+## field types cast to strings, bound with the longest value's size
+text_types = ['string', 'array', 'object', 'geojson']
+
+## cx_Oracle types other fields are bound as, by the name of each
+input_types = {
+    'integer': 'NUMBER',
+    'number': 'NUMBER',
+    'boolean': 'NUMBER',
+    'date': 'DATETIME',
+    'datetime': 'TIMESTAMP'
+}
+
+class OracleRowCaster(RowCaster):
+    def field_caster(self, field):
+        cast = super(OracleRowCaster, self).field_caster(field)
+
+        ## Oracle has no boolean type, SQLAlchemy stores them as 0 or 1
+        if field.type == 'boolean':
+            def cast_boolean(value):
+                value = cast(value)
+                if value is None:
+                    return None
+                return int(value)
+            return cast_boolean
+
+        if field.type == 'array' or field.type == 'object':
+            def cast_json(value):
+                value = cast(value)
+                if value is None:
+                    return None
+                return json.dumps(value)
+            return cast_json
+
+        return cast
+
+def get_insert_sql(engine, table, table_schema):
+    preparer = engine.dialect.identifier_preparer
+    columns = [get_column(table, field['name']) for field in table_schema['fields']]
+    return 'INSERT INTO {} ({}) VALUES ({})'.format(
+        preparer.format_table(table),
+        ', '.join([preparer.format_column(column) for column in columns]),
+        ', '.join([':{}'.format(i + 1) for i in range(len(columns))]))
+
+def get_input_types(table_schema):
+    """Returns the cx_Oracle type each non-text field is bound as, None for text fields.
+
+    cx_Oracle 5 otherwise takes the type of a column from its value in the
+    first row, so a batch starting with a null binds it as a string and
+    fails on the numbers or dates in later rows.
+    """
+    import cx_Oracle
+
+    return [getattr(cx_Oracle, input_types[field['type']]) if field['type'] in input_types else None
+            for field in table_schema['fields']]
+
+def get_input_sizes(batch, input_types, text_indexes):
+    ## sized up front, otherwise cx_Oracle reallocates its bind arrays each time a longer string turns up
+    sizes = list(input_types)
+    for index in text_indexes:
+        size = 1
+        for row in batch:
+            value = row[index]
+            if value is not None and len(value) > size:
+                size = len(value)
+        sizes[index] = size
+    return sizes
+
+def insert_rows(engine, table, table_schema, rows, batch_size=batch_size):
+    """Loads rows into an Oracle table with array bound `executemany` batches, in one transaction."""
+    caster = OracleRowCaster(table_schema)
+    sql = get_insert_sql(engine, table, table_schema)
+    types = get_input_types(table_schema)
+    text_indexes = [index for index, field in enumerate(table_schema['fields']) if field['type'] in text_types]
+
+    conn = engine.raw_connection()
+    try:
+        cur = conn.cursor()
+        for batch in metrics.current.timed('cast', caster.cast_batches(rows, batch_size)):
+            cur.setinputsizes(*get_input_sizes(batch, types, text_indexes))
+            with metrics.current.phase('insert'):
+                cur.executemany(sql, batch)
+        cur.close()
+        with metrics.current.phase('commit'):
+            conn.commit()
+    except:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
@@ -0,0 +1,147 @@
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+import yaml
+
+pipeline_commands = ['describe_table', 'create_table', 'write', 'transfer', 'swap_table', 'read']
+
+## step parameters resolved by `resolve_connection_string`
+connection_string_params = ['connection_string', 'source_connection_string']
+
+class Step(object):
+    def __init__(self, name, command, params, depends_on):
+        self.name = name
+        self.command = command
+        self.params = params
+        self.depends_on = depends_on
+        self.status = 'pending'
+        self.elapsed = None
+        self.error = None
+
+def get_step_name(command, params):
+    table_name = params.get('table_name', params.get('dest_table', params.get('new_table_name')))
+    if table_name == None:
+        return command
+    return '{}:{}'.format(command, table_name)
+
+def resolve_connection_string(connection_string, connections):
+    if connection_string in connections:
+        connection_string = connections[connection_string]
+    return os.path.expandvars(connection_string)
+
+def load_pipeline(file):
+    """Parses a pipeline manifest into its worker limit and steps.
+
+    Step keys other than `name`, `command` and `depends_on` are the
+    command's parameters, named as its options with underscores or dashes.
+    A `connection_string` or `source_connection_string` naming an entry of
+    the top level `connections` uses that entry, and `$VARIABLES` in
+    connection strings are expanded.
+    """
+    manifest = yaml.safe_load(file)
+
+    connections = manifest.get('connections', {})
+    steps = []
+    names = set()
+    for step_manifest in manifest['steps']:
+        step_manifest = dict(step_manifest)
+        command = step_manifest.pop('command', None)
+        if command not in pipeline_commands:
+            raise Exception('Pipeline step command must be one of {}, not `{}`'.format(
+                ', '.join(pipeline_commands),
+                command))
+
+        name = step_manifest.pop('name', None)
+        depends_on = step_manifest.pop('depends_on', [])
+        if not isinstance(depends_on, list):
+            depends_on = [depends_on]
+
+        params = {key.replace('-', '_'): value for key, value in step_manifest.items()}
+        for param in connection_string_params:
+            if params.get(param) != None:
+                params[param] = resolve_connection_string(params[param], connections)
+
+        if name == None:
+            name = get_step_name(command, params)
+        if name in names:
+            raise Exception('Pipeline step name `{}` is not unique, give the step a `name`'.format(name))
+        names.add(name)
+
+        steps.append(Step(name, command, params, depends_on))
+
+    for step in steps:
+        for dependency in step.depends_on:
+            if dependency not in names:
+                raise Exception('Pipeline step `{}` depends on unknown step `{}`'.format(step.name, dependency))
+    check_acyclic(steps)
+
+    return manifest.get('workers', 1), steps
+
+def check_acyclic(steps):
+    depends_on = {step.name: step.depends_on for step in steps}
+    visited = set()
+
+    def visit(name, path):
+        if name in path:
+            raise Exception('Pipeline steps depend on each other: {}'.format(' -> '.join(path + [name])))
+        if name in visited:
+            return
+        for dependency in depends_on[name]:
+            visit(dependency, path + [name])
+        visited.add(name)
+
+    for step in steps:
+        visit(step.name, [])
+
+def run_step(logger, step, invoke):
+    logger.info('{} - Starting'.format(step.name))
+    start = time.perf_counter()
+    try:
+        invoke(step)
+        step.status = 'success'
+    except Exception as e:
+        step.status = 'failed'
+        step.error = str(e)
+        logger.exception('{} - Failed: {}'.format(step.name, e))
+    finally:
+        step.elapsed = time.perf_counter() - start
+    logger.info('{} - {} in {:.3f}s'.format(step.name, step.status, step.elapsed))
+
+def run_pipeline(logger, steps, invoke, workers):
+    """Runs each step once all the steps it depends on succeed, up to `workers` at once.
+
+    `invoke(step)` runs a step's command. A failed step's dependents are
+    skipped, while steps independent of it carry on. Returns the steps,
+    with their `status` and `elapsed` seconds set.
+    """
+    by_name = {step.name: step for step in steps}
+    running = {}
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            ## repeated until settled, as skipping a step can skip the steps depending on it
+            changed = True
+            while changed:
+                changed = False
+                for step in steps:
+                    if step.status != 'pending':
+                        continue
+                    statuses = [by_name[dependency].status for dependency in step.depends_on]
+                    if any([status in ['failed', 'skipped'] for status in statuses]):
+                        step.status = 'skipped'
+                        changed = True
+                        logger.warning('{} - Skipped, a step it depends on did not succeed'.format(step.name))
+                    elif all([status == 'success' for status in statuses]):
+                        step.status = 'running'
+                        running[pool.submit(run_step, logger, step, invoke)] = step
+
+            if not running:
+                break
+
+            done, not_done = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                del running[future]
+                future.result()
+
+    return steps
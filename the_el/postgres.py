@@ -1,106 +1,648 @@
 import io
 import json
 import csv
+import uuid
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 
-import jsontableschema
-from jsontableschema.exceptions import InvalidObjectType
 from sqlalchemy.dialects.postgresql import insert
 
-class TransformStream(object):
-    def __init__(self, fun):
-        self.fun = fun
+from .casting import RowCaster, is_missing_geometry, get_missing_values
+from . import geometry
+from . import metrics
 
-    def read(self, *args, **kwargs):
-        return self.fun()
+copy_buffer_size = 1024 * 1024
 
-def type_fields(schema, row):
-    missing_values = []
-    if 'missingValues' in schema._Schema__descriptor:
-        missing_values = schema._Schema__descriptor['missingValues']
+## NULL is sent as an unquoted \N and every other non-numeric value quoted,
+## so COPY loads empty strings as empty strings, and a '\N' string as text
+copy_csv_options = "CSV NULL E'\\\\N'"
 
-    typed_row = []
-    for index, field in enumerate(schema.fields):
-        value = row[index]
+class CopyNull(object):
+    """Stands in for None in rows written by `csv.writer` for COPY.
 
-        if value in missing_values:
-                value = None
-        elif field.type != 'geojson':
-            try:
-                value = field.cast_value(value)
-            except InvalidObjectType:
-                value = json.loads(value)
+    With `QUOTE_NONNUMERIC`, csv.writer quotes None, so it is replaced by
+    this, which csv.writer takes for a number and leaves unquoted.
+    """
 
-        typed_row.append(value)
+    def __int__(self):
+        return 0
 
-    return typed_row
+    def __str__(self):
+        return '\\N'
 
-def copy_from(engine, table_name, table_schema, rows):
-    schema = jsontableschema.Schema(table_schema)
+copy_null = CopyNull()
 
-    def transform():
-        try:
-            row = next(rows)
-            typed_row = type_fields(schema, row)
-            with io.StringIO() as out:
-                writer = csv.writer(out)
-                writer.writerow(typed_row)
-                return out.getvalue()
-        except StopIteration:
-            return ''
+def get_copy_writer(file):
+    return csv.writer(file, quoting=csv.QUOTE_NONNUMERIC)
+
+def copy_values(row):
+    return [copy_null if value is None else value for value in row]
+
+class CopyRowCaster(RowCaster):
+    def field_caster(self, field):
+        cast = super(CopyRowCaster, self).field_caster(field)
+
+        ## COPY expects JSON text, not the python repr csv.writer would produce
+        if field.type == 'array' or field.type == 'object':
+            def cast_json(value):
+                value = cast(value)
+                if value is None:
+                    return None
+                return json.dumps(value)
+            return cast_json
+
+        return cast
+
+class PostGISCopyRowCaster(CopyRowCaster):
+    """Casts rows for COPY into PostGIS tables, with GeoJSON fields as hex EWKB.
+
+    `srids` maps geometry field names to the SRID their EWKB is tagged with.
+    """
+
+    def __init__(self, table_schema, srids):
+        self.srids = srids
+        super(PostGISCopyRowCaster, self).__init__(table_schema)
+
+    def field_caster(self, field):
+        if field.type == 'geojson':
+            missing_values = self.missing_values
+            srid = self.srids.get(field.name)
+            def cast_geometry(value):
+                if is_missing_geometry(value, missing_values):
+                    return None
+                return geometry.geojson_to_ewkb_hex(value, srid=srid)
+            return cast_geometry
+
+        return super(PostGISCopyRowCaster, self).field_caster(field)
+
+class CopyStream(object):
+    """File-like object feeding typed rows to `copy_expert` as CSV.
+
+    Each `read(size)` writes rows into a single reused buffer until it
+    holds at least `size` characters, so COPY receives large chunks
+    instead of one line per call.
+    """
+
+    def __init__(self, rows):
+        self.rows = iter(rows)
+        self.buffer = io.StringIO()
+        self.writer = get_copy_writer(self.buffer)
+
+    def read(self, size=copy_buffer_size):
+        if size is None or size < 0:
+            size = copy_buffer_size
 
-    transformed_rows = TransformStream(transform)
+        buffer = self.buffer
+        writerow = self.writer.writerow
+        with metrics.current.phase('encode'):
+            for row in self.rows:
+                writerow(copy_values(row))
+                if buffer.tell() >= size:
+                    break
+
+            data = buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        metrics.current.count('bytes', len(data))
+        return data
+
+def copy_from(engine, table_name, table_schema, rows, buffer_size=copy_buffer_size):
+    caster = CopyRowCaster(table_schema)
+    stream = CopyStream(metrics.current.timed('cast', caster.cast_rows(rows)))
 
     conn = engine.raw_connection()
     with conn.cursor() as cur:
-        copy = 'COPY {} FROM STDIN CSV'.format(table_name)
-        cur.copy_expert(copy, transformed_rows)
-        conn.commit()
+        copy = 'COPY {} FROM STDIN {}'.format(table_name, copy_csv_options)
+        with metrics.current.phase('copy'):
+            cur.copy_expert(copy, stream, size=buffer_size)
+        with metrics.current.phase('commit'):
+            conn.commit()
     conn.close()
 
-def copy_to(engine, table_name, file):
+def iter_chunks(rows, chunk_size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if len(chunk) == 0:
+            return
+        yield chunk
+
+def chunked_copy_from(logger, engine, table_name, table_schema, rows, commit_every, checkpoint=None):
+    """COPY rows committing every `commit_every` rows, saving `checkpoint` after each commit."""
+    caster = CopyRowCaster(table_schema)
+    copy = 'COPY {} FROM STDIN {}'.format(table_name, copy_csv_options)
+
+    num_rows = 0
+    conn = engine.raw_connection()
+    try:
+        with conn.cursor() as cur:
+            for chunk in iter_chunks(rows, commit_every):
+                num_rows += len(chunk)
+                mark = None
+                if checkpoint is not None:
+                    mark = checkpoint.mark(num_rows)
+
+                stream = CopyStream(metrics.current.timed('cast', caster.cast_rows(chunk)))
+                with metrics.current.phase('copy'):
+                    cur.copy_expert(copy, stream, size=copy_buffer_size)
+                with metrics.current.phase('commit'):
+                    conn.commit()
+
+                if checkpoint is not None:
+                    checkpoint.save(mark)
+                logger.info('{} - Committed {} rows'.format(table_name, num_rows))
+    except:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+## Set per worker process by `init_copy_worker`
+worker_caster = None
+
+def init_copy_worker(table_schema):
+    global worker_caster
+    worker_caster = CopyRowCaster(table_schema)
+
+def encode_chunk(chunk):
+    with io.StringIO() as out:
+        writer = get_copy_writer(out)
+        writer.writerows(map(copy_values, worker_caster.cast_rows(chunk)))
+        return out.getvalue()
+
+class QueueStream(object):
+    """File-like object reading encoded CSV chunks from a queue until a `None` sentinel."""
+
+    def __init__(self, chunks_queue):
+        self.chunks_queue = chunks_queue
+        self.done = False
+
+    def read(self, *args, **kwargs):
+        if self.done:
+            return ''
+        data = self.chunks_queue.get()
+        if data is None:
+            self.done = True
+            return ''
+        return data
+
+def copy_worker(conn, table_name, chunks_queue, errors):
+    stream = QueueStream(chunks_queue)
+    try:
+        with conn.cursor() as cur:
+            copy = 'COPY {} FROM STDIN {}'.format(table_name, copy_csv_options)
+            cur.copy_expert(copy, stream)
+    except Exception as e:
+        errors.append(e)
+        ## keep consuming so the producer never blocks on a failed worker
+        while not stream.done:
+            stream.read()
+
+## longer identifiers are silently truncated by Postgres
+max_identifier_length = 63
+
+def get_staging_table_names(table_name, count):
+    """Returns `count` names for staging tables of `table_name`, unique to this run.
+
+    A random run id keeps concurrent loads into the same table apart, and
+    the table's name is shortened so each name fits in an identifier.
+    """
+    schema, dot, name = table_name.rpartition('.')
+    run_id = uuid.uuid4().hex[:12]
+    suffixes = ['_the_el_{}_{}'.format(run_id, i) for i in range(count)]
+    name = name[:max_identifier_length - max(len(suffix) for suffix in suffixes)]
+    return [schema + dot + name + suffix for suffix in suffixes]
+
+def parallel_copy_from(logger, engine, table_name, table_schema, rows, workers, chunk_size=10000):
+    """COPY rows into `table_name` using `workers` processes and connections.
+
+    Chunks are cast and encoded in a process pool and COPY'd over one
+    connection per worker into unlogged staging tables. The staging tables
+    are merged into the target in a single transaction, so the target either
+    receives every row or none of them. The staging tables are named
+    uniquely per run and dropped however the load ends.
+    """
+    staging_tables = get_staging_table_names(table_name, workers)
+    conns = [engine.raw_connection() for i in range(workers)]
+
+    try:
+        with conns[0].cursor() as cur:
+            for staging_table in staging_tables:
+                cur.execute('CREATE UNLOGGED TABLE {} (LIKE {} INCLUDING DEFAULTS)'.format(staging_table, table_name))
+        conns[0].commit()
+
+        errors = []
+        queues = [queue.Queue(maxsize=2) for i in range(workers)]
+        threads = []
+        for conn, staging_table, chunks_queue in zip(conns, staging_tables, queues):
+            thread = threading.Thread(target=copy_worker, args=(conn, staging_table, chunks_queue, errors))
+            thread.daemon = True
+            thread.start()
+            threads.append(thread)
+
+        num_chunks = 0
+        try:
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=init_copy_worker,
+                                     initargs=(table_schema,)) as pool:
+                ## bounded window of chunks in flight, so input is never fully read into memory
+                pending = deque()
+                chunks = iter_chunks(rows, chunk_size)
+                while not errors:
+                    chunk = next(chunks, None)
+                    if chunk is not None:
+                        pending.append(pool.submit(encode_chunk, chunk))
+                        if len(pending) < workers * 2:
+                            continue
+                    if not pending:
+                        break
+                    ## the main thread waits either on the pool to encode or the connections to COPY
+                    with metrics.current.phase('encode'):
+                        data = pending.popleft().result()
+                    metrics.current.count('bytes', len(data))
+                    with metrics.current.phase('copy'):
+                        queues[num_chunks % workers].put(data)
+                    num_chunks += 1
+        finally:
+            for chunks_queue in queues:
+                chunks_queue.put(None)
+            with metrics.current.phase('copy'):
+                for thread in threads:
+                    thread.join()
+
+        if errors:
+            raise errors[0]
+
+        with metrics.current.phase('commit'):
+            for conn in conns:
+                conn.commit()
+
+        logger.info('{} - Loaded {} chunks into {} staging tables'.format(table_name, num_chunks, workers))
+
+        with conns[0].cursor() as cur:
+            merge = 'INSERT INTO {} '.format(table_name) +\
+                    ' UNION ALL '.join(['SELECT * FROM {}'.format(staging_table) for staging_table in staging_tables])
+            with metrics.current.phase('merge'):
+                cur.execute(merge)
+            logger.info('{} - Merged {} rows from staging tables'.format(table_name, cur.rowcount))
+        with metrics.current.phase('commit'):
+            conns[0].commit()
+    except:
+        for conn in conns:
+            conn.rollback()
+        raise
+    finally:
+        try:
+            with conns[0].cursor() as cur:
+                for staging_table in staging_tables:
+                    cur.execute('DROP TABLE IF EXISTS {}'.format(staging_table))
+            conns[0].commit()
+        finally:
+            for conn in conns:
+                conn.close()
+
+def copy_to(engine, table_name, file, where=None, params=None, columns=None, order_by=None, limit=None):
+    """COPYs the table, or the rows of it selected, to `file` as CSV. Returns the number of rows copied."""
+    source = table_name
+    if where != None or columns != None or order_by != None or limit != None:
+        source = 'SELECT {} FROM {}'.format(', '.join(columns) if columns else '*', table_name)
+        if where != None:
+            source += ' WHERE {}'.format(where)
+        if order_by != None:
+            source += ' ORDER BY {}'.format(order_by)
+        if limit != None:
+            source += ' LIMIT {}'.format(int(limit))
+        source = '({})'.format(source)
+
     conn = engine.raw_connection()
     with conn.cursor() as cur:
-        copy = 'COPY {} TO STDOUT WITH CSV'.format(table_name)
-        cur.copy_expert(copy, file)
+        copy = 'COPY {} TO STDOUT WITH CSV'.format(source)
+        ## COPY does not take bind parameters, so they are rendered client side
+        if params != None:
+            copy = cur.mogrify(copy, params)
+        with metrics.current.phase('copy'):
+            cur.copy_expert(copy, file)
+        ## the COPY command status holds the number of rows copied
+        num_rows = cur.rowcount
     conn.close()
+    return num_rows
+
+staging_table_sql = '''
+CREATE TEMP TABLE {staging_table} ON COMMIT DROP AS
+SELECT {columns} FROM {table_name} WITH NO DATA;
+ALTER TABLE {staging_table} ADD COLUMN the_el_row_number bigserial;
+'''
 
 upsert_sql = '''
-INSERT INTO {table_name} ({columns})
-VALUES ({params_str})
-ON CONFLICT ({conflict_columns})
-DO UPDATE SET ({columns}) = ({params_str})
+WITH upserted AS (
+    INSERT INTO {table_name} ({columns})
+    SELECT {columns} FROM {source}
+    ON CONFLICT ({conflict_columns})
+    {conflict_action}
+    RETURNING (xmax = 0) AS inserted
+)
+SELECT count(*) FILTER (WHERE inserted), count(*) FILTER (WHERE NOT inserted)
+FROM upserted
 '''
 
-def get_upsert_sql(db_schema, table_name, primary_keys, columns):
+def get_table_name(db_schema, table_name):
     if db_schema:
-        table_name = '{}.{}'.format(db_schema, table_name)
+        return '{}.{}'.format(db_schema, table_name)
+    return table_name
+
+def get_deduped_source(staging_table, primary_keys):
+    """Selects the last row COPY'd into the staging table for each key, like applying the rows one at a time would."""
+    return '(SELECT DISTINCT ON ({keys}) * FROM {staging_table} ORDER BY {keys}, the_el_row_number DESC)'.format(
+        keys=', '.join(primary_keys),
+        staging_table=staging_table)
+
+duplicate_keys_sql = '''
+SELECT {keys} FROM {staging_table} GROUP BY {keys} HAVING count(*) > 1 LIMIT 1
+'''
+
+def check_duplicate_keys(cur, staging_table, primary_keys):
+    cur.execute(duplicate_keys_sql.format(keys=', '.join(primary_keys), staging_table=staging_table))
+    duplicate = cur.fetchone()
+    if duplicate != None:
+        raise Exception('Duplicate primary key in input: {}'.format(
+            ', '.join(['{} = {}'.format(key, value) for key, value in zip(primary_keys, duplicate)])))
+
+def get_upsert_sql(db_schema, table_name, staging_table, primary_keys, columns, dedupe):
+    table_name = get_table_name(db_schema, table_name)
+    conflict_columns = ', '.join(primary_keys)
+
+    if dedupe:
+        source = get_deduped_source(staging_table, primary_keys) + ' AS deduped'
+    else:
+        source = staging_table
+
+    update_columns = [column for column in columns if column not in primary_keys]
+    if update_columns:
+        conflict_action = 'DO UPDATE SET ' +\
+            ', '.join(['{0} = EXCLUDED.{0}'.format(column) for column in update_columns])
+    else:
+        conflict_action = 'DO NOTHING'
 
     return upsert_sql.format(
         table_name=table_name,
         columns=', '.join(columns),
-        params_str=', '.join(['%s' for s in range(len(columns))]),
-        conflict_columns=', '.join(primary_keys))
+        source=source,
+        conflict_columns=conflict_columns,
+        conflict_action=conflict_action)
 
-def upsert(engine, db_schema, table_name, table_schema, rows):
+def get_primary_keys(table_schema, operation):
     if 'primaryKey' not in table_schema:
-        raise Exception('`primaryKey` required for upsert')
+        raise Exception('`primaryKey` required for {}'.format(operation))
 
-    schema = jsontableschema.Schema(table_schema)
+    primary_keys = table_schema['primaryKey']
+    if isinstance(primary_keys, str):
+        primary_keys = [primary_keys]
+    return primary_keys
 
-    upsert_sql = get_upsert_sql(
-        db_schema,
-        table_name,
-        table_schema['primaryKey'],
-        list(map(lambda x: x['name'], table_schema['fields'])))
+def copy_to_staging(cur, db_schema, table_name, staging_table, table_schema, rows):
+    """Creates a temporary copy of the table's columns, dropped on commit, and COPYs rows into it.
+
+    Returns the number of rows COPY'd.
+    """
+    columns = list(map(lambda x: x['name'], table_schema['fields']))
+
+    cur.execute(staging_table_sql.format(
+        staging_table=staging_table,
+        columns=', '.join(columns),
+        table_name=get_table_name(db_schema, table_name)))
+
+    caster = CopyRowCaster(table_schema)
+    stream = CopyStream(metrics.current.timed('cast', caster.cast_rows(rows)))
+    copy = 'COPY {} ({}) FROM STDIN {}'.format(staging_table, ', '.join(columns), copy_csv_options)
+    with metrics.current.phase('copy'):
+        cur.copy_expert(copy, stream, size=copy_buffer_size)
+    ## the COPY command status holds the number of rows copied
+    return cur.rowcount
+
+geometry_srids_sql = '''
+SELECT f_geometry_column, srid FROM geometry_columns
+WHERE f_table_schema = coalesce(%(db_schema)s, current_schema()) AND f_table_name = %(table_name)s
+'''
+
+def get_geometry_srids(cur, db_schema, table_name):
+    """Returns the SRID of each geometry column of the table, None where the column takes any SRID."""
+    cur.execute(geometry_srids_sql, {'db_schema': db_schema, 'table_name': table_name})
+    return {column: srid or None for column, srid in cur.fetchall()}
+
+def copy_from_postgis(logger, engine, db_schema, table_name, table_schema, rows, from_srid=None):
+    """COPY rows into a PostGIS table, sending GeoJSON fields as hex EWKB.
+
+    Geometries are tagged with each column's SRID, or `from_srid` if given.
+    When `from_srid` differs from a column's SRID, geometries are
+    reprojected in batches as they are cast. Without pyproj, rows are
+    COPY'd into a temporary table whose geometry columns take any SRID, and
+    inserted into the table with those columns passed through `ST_Transform`.
+    """
+    columns = list(map(lambda x: x['name'], table_schema['fields']))
+    geometry_columns = [field['name'] for field in table_schema['fields'] if field['type'] == 'geojson']
+    if from_srid != None:
+        from_srid = int(from_srid)
 
     conn = engine.raw_connection()
     with conn.cursor() as cur:
         try:
-            for row in rows:
-                typed_row = type_fields(schema, row)
-                cur.execute(upsert_sql, typed_row + typed_row) # has to do it twice, insert and set
-            conn.commit()
+            column_srids = get_geometry_srids(cur, db_schema, table_name)
+            transform_columns = [column for column in geometry_columns
+                                 if from_srid != None and
+                                    column_srids.get(column) != None and
+                                    column_srids[column] != from_srid]
+
+            srids = {column: from_srid or column_srids.get(column) for column in geometry_columns}
+
+            ## reprojected client side in batches where pyproj is installed, otherwise by the database
+            if transform_columns and geometry.can_reproject():
+                for column in transform_columns:
+                    index = columns.index(column)
+                    rows = geometry.reproject_rows(rows,
+                                                   [index],
+                                                   from_srid,
+                                                   column_srids[column],
+                                                   missing_values=get_missing_values(table_schema))
+                    srids[column] = column_srids[column]
+                transform_columns = []
+
+            caster = PostGISCopyRowCaster(table_schema, srids)
+            stream = CopyStream(metrics.current.timed('cast', caster.cast_rows(rows)))
+
+            if transform_columns:
+                logger.info('{} - Transforming {} from SRID {}'.format(table_name, ', '.join(transform_columns), from_srid))
+                target = '{}_transform'.format(table_name)
+                cur.execute(staging_table_sql.format(
+                    staging_table=target,
+                    columns=', '.join(columns),
+                    table_name=get_table_name(db_schema, table_name)))
+                for column in transform_columns:
+                    cur.execute('ALTER TABLE {} ALTER COLUMN {} TYPE geometry'.format(target, column))
+            else:
+                target = get_table_name(db_schema, table_name)
+
+            copy = 'COPY {} ({}) FROM STDIN {}'.format(target, ', '.join(columns), copy_csv_options)
+            with metrics.current.phase('copy'):
+                cur.copy_expert(copy, stream, size=copy_buffer_size)
+
+            if transform_columns:
+                select_columns = []
+                for column in columns:
+                    if column in transform_columns:
+                        column = 'ST_Transform({0}, {1}) AS {0}'.format(column, column_srids[column])
+                    select_columns.append(column)
+                with metrics.current.phase('merge'):
+                    cur.execute('INSERT INTO {} ({}) SELECT {} FROM {}'.format(
+                        get_table_name(db_schema, table_name),
+                        ', '.join(columns),
+                        ', '.join(select_columns),
+                        target))
+
+            with metrics.current.phase('commit'):
+                conn.commit()
         except:
             conn.rollback()
             raise
     conn.close()
+
+def upsert(engine, db_schema, table_name, table_schema, rows, dedupe=True):
+    """Upsert rows by COPYing them into a temporary table and merging with one statement.
+
+    Returns a tuple of the number of rows inserted and updated. Of rows
+    sharing a primary key the last one wins, as when upserting one row at a
+    time, unless `dedupe` is off, which fails the merge instead.
+    """
+    primary_keys = get_primary_keys(table_schema, 'upsert')
+    columns = list(map(lambda x: x['name'], table_schema['fields']))
+    staging_table = '{}_upsert'.format(table_name)
+
+    upsert_sql = get_upsert_sql(db_schema, table_name, staging_table, primary_keys, columns, dedupe)
+
+    conn = engine.raw_connection()
+    with conn.cursor() as cur:
+        try:
+            copy_to_staging(cur, db_schema, table_name, staging_table, table_schema, rows)
+            with metrics.current.phase('merge'):
+                cur.execute(upsert_sql)
+                inserted, updated = cur.fetchone()
+            with metrics.current.phase('commit'):
+                conn.commit()
+        except:
+            conn.rollback()
+            raise
+    conn.close()
+
+    return inserted, updated
+
+differential_delete_sql = '''
+DELETE FROM {table_name} AS t
+WHERE NOT EXISTS (SELECT 1 FROM {staging_table} AS s WHERE {key_join})
+'''
+
+## rows are compared by a hash of their text form, so types without a
+## strict equality operator, ie geometries, are compared by content
+differential_update_sql = '''
+UPDATE {table_name} AS t
+SET {set_columns}
+FROM {source} AS s
+WHERE {key_join}
+AND md5(ROW({target_columns})::text) <> md5(ROW({staging_columns})::text)
+'''
+
+differential_insert_sql = '''
+INSERT INTO {table_name} ({columns})
+SELECT {columns} FROM {source} AS s
+WHERE NOT EXISTS (SELECT 1 FROM {table_name} AS t WHERE {key_join})
+'''
+
+def get_differential_sql(db_schema, table_name, staging_table, primary_keys, columns, dedupe=True):
+    table_name = get_table_name(db_schema, table_name)
+    source = staging_table
+    if dedupe:
+        source = get_deduped_source(staging_table, primary_keys)
+    key_join = ' AND '.join(['t.{0} = s.{0}'.format(key) for key in primary_keys])
+    update_columns = [column for column in columns if column not in primary_keys]
+
+    delete_sql = differential_delete_sql.format(
+        table_name=table_name,
+        staging_table=staging_table,
+        key_join=key_join)
+
+    update_sql = None
+    if update_columns:
+        update_sql = differential_update_sql.format(
+            table_name=table_name,
+            source=source,
+            key_join=key_join,
+            set_columns=', '.join(['{0} = s.{0}'.format(column) for column in update_columns]),
+            target_columns=', '.join(['t.{}'.format(column) for column in update_columns]),
+            staging_columns=', '.join(['s.{}'.format(column) for column in update_columns]))
+
+    insert_sql = differential_insert_sql.format(
+        table_name=table_name,
+        source=source,
+        key_join=key_join,
+        columns=', '.join(columns))
+
+    return delete_sql, update_sql, insert_sql
+
+def differential_load(engine, db_schema, table_name, table_schema, rows, dedupe=True, allow_empty=False):
+    """Makes the table match the input while writing only the rows that differ.
+
+    Rows are COPY'd into a temporary table and matched to the table on the
+    `primaryKey`. Table rows missing from the input are deleted, rows whose
+    content hash differs are updated and new keys are inserted, all in one
+    transaction. Returns a tuple of the number of rows inserted, updated and
+    deleted.
+
+    Of rows sharing a primary key the last one wins, unless `dedupe` is
+    off, which fails the load instead. An empty input, ie from a failed
+    extract, would delete every row, so it fails the load unless
+    `allow_empty`.
+    """
+    primary_keys = get_primary_keys(table_schema, 'differential loads')
+    columns = list(map(lambda x: x['name'], table_schema['fields']))
+    staging_table = '{}_differential'.format(table_name)
+
+    delete_sql, update_sql, insert_sql = get_differential_sql(db_schema,
+                                                              table_name,
+                                                              staging_table,
+                                                              primary_keys,
+                                                              columns,
+                                                              dedupe=dedupe)
+
+    conn = engine.raw_connection()
+    with conn.cursor() as cur:
+        try:
+            num_rows = copy_to_staging(cur, db_schema, table_name, staging_table, table_schema, rows)
+            if num_rows == 0 and not allow_empty:
+                raise Exception('No input rows, a differential load would delete every row of `{}`. '.format(table_name) +\
+                                '`--allow-empty` loads an empty input')
+
+            with metrics.current.phase('merge'):
+                cur.execute('ANALYZE {}'.format(staging_table))
+                if not dedupe:
+                    check_duplicate_keys(cur, staging_table, primary_keys)
+
+                cur.execute(delete_sql)
+                deleted = cur.rowcount
+
+                updated = 0
+                if update_sql != None:
+                    cur.execute(update_sql)
+                    updated = cur.rowcount
+
+                cur.execute(insert_sql)
+                inserted = cur.rowcount
+
+            with metrics.current.phase('commit'):
+                conn.commit()
+        except:
+            conn.rollback()
+            raise
+    conn.close()
+
+    return inserted, updated, deleted
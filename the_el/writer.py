@@ -0,0 +1,180 @@
+import io
+import time
+import zlib
+import queue
+import threading
+
+from . import metrics
+
+compressions = ['gzip', 'zstd']
+
+chunk_size = 1024 * 1024
+
+class GzipCompressor(object):
+    def __init__(self, level=6):
+        ## wbits 31 writes a gzip header and trailer, readable by gunzip
+        self.compressobj = zlib.compressobj(level, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        return self.compressobj.compress(data)
+
+    def flush(self):
+        return self.compressobj.flush()
+
+def import_zstandard():
+    try:
+        import zstandard
+    except ImportError:
+        raise Exception('zstandard is required for zstd compression, `pip install the_el[zstd]`')
+    return zstandard
+
+def get_compressor(compression):
+    if compression == None:
+        return None
+    elif compression == 'gzip':
+        return GzipCompressor()
+    elif compression == 'zstd':
+        return import_zstandard().ZstdCompressor().compressobj()
+    raise Exception('Unsupported compression `{}`'.format(compression))
+
+## marks the end of the chunks in a queue
+end_of_chunks = object()
+
+class BackgroundWriter(io.RawIOBase):
+    """File-like object handing what is written to it to background threads, which compress and write it to `file`.
+
+    Writes are gathered into `chunk_size` chunks and passed along bounded
+    queues, so fetching and encoding rows overlaps with compression, and
+    compression with writing, ie a multipart upload to S3, while at most
+    `queue_size` chunks wait between stages. `str` is written as UTF-8.
+
+    Seconds each stage spends working, and blocked waiting on the stage
+    before or after it, are kept in `seconds` and recorded as phases.
+    """
+
+    def __init__(self, file, compression=None, queue_size=4):
+        self.file = file
+        self.buffer = bytearray()
+        self.num_bytes = 0
+        self.num_compressed_bytes = 0
+        self.errors = []
+        self.seconds = {}
+        self.seconds_lock = threading.Lock()
+        self.start_time = time.perf_counter()
+
+        self.write_queue = queue.Queue(maxsize=queue_size)
+        self.threads = [self.start_stage(self.write_chunks, self.write_queue)]
+
+        compressor = get_compressor(compression)
+        if compressor is not None:
+            self.input_queue = queue.Queue(maxsize=queue_size)
+            self.threads.append(self.start_stage(self.compress_chunks, self.input_queue, compressor))
+        else:
+            self.input_queue = self.write_queue
+
+    def start_stage(self, target, *args):
+        thread = threading.Thread(target=self.run_stage, args=(target,) + args)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def run_stage(self, target, input_queue, *args):
+        try:
+            target(input_queue, *args)
+        except Exception as e:
+            self.errors.append(e)
+            ## keep consuming so the stage before never blocks on a failed one
+            while input_queue.get() is not end_of_chunks:
+                pass
+
+    def add_seconds(self, name, seconds):
+        with self.seconds_lock:
+            self.seconds[name] = self.seconds.get(name, 0) + seconds
+
+    def get(self, name, input_queue):
+        start = time.perf_counter()
+        with metrics.current.phase(name + '_wait'):
+            chunk = input_queue.get()
+        self.add_seconds(name + '_wait', time.perf_counter() - start)
+        return chunk
+
+    def put(self, name, output_queue, chunk):
+        start = time.perf_counter()
+        with metrics.current.phase(name + '_wait'):
+            output_queue.put(chunk)
+        self.add_seconds(name + '_wait', time.perf_counter() - start)
+
+    def compress_chunks(self, input_queue, compressor):
+        try:
+            while True:
+                chunk = self.get('compress', input_queue)
+                if chunk is end_of_chunks:
+                    break
+                start = time.perf_counter()
+                with metrics.current.phase('compress'):
+                    chunk = compressor.compress(chunk)
+                self.add_seconds('compress', time.perf_counter() - start)
+                if chunk:
+                    self.put('compress', self.write_queue, chunk)
+            self.put('compress', self.write_queue, compressor.flush())
+        finally:
+            self.write_queue.put(end_of_chunks)
+
+    def write_chunks(self, input_queue):
+        while True:
+            chunk = self.get('upload', input_queue)
+            if chunk is end_of_chunks:
+                break
+            start = time.perf_counter()
+            with metrics.current.phase('upload'):
+                self.file.write(chunk)
+            self.add_seconds('upload', time.perf_counter() - start)
+            self.num_compressed_bytes += len(chunk)
+
+    def check_errors(self):
+        if self.errors:
+            raise self.errors[0]
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        self.buffer += data
+        self.num_bytes += len(data)
+        if len(self.buffer) >= chunk_size:
+            self.flush_buffer()
+        return len(data)
+
+    def flush_buffer(self):
+        self.check_errors()
+        self.put('output', self.input_queue, bytes(self.buffer))
+        self.buffer = bytearray()
+
+    def tell(self):
+        return self.num_bytes
+
+    def close(self):
+        if self.closed:
+            return
+        try:
+            if self.buffer:
+                self.flush_buffer()
+        finally:
+            self.input_queue.put(end_of_chunks)
+            for thread in self.threads:
+                thread.join()
+            super(BackgroundWriter, self).close()
+        self.check_errors()
+        metrics.current.count('output_bytes', self.num_bytes)
+        metrics.current.count('written_bytes', self.num_compressed_bytes)
+
+    def summary(self):
+        elapsed = time.perf_counter() - self.start_time
+        seconds = ' '.join(['{}: {:.3f}s'.format(name, value) for name, value in sorted(self.seconds.items())])
+        return 'Wrote {} bytes as {} at {:.1f} MB/s - {}'.format(
+            self.num_bytes,
+            self.num_compressed_bytes,
+            self.num_bytes / elapsed / (1024 * 1024) if elapsed > 0 else 0,
+            seconds)
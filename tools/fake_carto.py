@@ -0,0 +1,299 @@
+#!/usr/bin/env python
+"""Local stand-in for the Carto SQL API.
+
+Keeps a row count per table in memory and answers the statements the_el
+sends, including COPY uploads to the copyfrom endpoint, closely enough to
+exercise `carto.load` without a Carto account:
+
+    python tools/fake_carto.py --port 8080 --latency 0.05
+    CARTO_SQL_API_URL=http://localhost:8080/api/v2/sql/ the_el write ...
+"""
+
+import io
+import re
+import csv
+import json
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import click
+
+insert_regex = re.compile(r'^\s*INSERT INTO\s+"?([\w.]+)"?', re.IGNORECASE)
+count_regex = re.compile(r'^\s*SELECT count\(\*\) FROM\s+"?([\w.]+)"?', re.IGNORECASE)
+truncate_regex = re.compile(r'^\s*TRUNCATE TABLE\s+"?([\w.]+)"?', re.IGNORECASE)
+copy_regex = re.compile(r'^\s*COPY\s+"?([\w.]+)"?', re.IGNORECASE)
+copy_null_regex = re.compile(r"\bNULL\s+(E?)'((?:[^']|'')*)'", re.IGNORECASE)
+literal_regex = re.compile(r"^'((?:[^']|'')*)'(::\w+)?$", re.DOTALL)
+
+def count_values(statement):
+    """Counts the row tuples following VALUES in an INSERT statement."""
+    start = re.search(r'\bVALUES\b', statement, re.IGNORECASE).end()
+    depth = 0
+    in_string = False
+    num_rows = 0
+    for char in statement[start:]:
+        if char == "'":
+            in_string = not in_string # doubled quotes toggle twice, which nets out
+        elif in_string:
+            continue
+        elif char == '(':
+            if depth == 0:
+                num_rows += 1
+            depth += 1
+        elif char == ')':
+            depth -= 1
+    return num_rows
+
+def decode_literal(token):
+    """Decodes a value of an INSERT tuple to the text Postgres would store, None for null."""
+    token = token.strip()
+    if token.lower() == 'null':
+        return None
+    match = literal_regex.match(token)
+    if match:
+        return match.group(1).replace("''", "'")
+    return token
+
+def parse_values(statement):
+    """Parses the row tuples following VALUES in an INSERT statement into decoded values."""
+    start = re.search(r'\bVALUES\b', statement, re.IGNORECASE).end()
+    depth = 0
+    in_string = False
+    rows = []
+    token = ''
+    for char in statement[start:]:
+        if char == "'":
+            in_string = not in_string
+        elif in_string:
+            pass
+        elif char == '(':
+            depth += 1
+            if depth == 1:
+                row = []
+                token = ''
+                continue
+        elif char == ')':
+            depth -= 1
+            if depth == 0:
+                row.append(decode_literal(token))
+                rows.append(row)
+                continue
+        elif char == ',' and depth == 1:
+            row.append(decode_literal(token))
+            token = ''
+            continue
+        if depth > 0:
+            token += char
+    return rows
+
+def get_copy_null(statement):
+    match = copy_null_regex.search(statement)
+    if not match:
+        return '' ## Postgres' default for CSV, an unquoted empty value
+    null = match.group(2).replace("''", "'")
+    if match.group(1):
+        null = null.replace('\\\\', '\\')
+    return null
+
+def parse_copy_csv(data, null):
+    """Parses COPY CSV as Postgres does: unquoted values matching `null` are None, quoted ones never are."""
+    rows = []
+    row = []
+    value = ''
+    quoted = False
+    in_quotes = False
+    i = 0
+    while i < len(data):
+        char = data[i]
+        if in_quotes:
+            if char == '"':
+                if data[i + 1:i + 2] == '"':
+                    value += '"'
+                    i += 1
+                else:
+                    in_quotes = False
+            else:
+                value += char
+        elif char == '"':
+            in_quotes = True
+            quoted = True
+        elif char in ',\n' or data[i:i + 2] == '\r\n':
+            row.append(value if quoted or value != null else None)
+            value = ''
+            quoted = False
+            if char != ',':
+                rows.append(row)
+                row = []
+                if char == '\r':
+                    i += 1
+        else:
+            value += char
+        i += 1
+    if value or quoted or row:
+        row.append(value if quoted or value != null else None)
+        rows.append(row)
+    return rows
+
+class FakeCartoError(Exception):
+    pass
+
+class FakeCarto(object):
+    """Carto SQL API state. INSERTs numbered in `fail_inserts`, counting from 1, fail with HTTP 500.
+
+    With `keep_rows`, the rows inserted or COPY'd into each table are kept
+    in `rows` as the text Postgres would store, None for null.
+    """
+
+    def __init__(self, latency=0, fail_inserts=None, keep_rows=False):
+        self.latency = latency
+        self.fail_inserts = set(fail_inserts or [])
+        self.keep_rows = keep_rows
+        self.num_inserts = 0
+        self.tables = {}
+        self.rows = {}
+        self.statements = []
+        self.lock = threading.Lock()
+
+    def add_rows(self, table_name, num_rows, rows=None):
+        with self.lock:
+            self.tables[table_name] = self.tables.get(table_name, 0) + num_rows
+            if rows is not None:
+                self.rows.setdefault(table_name, []).extend(rows)
+
+    def execute(self, statement):
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.statements.append(statement)
+
+        match = insert_regex.match(statement)
+        if match:
+            with self.lock:
+                self.num_inserts += 1
+                num_insert = self.num_inserts
+            if num_insert in self.fail_inserts:
+                raise FakeCartoError('INSERT {} failed'.format(num_insert))
+            if self.keep_rows:
+                rows = parse_values(statement)
+                self.add_rows(match.group(1), len(rows), rows)
+                return {'rows': [], 'total_rows': len(rows)}
+            num_rows = count_values(statement)
+            self.add_rows(match.group(1), num_rows)
+            return {'rows': [], 'total_rows': num_rows}
+
+        match = count_regex.match(statement)
+        if match:
+            count = self.tables.get(match.group(1), 0)
+            return {'rows': [{'count': count}], 'total_rows': 1}
+
+        match = truncate_regex.match(statement)
+        if match:
+            with self.lock:
+                self.tables[match.group(1)] = 0
+                self.rows.pop(match.group(1), None)
+            return {'rows': [], 'total_rows': 0}
+
+        if 'SELECT EXISTS' in statement:
+            return {'rows': [{'exists': True}], 'total_rows': 1}
+
+        return {'rows': [], 'total_rows': 0}
+
+    def copy_from(self, statement, data):
+        if self.latency:
+            time.sleep(self.latency)
+
+        with self.lock:
+            self.statements.append(statement)
+
+        match = copy_regex.match(statement)
+        if not match:
+            return None
+        if self.keep_rows:
+            rows = parse_copy_csv(data.decode('utf-8'), get_copy_null(statement))
+            self.add_rows(match.group(1), len(rows), rows)
+            return {'time': self.latency, 'total_rows': len(rows)}
+        num_rows = sum(1 for row in csv.reader(io.StringIO(data.decode('utf-8'))))
+        self.add_rows(match.group(1), num_rows)
+        return {'time': self.latency, 'total_rows': num_rows}
+
+def make_handler(carto):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def read_body(self):
+            if self.headers.get('Transfer-Encoding', '').lower() != 'chunked':
+                return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+            body = bytearray()
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip(), 16)
+                if size == 0:
+                    self.rfile.readline()
+                    return bytes(body)
+                body += self.rfile.read(size)
+                self.rfile.readline()
+
+        def do_POST(self):
+            url = urlparse(self.path)
+            if url.path.endswith('/copyfrom'):
+                query = parse_qs(url.query)
+                result = carto.copy_from(query.get('q', [''])[0], self.read_body())
+                if result is None:
+                    return self.send_json(400, {'error': ['expected a COPY ... FROM STDIN statement']})
+                return self.send_json(200, result)
+
+            length = int(self.headers.get('Content-Length', 0))
+            form = parse_qs(self.rfile.read(length).decode('utf-8'))
+            if 'q' not in form:
+                return self.send_json(400, {'error': ['missing q']})
+            try:
+                result = carto.execute(form['q'][0])
+            except FakeCartoError as e:
+                return self.send_json(500, {'error': [str(e)]})
+            self.send_json(200, result)
+
+    return Handler
+
+def serve(port=0, latency=0, fail_inserts=None, keep_rows=False):
+    """Starts a fake Carto server in a background thread.
+
+    Returns the server, its `FakeCarto` state and the SQL API URL to use
+    as `CARTO_SQL_API_URL`.
+    """
+    carto = FakeCarto(latency=latency, fail_inserts=fail_inserts, keep_rows=keep_rows)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(carto))
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    url = 'http://127.0.0.1:{}/api/v2/sql/'.format(server.server_address[1])
+    return server, carto, url
+
+@click.command()
+@click.option('--port', type=int, default=8080)
+@click.option('--latency', type=float, default=0, help='Seconds to wait before answering each statement')
+def main(port, latency):
+    server, carto, url = serve(port=port, latency=latency)
+    click.echo('Fake Carto SQL API listening at {}'.format(url))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == '__main__':
+    main()